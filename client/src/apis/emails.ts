@@ -1,5 +1,5 @@
 import { BaseApiService } from './base';
-import type { FetchEmailsParams, FetchEmailsResponse } from './types';
+import type { FetchEmailsParams, FetchEmailsResponse, FetchJob } from './types';
 
 export class EmailService extends BaseApiService {
   async fetchEmails(params: FetchEmailsParams): Promise<FetchEmailsResponse> {
@@ -20,5 +20,33 @@ export class EmailService extends BaseApiService {
 
     return this.handleResponse<FetchEmailsResponse>(response, 'Failed to fetch emails');
   }
-}
 
+  async startFetchEmailsJob(params: FetchEmailsParams): Promise<{ job_id: number; status: string }> {
+    const queryParams = new URLSearchParams();
+
+    if (params.provider) queryParams.append('provider', params.provider);
+    if (params.window) queryParams.append('window', params.window);
+    if (params.max) queryParams.append('max', params.max.toString());
+    if (params.since) queryParams.append('since', params.since);
+    if (params.q) queryParams.append('q', params.q);
+    if (params.timezone) queryParams.append('timezone', params.timezone);
+    queryParams.append('async', 'true');
+
+    const response = await fetch(`${this.baseUrl}/fetch-emails?${queryParams}`, {
+      method: 'POST',
+      credentials: 'include',
+      headers: this.getHeaders(),
+    });
+
+    return this.handleResponse<{ job_id: number; status: string }>(response, 'Failed to start fetch job');
+  }
+
+  async getJob(jobId: number): Promise<FetchJob> {
+    const response = await fetch(`${this.baseUrl}/jobs/${jobId}`, {
+      credentials: 'include',
+      headers: this.getHeaders(),
+    });
+
+    return this.handleResponse<FetchJob>(response, 'Failed to fetch job status');
+  }
+}
@@ -41,6 +41,7 @@ export type CalendarEvent = {
 export type FetchEmailsResponse = {
   processed: number;
   query: string;
+  sync_mode?: 'full' | 'incremental';
   created: Array<{
     message_id: string;
     provider: string;
@@ -56,6 +57,15 @@ export type FetchEmailsResponse = {
   }>;
   total_found: number;
   already_processed: number;
+  skipped_known?: number;
+  remaining?: number;
+  fetch_errors?: number;
+  triage_skipped?: Record<string, number>;
+  triage_bytes_saved?: number;
+  errors?: Array<{
+    message_id: string;
+    error?: string;
+  }>;
   considered: number;
   calendar_events?: Array<{
     summary: string;
@@ -65,6 +75,20 @@ export type FetchEmailsResponse = {
   }>;
 };
 
+export type FetchJob = {
+  id: number;
+  status: 'queued' | 'running' | 'completed' | 'failed';
+  considered: number;
+  created: number;
+  skipped: number;
+  errors: number;
+  result?: FetchEmailsResponse | null;
+  error?: string | null;
+  created_at?: string | null;
+  started_at?: string | null;
+  finished_at?: string | null;
+};
+
 export type Settings = {
   max?: number;
   window: string;
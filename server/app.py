@@ -14,7 +14,8 @@ if str(project_root) not in sys.path:
 
 from server.config import FLASK_SECRET
 from server.db import init_db
-from server.routers import auth, tasks, calendar, emails, settings
+from server.jobs import fail_stale_jobs
+from server.routers import auth, tasks, calendar, emails, settings, jobs
 
 # Configure logging
 log_dir = Path(project_root) / "logs"
@@ -56,12 +57,16 @@ app.register_blueprint(tasks.tasks_bp)
 app.register_blueprint(calendar.calendar_bp)
 app.register_blueprint(emails.emails_bp)
 app.register_blueprint(settings.settings_bp)
+app.register_blueprint(jobs.jobs_bp)
 
 # Ensure DB tables exist at startup
 logger.info("Initializing database...")
 init_db()
 logger.info("Database initialized successfully")
 
+# Jobs left queued/running by a process that no longer exists will never finish
+fail_stale_jobs()
+
 @app.route('/')
 def index():
     return "Hello, World!"
@@ -0,0 +1,314 @@
+"""
+Offline classification of large historical imports through the OpenAI Batch API.
+
+Backfills don't need interactive latency, so instead of one chat request per
+email (full price) the classification requests are written to a JSONL file,
+submitted as one batch (half price, completed within 24h), and the answers
+are applied afterwards exactly as the fetch pipeline would: with
+auto_generate on, tasks and calendar events are created; otherwise they are
+stored as pending for review.
+
+Each backfill lives in a work directory:
+    manifest.json    user, provider, model, query, batch and file ids, status
+    payloads.jsonl   the parsed messages (subject, sender, body, ...)
+    requests.jsonl   Batch API input, one /v1/chat/completions request per message
+    results.jsonl    Batch API output, downloaded once the batch finishes
+
+Usage:
+    python -m server.backfill prepare --user you@example.com --window 365d --dir backfills/2025
+    python -m server.backfill submit --dir backfills/2025 [--base-url http://localhost:8000/v1]
+    python -m server.backfill wait --dir backfills/2025 [--interval 60]
+    python -m server.backfill apply --dir backfills/2025
+    python -m server.backfill run --user you@example.com --window 365d --dir backfills/2025   # all four
+
+Messages with no usable answer are left unprocessed, so the next regular
+fetch picks them up.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict
+from sqlalchemy import select
+from server.config import DEFAULT_PROVIDER, OPENAI_BATCH_BASE_URL
+from server.db import db_session, init_db, User
+from server.gmail import batch_get_messages, gmail_list_ids
+from server.mime import ParsedMessage, message_to_payload
+from server.ml import batch_request_line, classification_from_content, get_openai_client
+from server.pipeline import (
+    FetchRun, apply_classification, build_gmail_query, known_message_ids, load_user_preferences,
+    message_ids_with_tasks, parse_since_to_utc,
+)
+from server.utils import get_thread_service, load_stored_credentials
+
+logger = logging.getLogger(__name__)
+
+# Batch statuses after which nothing more will happen
+TERMINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# newer_than window listed when neither --window nor --query is given
+DEFAULT_WINDOW = "365d"
+
+
+def _load_manifest(workdir: Path) -> Dict[str, Any]:
+    return json.loads((workdir / "manifest.json").read_text())
+
+
+def _save_manifest(workdir: Path, manifest: Dict[str, Any]):
+    (workdir / "manifest.json").write_text(json.dumps(manifest, indent=2))
+
+
+def _read_jsonl(path: Path) -> list[dict]:
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def _client(api_key: str | None = None, base_url: str | None = OPENAI_BATCH_BASE_URL):
+    kwargs: Dict[str, Any] = {"api_key": api_key or os.getenv("OPENAI_API_KEY")}
+    if base_url:
+        kwargs["base_url"] = base_url
+    return get_openai_client(**kwargs)
+
+
+def prepare(
+    user_id: int,
+    credentials,
+    workdir: Path,
+    provider: str = DEFAULT_PROVIDER,
+    window: str | None = None,
+    custom_query: str | None = None,
+    since_dt: datetime | None = None,
+    max_msgs: int | None = None,
+) -> Dict[str, Any]:
+    """Fetch and parse the user's unprocessed messages and write the Batch API input."""
+    workdir.mkdir(parents=True, exist_ok=True)
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    service = get_thread_service("gmail", "v1", credentials)
+    query = build_gmail_query(custom_query, window, since_dt)
+    ids = gmail_list_ids(service, q=query, max_list=max_msgs, user_key=user_id)
+    with db_session() as s:
+        known = known_message_ids(s, user_id, ids)
+    pending_ids = [message_id for message_id in ids if message_id not in known]
+    logger.info(f"Backfill found {len(ids)} email(s), {len(known)} already processed, {len(pending_ids)} to classify")
+
+    _, task_categories, calendar_categories = load_user_preferences(user_id)
+    since_ms = int(since_dt.timestamp() * 1000) if since_dt else None
+    written = fetch_errors = 0
+    with open(workdir / "payloads.jsonl", "w") as payloads_file, open(workdir / "requests.jsonl", "w") as requests_file:
+        for message_id, message, error in batch_get_messages(service, pending_ids, format="full", user_key=user_id):
+            if error is not None:
+                logger.error(f"Email fetch FAILED - ID: {message_id} | Error: {str(error)}")
+                fetch_errors += 1
+                continue
+            if since_ms is not None and int(message.get("internalDate", 0)) < since_ms:
+                continue
+            payload = message_to_payload(message)
+            payloads_file.write(json.dumps({field: payload.get(field) for field in ParsedMessage.__slots__}) + "\n")
+            requests_file.write(json.dumps(batch_request_line(message_id, payload, model, task_categories, calendar_categories)) + "\n")
+            written += 1
+
+    manifest = {
+        "user_id": user_id,
+        "provider": provider,
+        "model": model,
+        "query": query,
+        "requests": written,
+        "fetch_errors": fetch_errors,
+        "status": "prepared",
+        "prepared_at": datetime.now(timezone.utc).isoformat(),
+    }
+    _save_manifest(workdir, manifest)
+    logger.info(f"Backfill prepared - Requests: {written} | Dir: {workdir}")
+    return manifest
+
+
+def submit(workdir: Path, api_key: str | None = None, base_url: str | None = OPENAI_BATCH_BASE_URL) -> Dict[str, Any]:
+    """Upload requests.jsonl and start the batch."""
+    manifest = _load_manifest(workdir)
+    if manifest.get("batch_id"):
+        raise RuntimeError(f"Backfill already submitted as batch {manifest['batch_id']}")
+    if not manifest["requests"]:
+        manifest["status"] = "completed"
+        _save_manifest(workdir, manifest)
+        return manifest
+
+    client = _client(api_key, base_url)
+    input_file = client.files.create(file=("requests.jsonl", (workdir / "requests.jsonl").read_bytes()), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"source": "taskflow-backfill", "user_id": str(manifest["user_id"])},
+    )
+    manifest.update({"input_file_id": input_file.id, "batch_id": batch.id, "status": batch.status, "base_url": base_url})
+    _save_manifest(workdir, manifest)
+    logger.info(f"Backfill submitted - Batch: {batch.id} | Requests: {manifest['requests']}")
+    return manifest
+
+
+def wait(
+    workdir: Path,
+    interval: float = 60.0,
+    timeout: float | None = None,
+    api_key: str | None = None,
+    base_url: str | None = None,
+) -> Dict[str, Any]:
+    """Poll the batch until it finishes, then download its output (and error) lines to results.jsonl."""
+    manifest = _load_manifest(workdir)
+    if not manifest.get("batch_id"):
+        return manifest
+    client = _client(api_key, base_url or manifest.get("base_url"))
+    deadline = time.monotonic() + timeout if timeout else None
+    while True:
+        batch = client.batches.retrieve(manifest["batch_id"])
+        counts = getattr(batch, "request_counts", None)
+        logger.info(
+            f"Backfill batch {batch.id} - Status: {batch.status} | "
+            f"Done: {getattr(counts, 'completed', '?')}/{getattr(counts, 'total', '?')} | Failed: {getattr(counts, 'failed', '?')}"
+        )
+        if batch.status in TERMINAL_STATUSES:
+            break
+        if deadline is not None and time.monotonic() >= deadline:
+            manifest["status"] = batch.status
+            _save_manifest(workdir, manifest)
+            return manifest
+        time.sleep(interval)
+
+    # Expired and cancelled batches still return the requests that finished
+    lines = []
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if file_id:
+            lines.extend(line for line in client.files.content(file_id).text.splitlines() if line.strip())
+    (workdir / "results.jsonl").write_text("".join(line + "\n" for line in lines))
+    manifest.update({"status": batch.status, "output_file_id": batch.output_file_id, "error_file_id": batch.error_file_id})
+    _save_manifest(workdir, manifest)
+    return manifest
+
+
+def _answer_content(line: dict) -> str | None:
+    """The model's message text from a Batch API output line, or None if the request failed."""
+    response = line.get("response") or {}
+    if line.get("error") or response.get("status_code") != 200:
+        return None
+    try:
+        return response["body"]["choices"][0]["message"]["content"]
+    except (KeyError, IndexError, TypeError):
+        return None
+
+
+def apply(workdir: Path, credentials) -> Dict[str, int]:
+    """Store the batch answers and create tasks/events with the user's auto_generate setting."""
+    manifest = _load_manifest(workdir)
+    user_id = manifest["user_id"]
+    answers = {line.get("custom_id"): _answer_content(line) for line in _read_jsonl(workdir / "results.jsonl")}
+    payloads = [ParsedMessage(**fields) for fields in _read_jsonl(workdir / "payloads.jsonl")]
+
+    auto_generate, task_categories, calendar_categories = load_user_preferences(user_id)
+    run = FetchRun(
+        user_id=user_id,
+        credentials=credentials,
+        provider=manifest["provider"],
+        auto_generate=auto_generate,
+        task_categories=task_categories,
+        calendar_categories=calendar_categories,
+    )
+    message_ids = [payload.message_id for payload in payloads]
+    with db_session() as s:
+        known = known_message_ids(s, user_id, message_ids)
+        run.existing_task_ids = message_ids_with_tasks(s, user_id, message_ids, run.provider)
+
+    counts = {"created": 0, "pending": 0, "skipped": 0, "already_processed": 0, "unanswered": 0, "error": 0}
+    with db_session() as s:
+        for payload in payloads:
+            message_id = payload.message_id
+            if message_id in known:
+                counts["already_processed"] += 1
+                continue
+            content = answers.get(message_id)
+            try:
+                ml_result = classification_from_content(content, payload) if content else None
+            except ValueError as e:
+                logger.error(f"Backfill answer unusable - ID: {message_id} | Error: {str(e)}")
+                ml_result = None
+            if ml_result is None:
+                counts["unanswered"] += 1
+                continue
+            try:
+                record = apply_classification(s, run, message_id, payload, ml_result)
+                s.commit()
+            except Exception as e:
+                s.rollback()
+                logger.error(f"Saving email FAILED - ID: {message_id} | Error: {str(e)}")
+                record = {"status": "error"}
+            counts[record["status"]] = counts.get(record["status"], 0) + 1
+
+    manifest.update({"status": "applied", "applied": counts, "applied_at": datetime.now(timezone.utc).isoformat()})
+    _save_manifest(workdir, manifest)
+    logger.info(f"Backfill applied - {counts}")
+    return counts
+
+
+def _resolve_user(email: str) -> tuple[int, Any]:
+    with db_session() as s:
+        user = s.execute(select(User).where(User.email == email)).scalar_one_or_none()
+        user_id = user.id if user else None
+    if user_id is None:
+        sys.exit(f"No user {email}; they need to log in once first")
+    credentials = load_stored_credentials(user_id)
+    if credentials is None:
+        sys.exit(f"No usable stored credentials for {email}; they need to log in again")
+    return user_id, credentials
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Classify a historical import through the OpenAI Batch API.")
+    parser.add_argument("command", choices=["prepare", "submit", "wait", "apply", "run"])
+    parser.add_argument("--dir", required=True, type=Path, help="work directory for this backfill")
+    parser.add_argument("--user", help="user email (prepare, apply, run)")
+    parser.add_argument("--provider", default=DEFAULT_PROVIDER)
+    parser.add_argument("--window", help=f"Gmail newer_than window, e.g. 365d (default {DEFAULT_WINDOW} unless --query is given)")
+    parser.add_argument("--query", help="Gmail search query; no window is added unless --window is given too")
+    parser.add_argument("--since", help="ISO timestamp cutoff")
+    parser.add_argument("--max", type=int, default=None, help="cap on messages listed")
+    parser.add_argument("--base-url", default=OPENAI_BATCH_BASE_URL, help="OpenAI-compatible endpoint")
+    parser.add_argument("--interval", type=float, default=60.0, help="seconds between batch status polls")
+    parser.add_argument("--timeout", type=float, default=None, help="stop waiting after this many seconds")
+    args = parser.parse_args(argv)
+    window = args.window or (None if args.query else DEFAULT_WINDOW)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    init_db()
+    if args.command in ("prepare", "apply", "run"):
+        if not args.user:
+            parser.error(f"{args.command} needs --user")
+        user_id, credentials = _resolve_user(args.user)
+
+    if args.command in ("prepare", "run"):
+        prepare(
+            user_id, credentials, args.dir, provider=args.provider, window=window,
+            custom_query=args.query, since_dt=parse_since_to_utc(args.since), max_msgs=args.max,
+        )
+    if args.command in ("submit", "run"):
+        submit(args.dir, base_url=args.base_url)
+    if args.command in ("wait", "run"):
+        manifest = wait(args.dir, interval=args.interval, timeout=args.timeout, base_url=args.base_url)
+        if manifest["status"] not in TERMINAL_STATUSES:
+            print(json.dumps(manifest, indent=2))
+            return
+    if args.command in ("apply", "run"):
+        apply(args.dir, credentials)
+    print(json.dumps(_load_manifest(args.dir), indent=2))
+
+
+if __name__ == "__main__":
+    main()
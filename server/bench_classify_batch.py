@@ -0,0 +1,122 @@
+"""
+Tokens and latency of per-email classification vs batched classification
+(several emails per OpenAI request, see ml.classify_batch).
+
+Usage:
+    python -m server.bench_classify_batch [--synthetic 40] [--batch-size 8] [--llm-latency-ms 800] [--live]
+
+The corpus is server/test_ml.py's samples plus --synthetic messages from the
+emulator's synthetic mailbox. By default requests go to the emulated OpenAI
+backend (token counts are estimated from prompt length); --live sends them
+to the real API with OPENAI_API_KEY and reports the usage it returns.
+"""
+
+from __future__ import annotations
+import argparse
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+from server import ml
+from server.emulator import EmulatorConfig, FakeOpenAI, FaultInjector, SyntheticMailbox
+from server.mime import message_to_payload
+
+
+class UsageRecorder:
+    """Wraps a chat client and records latency and token usage per request."""
+
+    def __init__(self, client):
+        self._client = client
+        self.calls: list[tuple[float, int, int, int]] = []
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **kwargs):
+        started = time.perf_counter()
+        response = self._client.chat.completions.create(**kwargs)
+        usage = getattr(response, "usage", None)
+        details = getattr(usage, "prompt_tokens_details", None)
+        self.calls.append((
+            time.perf_counter() - started,
+            getattr(usage, "prompt_tokens", 0) or 0,
+            getattr(usage, "completion_tokens", 0) or 0,
+            getattr(details, "cached_tokens", 0) or 0,
+        ))
+        return response
+
+
+def load_corpus(synthetic: int) -> list[dict]:
+    from server.test_ml import test_emails
+    corpus = [dict(sample["payload"]) for sample in test_emails]
+    if synthetic:
+        mailbox = SyntheticMailbox(EmulatorConfig(messages=synthetic, mime="random", html_kb=8))
+        corpus.extend(message_to_payload(message) for message in mailbox.messages.values())
+    return corpus
+
+
+def run(label: str, recorder: UsageRecorder, classify) -> dict:
+    recorder.calls.clear()
+    started = time.perf_counter()
+    results = classify()
+    wall = time.perf_counter() - started
+    latencies = [c[0] for c in recorder.calls]
+    return {
+        "label": label,
+        "requests": len(recorder.calls),
+        "prompt_tokens": sum(c[1] for c in recorder.calls),
+        "completion_tokens": sum(c[2] for c in recorder.calls),
+        "cached_tokens": sum(c[3] for c in recorder.calls),
+        "wall_seconds": wall,
+        "request_p50": statistics.median(latencies) if latencies else 0.0,
+        "fallbacks": sum(1 for r in results if r.get("fallback")),
+        "decisions": [bool(r.get("should_create")) for r in results],
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--synthetic", type=int, default=40, help="synthetic emails added to the test_ml samples")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--token-budget", type=int, default=ml.CLASSIFY_BATCH_TOKENS)
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="emulated per-request latency")
+    parser.add_argument("--live", action="store_true", help="call the real OpenAI API")
+    args = parser.parse_args(argv)
+
+    if args.live:
+        api_key = os.getenv("OPENAI_API_KEY")
+        if not ml.OPENAI_AVAILABLE or not api_key:
+            sys.exit("--live needs the openai package and OPENAI_API_KEY")
+        from openai import OpenAI
+        recorder = UsageRecorder(OpenAI(api_key=api_key))
+    else:
+        api_key = "emulator"
+        recorder = UsageRecorder(FakeOpenAI(FaultInjector(EmulatorConfig()), llm_latency_ms=args.llm_latency_ms))
+    ml.set_openai_client_factory(lambda **kwargs: recorder)
+
+    corpus = load_corpus(args.synthetic)
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    try:
+        single = run("per-email", recorder, lambda: [ml.classify_and_generate_task(p, api_key=api_key, model=model) for p in corpus])
+        batched = run(
+            f"batch of {args.batch_size}", recorder,
+            lambda: ml.classify_batch(corpus, api_key=api_key, model=model, token_budget=args.token_budget, max_batch=args.batch_size),
+        )
+    finally:
+        ml.set_openai_client_factory(None)
+
+    print(f"{len(corpus)} emails, model {model}{'' if args.live else ' (emulated)'}\n")
+    print(f"{'':<14} {'requests':>9} {'prompt tok':>11} {'cached tok':>11} {'compl tok':>10} {'wall s':>8} {'req p50 s':>10} {'fallbacks':>10}")
+    for r in (single, batched):
+        print(
+            f"{r['label']:<14} {r['requests']:>9} {r['prompt_tokens']:>11} {r['cached_tokens']:>11} {r['completion_tokens']:>10} "
+            f"{r['wall_seconds']:>8.2f} {r['request_p50']:>10.2f} {r['fallbacks']:>10}"
+        )
+    if single["prompt_tokens"]:
+        saved = 1 - batched["prompt_tokens"] / single["prompt_tokens"]
+        print(f"\nprompt tokens saved: {saved:.0%}")
+    agree = sum(a == b for a, b in zip(single["decisions"], batched["decisions"]))
+    print(f"should_create agreement: {agree}/{len(corpus)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+Per-message CPU of HTML -> text extraction: the previous BeautifulSoup path
+vs server.html_text.
+
+The baseline is the path an HTML-only message took before: utils.html_to_text
+(BeautifulSoup) for the stored body, then ml.clean_html_to_text (a second
+BeautifulSoup parse plus tree edits) in prepare_email_content whenever that
+body came out empty. "both passes" is the cost when the second pass runs.
+"now" is the same path today: server.html_text, with clean_html_to_text
+delegating to it.
+
+Usage:
+    python -m server.bench_html_text [CORPUS_DIR] [--repeat 3]
+
+CORPUS_DIR may hold .html files or raw .eml messages (the first text/html part
+is used). Without it, a synthetic corpus from server.emulator is used; export a
+few real newsletters/receipts to get numbers that mean something.
+"""
+
+from __future__ import annotations
+import argparse
+import base64
+import email
+import email.policy
+import re
+import statistics
+import sys
+import time
+from pathlib import Path
+from server.html_text import html_to_text
+from server.ml import clean_html_to_text
+
+try:
+    from bs4 import BeautifulSoup
+    BS4_AVAILABLE = True
+except ImportError:
+    BS4_AVAILABLE = False
+
+
+def legacy_html_to_text(html: str) -> str:
+    """The pre-lxml utils.html_to_text (first pass: the stored body)."""
+    if not html:
+        return ""
+    soup = BeautifulSoup(html, "lxml")
+    for br in soup.find_all("br"):
+        br.replace_with("\n")
+    return soup.get_text("\n").strip()
+
+
+def legacy_clean_html_to_text(html: str) -> str:
+    """The pre-lxml ml.clean_html_to_text (second pass: the prompt body)."""
+    if not html or not html.strip():
+        return ""
+    soup = BeautifulSoup(html, "lxml")
+    for element in soup(["script", "style", "meta", "link"]):
+        element.decompose()
+    for br in soup.find_all("br"):
+        br.replace_with("\n")
+    for p in soup.find_all("p"):
+        p.insert_after("\n")
+    for div in soup.find_all("div"):
+        div.insert_after("\n")
+    text = soup.get_text("\n")
+    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
+    lines = [line.strip() for line in text.split('\n')]
+    text = '\n'.join(line for line in lines if line)
+    return text.strip()
+
+
+def legacy_extract(html: str) -> str:
+    """What message_to_payload + prepare_email_content did with an HTML-only body."""
+    return legacy_html_to_text(html) or legacy_clean_html_to_text(html)
+
+
+def legacy_both_passes(html: str) -> str:
+    legacy_html_to_text(html)
+    return legacy_clean_html_to_text(html)
+
+
+def current_extract(html: str) -> str:
+    """The same path today."""
+    return html_to_text(html) or clean_html_to_text(html)
+
+
+def load_corpus(directory: str | None) -> list[tuple[str, str]]:
+    if not directory:
+        from server.emulator import EmulatorConfig, SyntheticMailbox, _html_body
+        corpus = [(f"synthetic-{kb}kb", _html_body("Please review the attached report by Friday.", kb)) for kb in (2, 8, 32, 128, 512)]
+        mailbox = SyntheticMailbox(EmulatorConfig(messages=20, mime="html", html_kb=16))
+        for message in mailbox.messages.values():
+            corpus.append((message["id"], base64.urlsafe_b64decode(message["payload"]["body"]["data"]).decode("utf-8")))
+        return corpus
+
+    corpus = []
+    for path in sorted(Path(directory).iterdir()):
+        if path.suffix.lower() in (".html", ".htm"):
+            corpus.append((path.name, path.read_text(errors="replace")))
+        elif path.suffix.lower() == ".eml":
+            msg = email.message_from_bytes(path.read_bytes(), policy=email.policy.default)
+            part = msg.get_body(preferencelist=("html",))
+            if part is not None:
+                corpus.append((path.name, part.get_content()))
+    return corpus
+
+
+def measure(fn, html: str, repeat: int) -> float:
+    """Best-of-repeat CPU milliseconds for one extraction."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.process_time()
+        fn(html)
+        best = min(best, time.process_time() - started)
+    return best * 1000
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("corpus", nargs="?", help="directory of .html/.eml files")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if not BS4_AVAILABLE:
+        sys.exit("beautifulsoup4 is needed for the baseline: pip install beautifulsoup4")
+
+    corpus = load_corpus(args.corpus)
+    if not corpus:
+        sys.exit("No HTML found in corpus")
+
+    legacy_ms, both_ms, new_ms = [], [], []
+    second_passes = 0
+    print(f"{'message':<28} {'KB':>7} {'before ms':>10} {'both ms':>9} {'now ms':>8} {'speedup':>8}")
+    for name, html in corpus:
+        second_passes += not legacy_html_to_text(html)
+        old = measure(legacy_extract, html, args.repeat)
+        both = measure(legacy_both_passes, html, args.repeat)
+        new = measure(current_extract, html, args.repeat)
+        legacy_ms.append(old)
+        both_ms.append(both)
+        new_ms.append(new)
+        print(f"{name[:28]:<28} {len(html.encode('utf-8')) / 1024:>7.1f} {old:>10.2f} {both:>9.2f} {new:>8.2f} {old / new if new else 0:>7.1f}x")
+
+    print()
+    for label, values in (("bs4 (before)", legacy_ms), ("bs4 both passes", both_ms), ("lxml (now)", new_ms)):
+        ordered = sorted(values)
+        p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+        print(f"{label:<16} mean {statistics.mean(values):8.2f} ms  p50 {statistics.median(values):8.2f} ms  p95 {p95:8.2f} ms")
+    print(f"second pass ran for {second_passes} of {len(corpus)} message(s) before")
+    print(f"total speedup  {sum(legacy_ms) / sum(new_ms):.1f}x vs the path as it ran, {sum(both_ms) / sum(new_ms):.1f}x when both passes run")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Content-addressed, compressed storage for email bodies.
+
+Bodies are normalized, keyed by the SHA-256 of the normalized text and
+stored once in email_bodies (zstd when the zstandard package is installed,
+zlib otherwise) with a reference count. Emails point at them through
+Email.body_sha256; the compressed bytes are a deferred column, so list
+queries never touch the blob table.
+
+Usage:
+    python -m server.bodies [--migrate] [--vacuum]   # print the storage report
+"""
+
+from __future__ import annotations
+import argparse
+import hashlib
+import json
+import logging
+import unicodedata
+import zlib
+from typing import Any, Dict
+from sqlalchemy import delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from server.db import db_session, engine, Email, EmailBody
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ZSTD_LEVEL = 9
+ZLIB_LEVEL = 6
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+# Legacy rows moved per transaction by migrate_legacy_bodies
+MIGRATION_BATCH = 500
+
+
+def normalize_body(body: str) -> str:
+    """Canonical form that is hashed and stored: NFC, LF line endings, no trailing spaces."""
+    body = unicodedata.normalize("NFC", body).replace("\r\n", "\n").replace("\r", "\n")
+    return "\n".join(line.rstrip() for line in body.split("\n")).strip()
+
+
+def body_digest(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def compress_body(normalized: str) -> tuple[str, bytes]:
+    raw = normalized.encode("utf-8")
+    if ZSTD_AVAILABLE:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(raw)
+    return "zlib", zlib.compress(raw, ZLIB_LEVEL)
+
+
+def decompress_body(data: bytes) -> str:
+    # zstd frames are recognisable by their magic number; everything else is zlib
+    if data[:4] == ZSTD_MAGIC:
+        if not ZSTD_AVAILABLE:
+            raise RuntimeError("Email body is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data).decode("utf-8")
+    return zlib.decompress(data).decode("utf-8")
+
+
+def attach_body(session: Session, email_row: Email, body: str | None):
+    """Point email_row at the shared blob for body, storing it (or bumping its refcount)."""
+    if email_row.body_sha256:
+        release_body(session, email_row)
+    normalized = normalize_body(body or "")
+    if not normalized:
+        email_row.body_sha256 = None
+        return
+    digest = body_digest(normalized)
+
+    bumped = session.execute(
+        update(EmailBody).where(EmailBody.sha256 == digest).values(refcount=EmailBody.refcount + 1)
+    ).rowcount
+    if not bumped:
+        codec, data = compress_body(normalized)
+        try:
+            # A concurrent writer may store the same body first; fall back to bumping theirs
+            with session.begin_nested():
+                session.add(EmailBody(sha256=digest, codec=codec, data=data, size=len(normalized.encode("utf-8")), refcount=1))
+        except IntegrityError:
+            session.execute(update(EmailBody).where(EmailBody.sha256 == digest).values(refcount=EmailBody.refcount + 1))
+    email_row.body_sha256 = digest
+
+
+def release_body(session: Session, email_row: Email):
+    """Drop email_row's reference to its blob, deleting the blob when nothing else uses it."""
+    digest = email_row.body_sha256
+    if not digest:
+        return
+    email_row.body_sha256 = None
+    session.execute(update(EmailBody).where(EmailBody.sha256 == digest).values(refcount=EmailBody.refcount - 1))
+    session.execute(delete(EmailBody).where(EmailBody.sha256 == digest).where(EmailBody.refcount <= 0))
+
+
+def migrate_legacy_bodies(batch_size: int = MIGRATION_BATCH) -> int:
+    """Move inline emails.body text into email_bodies. Safe to re-run; returns rows migrated."""
+    migrated = 0
+    while True:
+        with db_session() as s:
+            rows = s.execute(
+                select(Email.id, Email.legacy_body)
+                .where(Email.legacy_body.is_not(None))
+                .order_by(Email.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            for email_id, body in rows:
+                email_row = s.get(Email, email_id)
+                if not email_row.body_sha256:
+                    attach_body(s, email_row, body)
+                email_row.legacy_body = None
+            migrated += len(rows)
+    if migrated:
+        logger.info(f"Moved {migrated} email body(ies) to content-addressed storage")
+    return migrated
+
+
+def storage_report() -> Dict[str, Any]:
+    """How much the blob table saves versus one uncompressed copy per email."""
+    with db_session() as s:
+        emails_with_body = s.execute(select(func.count()).where(Email.body_sha256.is_not(None))).scalar_one()
+        blobs, stored, unique_raw, logical_raw, references = s.execute(
+            select(
+                func.count(),
+                func.coalesce(func.sum(func.length(EmailBody.data)), 0),
+                func.coalesce(func.sum(EmailBody.size), 0),
+                func.coalesce(func.sum(EmailBody.size * EmailBody.refcount), 0),
+                func.coalesce(func.sum(EmailBody.refcount), 0),
+            )
+        ).one()
+        legacy_rows, legacy_bytes = s.execute(
+            select(func.count(), func.coalesce(func.sum(func.length(Email.legacy_body)), 0)).where(Email.legacy_body.is_not(None))
+        ).one()
+    return {
+        "emails_with_body": emails_with_body,
+        "blobs": blobs,
+        "references": references,
+        "dedup_ratio": round(references / blobs, 2) if blobs else 0.0,
+        "uncompressed_bytes_if_inline": logical_raw,
+        "unique_uncompressed_bytes": unique_raw,
+        "stored_bytes": stored,
+        "bytes_saved": logical_raw - stored,
+        "savings_pct": round(100 * (logical_raw - stored) / logical_raw, 1) if logical_raw else 0.0,
+        "legacy_rows_remaining": legacy_rows,
+        "legacy_bytes_remaining": legacy_bytes,
+        "codec": "zstd" if ZSTD_AVAILABLE else "zlib",
+    }
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Email body storage report and migration.")
+    parser.add_argument("--migrate", action="store_true", help="move remaining inline bodies into email_bodies")
+    parser.add_argument("--vacuum", action="store_true", help="reclaim freed space (SQLite VACUUM)")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    if args.migrate:
+        from server.db import init_db
+        init_db()
+    if args.vacuum and engine.dialect.name == "sqlite":
+        with engine.connect() as conn:
+            conn.exec_driver_sql("VACUUM")
+    print(json.dumps(storage_report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Persistent cache of classification results.
+
+Re-running a window or receiving the same templated notification again
+produces an identical prompt, so ml_decide looks the result up here before
+calling OpenAI. Entries live in the classification_cache table, expire after
+CLASSIFY_CACHE_TTL seconds, and the least recently used ones are evicted once
+there are more than CLASSIFY_CACHE_MAX_ENTRIES. Editing categories in
+/settings drops the user's entries (see invalidate_user).
+"""
+
+from __future__ import annotations
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+from sqlalchemy import delete, select, update
+from sqlalchemy.exc import IntegrityError
+from server.config import CLASSIFY_CACHE_TTL, CLASSIFY_CACHE_MAX_ENTRIES
+from server.db import db_session, ClassificationCacheEntry
+
+logger = logging.getLogger(__name__)
+
+# Expiry and LRU eviction run once per this many stored results
+EVICT_EVERY = 100
+
+_lock = threading.Lock()
+_counters = {"hits": 0, "misses": 0, "stores": 0, "evictions": 0, "invalidations": 0, "errors": 0}
+_stores_since_evict = 0
+
+
+def enabled() -> bool:
+    return CLASSIFY_CACHE_TTL > 0
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def _cutoff() -> datetime:
+    return datetime.now(timezone.utc) - timedelta(seconds=CLASSIFY_CACHE_TTL)
+
+
+def get(key: str) -> Dict[str, Any] | None:
+    """Return the cached result for key (marking it recently used), or None."""
+    try:
+        with db_session() as s:
+            result = s.execute(
+                select(ClassificationCacheEntry.result)
+                .where(ClassificationCacheEntry.key == key)
+                .where(ClassificationCacheEntry.created_at >= _cutoff())
+            ).scalar_one_or_none()
+            if result is not None:
+                s.execute(
+                    update(ClassificationCacheEntry)
+                    .where(ClassificationCacheEntry.key == key)
+                    .values(hits=ClassificationCacheEntry.hits + 1, last_used_at=datetime.now(timezone.utc))
+                )
+    except Exception as e:
+        logger.warning(f"Classification cache lookup FAILED - Error: {str(e)}")
+        _count("errors")
+        return None
+    _count("hits" if result is not None else "misses")
+    return result
+
+
+def put(key: str, user_id: int, model: str, result: Dict[str, Any]):
+    """Store result under key, replacing an expired entry."""
+    global _stores_since_evict
+    now = datetime.now(timezone.utc)
+    try:
+        with db_session() as s:
+            existing = s.get(ClassificationCacheEntry, key)
+            if existing is not None:
+                existing.result = result
+                existing.hits = 0
+                existing.created_at = now
+                existing.last_used_at = now
+            else:
+                s.add(ClassificationCacheEntry(key=key, user_id=user_id, model=model, result=result, created_at=now, last_used_at=now))
+    except IntegrityError:
+        # Another worker classified the same email first
+        return
+    except Exception as e:
+        logger.warning(f"Classification cache store FAILED - Error: {str(e)}")
+        _count("errors")
+        return
+    with _lock:
+        _counters["stores"] += 1
+        _stores_since_evict += 1
+        due = _stores_since_evict >= EVICT_EVERY
+        if due:
+            _stores_since_evict = 0
+    if due:
+        evict()
+
+
+def evict() -> int:
+    """Delete expired entries and the least recently used ones beyond CLASSIFY_CACHE_MAX_ENTRIES."""
+    try:
+        with db_session() as s:
+            removed = s.execute(
+                delete(ClassificationCacheEntry).where(ClassificationCacheEntry.created_at < _cutoff())
+            ).rowcount
+            overflow = (
+                select(ClassificationCacheEntry.key)
+                .order_by(ClassificationCacheEntry.last_used_at.desc())
+                .offset(CLASSIFY_CACHE_MAX_ENTRIES)
+            )
+            removed += s.execute(
+                delete(ClassificationCacheEntry).where(ClassificationCacheEntry.key.in_(overflow))
+            ).rowcount
+    except Exception as e:
+        logger.warning(f"Classification cache eviction FAILED - Error: {str(e)}")
+        _count("errors")
+        return 0
+    if removed:
+        _count("evictions", removed)
+    return removed
+
+
+def invalidate_user(user_id: int) -> int:
+    """Drop every cached result for a user, e.g. after their categories change."""
+    with db_session() as s:
+        removed = s.execute(
+            delete(ClassificationCacheEntry).where(ClassificationCacheEntry.user_id == user_id)
+        ).rowcount
+    _count("invalidations", removed)
+    logger.info(f"Classification cache invalidated - User: {user_id} | Entries: {removed}")
+    return removed
+
+
+def cache_stats() -> Dict[str, Any]:
+    with _lock:
+        stats = dict(_counters)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = round(stats["hits"] / lookups, 3) if lookups else 0.0
+    return stats
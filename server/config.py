@@ -15,4 +15,68 @@ DEFAULT_FETCH_LIMIT = int(os.getenv("FETCH_LIMIT", "10"))
 TASKS_LIST_TITLE = os.getenv("TASKS_LIST_TITLE", "Email Tasks")
 FLASK_SECRET = os.getenv("FLASK_SECRET", "dev-change-me")
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:5173")
+GMAIL_BATCH_SIZE = int(os.getenv("GMAIL_BATCH_SIZE", "50"))
+CLASSIFY_WORKERS = int(os.getenv("CLASSIFY_WORKERS", "4"))
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "4"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# A queued/running job whose worker hasn't sent a heartbeat for this long is marked failed (its process is gone)
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "90"))
+# Google API pacing (quota units per second, per user and per server process; see server/quota.py)
+GOOGLE_API_MAX_RETRIES = int(os.getenv("GOOGLE_API_MAX_RETRIES", "5"))
+QUOTA_GMAIL_PER_USER = float(os.getenv("QUOTA_GMAIL_PER_USER", "250"))
+QUOTA_GMAIL_GLOBAL = float(os.getenv("QUOTA_GMAIL_GLOBAL", "20000"))
+QUOTA_TASKS_PER_USER = float(os.getenv("QUOTA_TASKS_PER_USER", "10"))
+QUOTA_TASKS_GLOBAL = float(os.getenv("QUOTA_TASKS_GLOBAL", "100"))
+QUOTA_CALENDAR_PER_USER = float(os.getenv("QUOTA_CALENDAR_PER_USER", "10"))
+QUOTA_CALENDAR_GLOBAL = float(os.getenv("QUOTA_CALENDAR_GLOBAL", "150"))
+# Decoded bytes read from any one MIME body part (bounds work on multi-megabyte newsletters)
+MIME_PART_MAX_BYTES = int(os.getenv("MIME_PART_MAX_BYTES", str(256 * 1024)))
+# Worker processes for message parsing (0 = parse on the pipeline threads) and per-message timeout
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", "0"))
+PARSE_TIMEOUT = float(os.getenv("PARSE_TIMEOUT", "10"))
+# OpenAI HTTP client (one pooled client per API key and process; see server/ml.py)
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_READ_TIMEOUT = float(os.getenv("OPENAI_READ_TIMEOUT", "30"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "10"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "60"))
+# Concurrent OpenAI calls per page of messages on the asyncio path (0 = thread-per-message classify stage) and per-call deadline
+CLASSIFY_ASYNC_CONCURRENCY = int(os.getenv("CLASSIFY_ASYNC_CONCURRENCY", "0"))
+CLASSIFY_ASYNC_TIMEOUT = float(os.getenv("CLASSIFY_ASYNC_TIMEOUT", "20"))
+# OpenAI-compatible endpoint for Batch API backfills (python -m server.backfill); unset = api.openai.com
+OPENAI_BATCH_BASE_URL = os.getenv("OPENAI_BATCH_BASE_URL") or None
+# Emails classified per OpenAI request (1 = one request per email) and the email-content token budget per request
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "1"))
+CLASSIFY_BATCH_TOKENS = int(os.getenv("CLASSIFY_BATCH_TOKENS", "6000"))
+# Email-body tokens sent to the classifier, and per-model overrides ("model=tokens,model=tokens")
+CLASSIFY_BODY_TOKENS = int(os.getenv("CLASSIFY_BODY_TOKENS", "500"))
+CLASSIFY_BODY_TOKENS_BY_MODEL = os.getenv("CLASSIFY_BODY_TOKENS_BY_MODEL", "")
+# Constrain answers to the JSON schema in server/ml.py (false = plain JSON mode, still validated); ask for reasoning
+CLASSIFY_STRUCTURED_OUTPUTS = os.getenv("CLASSIFY_STRUCTURED_OUTPUTS", "true").lower() == "true"
+CLASSIFY_REASONING = os.getenv("CLASSIFY_REASONING", "false").lower() == "true"
+# Two-tier classification: the tier-one model sees subject, sender and snippet only; answers below the confidence
+# (or flagging a meeting) are escalated to the full-body prompt on the tier-two model. Unset tier-one model = one tier
+CLASSIFY_TIER1_MODEL = os.getenv("CLASSIFY_TIER1_MODEL", "")
+CLASSIFY_TIER1_MIN_CONFIDENCE = float(os.getenv("CLASSIFY_TIER1_MIN_CONFIDENCE", "0.8"))
+CLASSIFY_TIER1_ESCALATE_MEETINGS = os.getenv("CLASSIFY_TIER1_ESCALATE_MEETINGS", "true").lower() == "true"
+CLASSIFY_TIER2_MODEL = os.getenv("CLASSIFY_TIER2_MODEL", "")
+# Cached classifications (see server/classification_cache.py); a TTL of 0 disables the cache
+CLASSIFY_CACHE_TTL = float(os.getenv("CLASSIFY_CACHE_TTL", str(7 * 24 * 3600)))
+CLASSIFY_CACHE_MAX_ENTRIES = int(os.getenv("CLASSIFY_CACHE_MAX_ENTRIES", "50000"))
+# First-pass local classifier (python -m server.local_classifier --retrain): confidence needed to skip / create without OpenAI (0 = never)
+LOCAL_CLASSIFIER_SKIP_CONFIDENCE = float(os.getenv("LOCAL_CLASSIFIER_SKIP_CONFIDENCE", "0"))
+LOCAL_CLASSIFIER_CREATE_CONFIDENCE = float(os.getenv("LOCAL_CLASSIFIER_CREATE_CONFIDENCE", "0"))
+# Labelled emails a user needs for a model of their own; below that the global model is used
+LOCAL_CLASSIFIER_MIN_EXAMPLES = int(os.getenv("LOCAL_CLASSIFIER_MIN_EXAMPLES", "200"))
+# Comma-separated triage rule names (see server/triage.py); unset = defaults, empty = disabled
+TRIAGE_RULES = os.getenv("TRIAGE_RULES")
+# Comma-separated text reduction rule names (see server/text_reduction.py); unset = all, empty = disabled
+TEXT_REDUCTION_RULES = os.getenv("TEXT_REDUCTION_RULES")
 
+# Background polling (python -m server.scheduler)
+SCHEDULER_INTERVAL = float(os.getenv("SCHEDULER_INTERVAL", "300"))
+SCHEDULER_MAX_INTERVAL = float(os.getenv("SCHEDULER_MAX_INTERVAL", "3600"))
+SCHEDULER_JITTER = float(os.getenv("SCHEDULER_JITTER", "0.1"))
+SCHEDULER_WORKERS = int(os.getenv("SCHEDULER_WORKERS", "4"))
+SCHEDULER_MESSAGES_PER_TURN = int(os.getenv("SCHEDULER_MESSAGES_PER_TURN", "25"))
@@ -3,15 +3,15 @@ import os
 from contextlib import contextmanager
 from datetime import datetime, timezone
 
-from sqlalchemy import create_engine, ForeignKey, UniqueConstraint, Integer
-from sqlalchemy.orm import registry, mapped_column, Mapped, Session, sessionmaker, relationship
-from sqlalchemy import JSON, BigInteger, Text, Boolean, TIMESTAMP
+from sqlalchemy import create_engine, ForeignKey, UniqueConstraint, Integer, select, inspect, text
+from sqlalchemy.orm import registry, mapped_column, Mapped, Session, sessionmaker, relationship, column_property
+from sqlalchemy import JSON, BigInteger, Text, Boolean, TIMESTAMP, LargeBinary
 from sqlalchemy.exc import OperationalError
 from pathlib import Path
 
 db_dir = Path(__file__).parent.parent
 db_path = db_dir / "taskflow.db"
-DATABASE_URL = f"sqlite:///{db_path}"
+DATABASE_URL = os.getenv("DATABASE_URL", f"sqlite:///{db_path}")
 
 engine = create_engine(DATABASE_URL, pool_pre_ping=True, future=True)
 mapper_registry = registry()
@@ -30,6 +30,19 @@ class User(Base):
     tasks: Mapped[list["Task"]] = relationship("Task", back_populates="user")
     calendar_events: Mapped[list["CalendarEvent"]] = relationship("CalendarEvent", back_populates="user")
     settings: Mapped["UserSettings | None"] = relationship("UserSettings", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    sync_cursor: Mapped["SyncCursor | None"] = relationship("SyncCursor", back_populates="user", uselist=False, cascade="all, delete-orphan")
+    stored_credential: Mapped["StoredCredential | None"] = relationship("StoredCredential", back_populates="user", uselist=False, cascade="all, delete-orphan")
+
+
+class EmailBody(Base):
+    """A compressed email body shared by every Email whose normalized text hashes the same."""
+    __tablename__ = "email_bodies"
+    sha256: Mapped[str] = mapped_column(Text, primary_key=True)
+    codec: Mapped[str] = mapped_column(Text, nullable=False)  # zstd or zlib
+    data: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    size: Mapped[int] = mapped_column(Integer, nullable=False)  # uncompressed UTF-8 bytes
+    refcount: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
 
 
 class Email(Base):
@@ -42,8 +55,18 @@ class Email(Base):
     sender: Mapped[str | None] = mapped_column(Text)
     received_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
     snippet: Mapped[str | None] = mapped_column(Text)
-    body: Mapped[str | None] = mapped_column(Text)
+    # Bodies live in email_bodies (see server/bodies.py). The old inline column
+    # only holds rows not yet migrated; neither is loaded unless .body is read.
+    body_sha256: Mapped[str | None] = mapped_column(Text, index=True)
+    legacy_body: Mapped[str | None] = mapped_column("body", Text, deferred=True)
+    body_blob: Mapped[bytes | None] = column_property(
+        select(EmailBody.data).where(EmailBody.sha256 == body_sha256).correlate_except(EmailBody).scalar_subquery(),
+        deferred=True,
+    )
     processed: Mapped[bool] = mapped_column(Boolean, default=False, nullable=False)
+    # Who made the task/skip decision: llm, tier1, tier2, local, fallback, triage, or user
+    # (confirmed or deleted its task/event). NULL for rows processed before it was recorded.
+    decided_by: Mapped[str | None] = mapped_column(Text)
     first_processed_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
     last_processed_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
     created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
@@ -56,6 +79,13 @@ class Email(Base):
         UniqueConstraint('user_id', 'gmail_message_id', name='uq_user_email_message'),
     )
 
+    @property
+    def body(self) -> str | None:
+        if self.body_sha256:
+            from server.bodies import decompress_body
+            return decompress_body(self.body_blob) if self.body_blob is not None else None
+        return self.legacy_body
+
 
 class Task(Base):
     __tablename__ = "tasks"
@@ -111,6 +141,78 @@ class UserSettings(Base):
     user: Mapped["User"] = relationship("User", back_populates="settings")
 
 
+class SyncCursor(Base):
+    """Last Gmail historyId seen per user, for incremental mailbox sync."""
+    __tablename__ = "sync_cursors"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False, unique=True, index=True)
+    history_id: Mapped[str] = mapped_column(Text, nullable=False)
+    # Gmail query the cursor was established with; a different query needs a full list
+    query: Mapped[str] = mapped_column(Text, nullable=False, default="")
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False, onupdate=lambda: datetime.now(timezone.utc))
+
+    # Relationship
+    user: Mapped["User"] = relationship("User", back_populates="sync_cursor")
+
+
+class StoredCredential(Base):
+    """Google OAuth credentials saved at login so the scheduler can poll without a session."""
+    __tablename__ = "stored_credentials"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False, unique=True, index=True)
+    info: Mapped[dict] = mapped_column(JSON, nullable=False)
+    # Set when refreshing fails (e.g. access revoked); the scheduler skips the user until the next login
+    last_error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    updated_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False, onupdate=lambda: datetime.now(timezone.utc))
+
+    # Relationship
+    user: Mapped["User"] = relationship("User", back_populates="stored_credential")
+
+
+class LocalClassifierModel(Base):
+    """A first-pass should_create model (see server/local_classifier.py); scope is "global" or "user:<id>"."""
+    __tablename__ = "local_classifier_models"
+    scope: Mapped[str] = mapped_column(Text, primary_key=True)
+    user_id: Mapped[int | None] = mapped_column(BigInteger, ForeignKey("users.id"), index=True)
+    model: Mapped[dict] = mapped_column(JSON, nullable=False)
+    examples: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    metrics: Mapped[dict | None] = mapped_column(JSON)
+    trained_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+
+
+class ClassificationCacheEntry(Base):
+    """A stored ml_decide result, keyed by a hash of everything that went into the prompt."""
+    __tablename__ = "classification_cache"
+    key: Mapped[str] = mapped_column(Text, primary_key=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False, index=True)
+    model: Mapped[str] = mapped_column(Text, nullable=False)
+    result: Mapped[dict] = mapped_column(JSON, nullable=False)
+    hits: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    last_used_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False, index=True)
+
+
+class FetchJob(Base):
+    """A background /fetch-emails run and its live progress counters."""
+    __tablename__ = "fetch_jobs"
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, ForeignKey("users.id"), nullable=False, index=True)
+    status: Mapped[str] = mapped_column(Text, nullable=False, default="queued")  # queued, running, completed, failed
+    params: Mapped[dict | None] = mapped_column(JSON)
+    considered: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    created: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    skipped: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    errors: Mapped[int] = mapped_column(Integer, nullable=False, default=0)
+    result: Mapped[dict | None] = mapped_column(JSON)
+    error: Mapped[str | None] = mapped_column(Text)
+    created_at: Mapped[datetime] = mapped_column(TIMESTAMP(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    started_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    finished_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+    # Refreshed by the owning process while the job is queued or running (see server/jobs.py)
+    heartbeat_at: Mapped[datetime | None] = mapped_column(TIMESTAMP(timezone=True))
+
 
 
 def init_db():
@@ -127,6 +229,30 @@ def init_db():
     except OperationalError:
         pass
 
+    _add_missing_columns()
+
+    from server.bodies import migrate_legacy_bodies
+    migrate_legacy_bodies()
+
+def _add_missing_columns():
+    """create_all doesn't alter existing tables; add columns introduced since they were created."""
+    added = {
+        "emails": {"body_sha256": "TEXT", "decided_by": "TEXT"},
+        "fetch_jobs": {"heartbeat_at": "TIMESTAMP WITH TIME ZONE"},
+    }
+    indexed = {"body_sha256"}  # columns declared with index=True
+    existing_tables = inspect(engine).get_table_names()
+    with engine.begin() as conn:
+        for table, columns in added.items():
+            if table not in existing_tables:
+                continue
+            present = {c["name"] for c in inspect(conn).get_columns(table)}
+            for name, ddl_type in columns.items():
+                if name not in present:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl_type}"))
+                    if name in indexed:
+                        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_{name} ON {table} ({name})"))
+
 @contextmanager
 def db_session() -> Session:
     session = SessionLocal()
@@ -0,0 +1,657 @@
+"""
+Local stand-ins for Gmail, Google Tasks, Google Calendar and OpenAI.
+
+Installs fakes at the get_*_service / OpenAI client boundary so fetch_emails,
+confirm_tasks and confirm_calendar_events run end-to-end without touching
+real quotas. Mailboxes are synthetic and seeded (size, MIME complexity and
+HTML weight are configurable) and every API call can be delayed or fail
+with injected errors and 429s.
+
+Usage (load test against a throwaway database):
+    python -m server.emulator --users 4 --messages 200 --latency-ms 40 --rate-limit-rate 0.02
+"""
+
+from __future__ import annotations
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import random
+import re
+import statistics
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, Optional
+import httplib2
+from googleapiclient.errors import HttpError
+
+logger = logging.getLogger(__name__)
+
+MIME_KINDS = ["plain", "alternative", "html", "mixed"]
+
+
+class EmulatorConfig:
+    """Knobs for the synthetic backends."""
+
+    def __init__(
+        self,
+        messages: int = 100,
+        mime: str = "random",
+        html_kb: int = 20,
+        latency_ms: float = 0.0,
+        llm_latency_ms: float = 0.0,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        seed: int = 1,
+    ):
+        self.messages = messages
+        self.mime = mime
+        self.html_kb = html_kb
+        self.latency_ms = latency_ms
+        self.llm_latency_ms = llm_latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+
+
+class FaultInjector:
+    """Applies latency and injects 5xx/429 failures; counts what it did."""
+
+    def __init__(self, config: EmulatorConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self.counters = {"calls": 0, "errors": 0, "rate_limited": 0}
+
+    def __call__(self, latency_ms: float | None = None):
+        latency_ms = self.config.latency_ms if latency_ms is None else latency_ms
+        with self._lock:
+            self.counters["calls"] += 1
+            roll = self._rng.random()
+            jitter = self._rng.uniform(0.5, 1.5)
+        if latency_ms:
+            time.sleep(latency_ms * jitter / 1000)
+        if roll < self.config.rate_limit_rate:
+            with self._lock:
+                self.counters["rate_limited"] += 1
+            raise _http_error(429, "rateLimitExceeded", "Rate Limit Exceeded")
+        if roll < self.config.rate_limit_rate + self.config.error_rate:
+            with self._lock:
+                self.counters["errors"] += 1
+            raise _http_error(503, "backendError", "Backend Error")
+
+
+def _http_error(status: int, reason: str, message: str) -> HttpError:
+    content = json.dumps({"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}})
+    return HttpError(httplib2.Response({"status": str(status)}), content.encode("utf-8"), uri="emulator://")
+
+
+class _Request:
+    """Mimics googleapiclient.http.HttpRequest: work happens on execute()."""
+
+    def __init__(self, fn: Callable[[], Any], faults: FaultInjector):
+        self._fn = fn
+        self._faults = faults
+
+    def execute(self, num_retries: int = 0):
+        self._faults()
+        return self._fn()
+
+
+class _Batch:
+    """Mimics BatchHttpRequest: one round-trip of latency, per-item faults."""
+
+    def __init__(self, faults: FaultInjector, callback=None):
+        self._faults = faults
+        self._callback = callback
+        self._requests: list[tuple[str, _Request, Any]] = []
+
+    def add(self, request: _Request, callback=None, request_id=None):
+        self._requests.append((request_id or str(len(self._requests)), request, callback))
+
+    def execute(self):
+        self._faults()
+        for request_id, request, callback in self._requests:
+            try:
+                response, exception = request._fn(), None
+                self._faults(latency_ms=0)
+            except HttpError as e:
+                response, exception = None, e
+            (callback or self._callback)(request_id, response, exception)
+
+
+# --- Gmail -------------------------------------------------------------------
+
+_SENDERS = ["manager@company.com", "billing@service.com", "calendar@company.com", "news@techblog.com", "deals@shopping.com"]
+_KINDS = ["action", "action", "meeting", "bill", "newsletter", "promotion", "notification"]
+
+
+def _b64(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def _html_body(text: str, kb: int) -> str:
+    filler_row = "<tr><td style=\"padding:8px;font-family:Arial\"><p>Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p><a href=\"https://example.com/x\">Read more</a></td></tr>"
+    rows = max(1, kb * 1024 // len(filler_row))
+    return (
+        "<html><head><style>td{color:#333}</style><script>var t=1;</script></head><body>"
+        f"<div><p>{text.replace(chr(10), '<br/>')}</p></div><table>{filler_row * rows}</table>"
+        "<div>Unsubscribe | Privacy policy</div></body></html>"
+    )
+
+
+class SyntheticMailbox:
+    """A deterministic in-memory mailbox with Gmail-shaped messages and history."""
+
+    def __init__(self, config: EmulatorConfig, seed: int | None = None):
+        self.config = config
+        self._rng = random.Random(config.seed if seed is None else seed)
+        self._lock = threading.Lock()
+        self.messages: dict[str, dict] = {}
+        self.order: list[str] = []  # newest first
+        self.history: list[tuple[int, str]] = []
+        self.history_id = 1000
+        self.add_messages(config.messages)
+
+    def add_messages(self, count: int, labels: list[str] | None = None):
+        """Add count synthetic messages; labels replaces their labelIds (e.g. ["SENT"])."""
+        with self._lock:
+            for _ in range(count):
+                self.history_id += 1
+                message = self._make_message(len(self.order))
+                if labels is not None:
+                    message["labelIds"] = list(labels)
+                self.messages[message["id"]] = message
+                self.order.insert(0, message["id"])
+                self.history.append((self.history_id, message["id"]))
+
+    def _make_message(self, n: int) -> dict:
+        rng = self._rng
+        kind = rng.choice(_KINDS)
+        mime = self.config.mime if self.config.mime in MIME_KINDS else rng.choice(MIME_KINDS)
+        subject, text = {
+            "action": (f"Please review the Q{n % 4 + 1} report", "Hi,\n\nCan you review the attached report and send feedback by Friday?\n\nThanks"),
+            "meeting": (f"Meeting: Project sync #{n}", "You're invited to a project sync.\nWhen: Thursday 2pm\nWhere: https://meet.example.com/abc"),
+            "bill": (f"Invoice #{10000 + n} due", "Your invoice is due on the 15th. Amount: $150.00. Please pay to avoid late fees."),
+            "newsletter": (f"Weekly newsletter #{n}", "Top stories this week in tech. Read more on our website."),
+            "promotion": (f"50% OFF everything - deal #{n}", "Limited time only! Shop now and save big."),
+            "notification": (f"New login to your account #{n}", "We noticed a new sign-in. No action is needed if this was you."),
+        }[kind]
+
+        headers = [
+            {"name": "Subject", "value": subject},
+            {"name": "From", "value": _SENDERS[_KINDS.index(kind) % len(_SENDERS)]},
+            {"name": "Content-Type", "value": "text/plain; charset=\"UTF-8\""},
+        ]
+        labels = ["INBOX", "UNREAD"]
+        if kind in ("newsletter", "promotion"):
+            headers.append({"name": "List-Unsubscribe", "value": "<mailto:unsubscribe@example.com>"})
+            labels.append("CATEGORY_PROMOTIONS")
+        if kind == "notification":
+            headers.append({"name": "Auto-Submitted", "value": "auto-generated"})
+            labels.append("CATEGORY_UPDATES")
+
+        text_part = {"mimeType": "text/plain", "headers": [{"name": "Content-Type", "value": "text/plain; charset=UTF-8"}], "body": {"data": _b64(text)}}
+        html_part = {"mimeType": "text/html", "headers": [{"name": "Content-Type", "value": "text/html; charset=UTF-8"}], "body": {"data": _b64(_html_body(text, self.config.html_kb))}}
+        if mime == "plain":
+            payload = {**text_part, "headers": headers}
+        elif mime == "html":
+            payload = {**html_part, "headers": headers}
+        elif mime == "alternative":
+            payload = {"mimeType": "multipart/alternative", "headers": headers, "parts": [text_part, html_part]}
+        else:
+            attachment = {
+                "mimeType": "application/pdf",
+                "filename": "report.pdf",
+                "headers": [{"name": "Content-Disposition", "value": "attachment; filename=\"report.pdf\""}],
+                "body": {"attachmentId": f"att{n}", "size": 250000},
+            }
+            payload = {
+                "mimeType": "multipart/mixed",
+                "headers": headers,
+                "parts": [{"mimeType": "multipart/alternative", "parts": [text_part, html_part]}, attachment],
+            }
+
+        message_id = f"{n:016x}"
+        raw_size = len(json.dumps(payload))
+        return {
+            "id": message_id,
+            "threadId": message_id,
+            "labelIds": labels,
+            "snippet": text[:100],
+            "internalDate": str(int(time.time() * 1000) - n * 60000),
+            "sizeEstimate": raw_size,
+            "payload": payload,
+        }
+
+    def get(self, message_id: str, format: str = "full", metadataHeaders=None) -> dict:
+        message = self.messages.get(message_id)
+        if message is None:
+            raise _http_error(404, "notFound", "Requested entity was not found.")
+        if format == "metadata":
+            wanted = {h.lower() for h in (metadataHeaders or [])}
+            headers = [h for h in message["payload"]["headers"] if not wanted or h["name"].lower() in wanted]
+            return {**{k: v for k, v in message.items() if k != "payload"}, "payload": {"mimeType": message["payload"]["mimeType"], "headers": headers}}
+        return message
+
+    def list(self, maxResults: int = 100, pageToken: str | None = None, q: str | None = None, **_) -> dict:
+        start = int(pageToken or 0)
+        # Only the in:inbox operator is emulated; other search terms match everything
+        order = [m for m in self.order if "INBOX" in self.messages[m]["labelIds"]] if q and "in:inbox" in q else self.order
+        page = order[start:start + maxResults]
+        resp: dict = {"messages": [{"id": m, "threadId": m} for m in page], "resultSizeEstimate": len(order)}
+        if start + maxResults < len(order):
+            resp["nextPageToken"] = str(start + maxResults)
+        return resp
+
+    def history_list(self, startHistoryId: str, pageToken: str | None = None, labelId: str | None = None, **_) -> dict:
+        start_id = int(startHistoryId)
+        if self.history and start_id < self.history[0][0] - 1:
+            raise _http_error(404, "notFound", "Requested entity was not found.")
+        added = [(h, m) for h, m in self.history if h > start_id and (not labelId or labelId in self.messages[m]["labelIds"])]
+        return {
+            "history": [{"id": str(h), "messagesAdded": [{"message": {"id": m, "threadId": m, "labelIds": self.messages[m]["labelIds"]}}]} for h, m in added],
+            "historyId": str(self.history_id),
+        }
+
+
+class FakeGmail:
+    def __init__(self, mailbox: SyntheticMailbox, faults: FaultInjector):
+        self._mailbox = mailbox
+        self._faults = faults
+
+    def users(self):
+        return self
+
+    def messages(self):
+        return SimpleNamespace(
+            list=lambda userId="me", **kw: _Request(lambda: self._mailbox.list(**kw), self._faults),
+            get=lambda userId="me", id=None, **kw: _Request(lambda: self._mailbox.get(id, **kw), self._faults),
+        )
+
+    def history(self):
+        return SimpleNamespace(list=lambda userId="me", **kw: _Request(lambda: self._mailbox.history_list(**kw), self._faults))
+
+    def getProfile(self, userId="me"):
+        return _Request(lambda: {"emailAddress": "emulated@example.com", "historyId": str(self._mailbox.history_id)}, self._faults)
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self._faults, callback)
+
+
+# --- Tasks / Calendar --------------------------------------------------------
+
+class FakeTasks:
+    def __init__(self, faults: FaultInjector):
+        self._faults = faults
+        self._lock = threading.Lock()
+        self.tasklists_by_id: dict[str, dict] = {}
+        self.tasks_by_id: dict[str, dict] = {}
+
+    def _insert_tasklist(self, body: dict) -> dict:
+        with self._lock:
+            tl = {"id": f"tl{len(self.tasklists_by_id) + 1}", "title": body.get("title")}
+            self.tasklists_by_id[tl["id"]] = tl
+            return tl
+
+    def _insert_task(self, tasklist: str, body: dict) -> dict:
+        with self._lock:
+            task_id = f"t{len(self.tasks_by_id) + 1}"
+            task = {**body, "id": task_id, "status": "needsAction", "selfLink": f"emulator://tasks/{tasklist}/{task_id}"}
+            self.tasks_by_id[task_id] = task
+            return task
+
+    def _delete_task(self, task: str) -> dict:
+        with self._lock:
+            self.tasks_by_id.pop(task, None)
+        return {}
+
+    def tasklists(self):
+        return SimpleNamespace(
+            list=lambda **kw: _Request(lambda: {"items": list(self.tasklists_by_id.values())}, self._faults),
+            list_next=lambda req, resp: None,
+            insert=lambda body: _Request(lambda: self._insert_tasklist(body), self._faults),
+        )
+
+    def tasks(self):
+        return SimpleNamespace(
+            insert=lambda tasklist, body: _Request(lambda: self._insert_task(tasklist, body), self._faults),
+            delete=lambda tasklist, task: _Request(lambda: self._delete_task(task), self._faults),
+        )
+
+
+class FakeCalendar:
+    def __init__(self, faults: FaultInjector):
+        self._faults = faults
+        self._lock = threading.Lock()
+        self.events_by_id: dict[str, dict] = {}
+
+    def _insert(self, body: dict) -> dict:
+        with self._lock:
+            event_id = f"ev{len(self.events_by_id) + 1}"
+            event = {**body, "id": event_id, "htmlLink": f"emulator://calendar/{event_id}"}
+            self.events_by_id[event_id] = event
+            return event
+
+    def _delete(self, event_id: str) -> dict:
+        with self._lock:
+            self.events_by_id.pop(event_id, None)
+        return {}
+
+    def events(self):
+        return SimpleNamespace(
+            insert=lambda calendarId="primary", body=None: _Request(lambda: self._insert(body), self._faults),
+            delete=lambda calendarId="primary", eventId=None: _Request(lambda: self._delete(eventId), self._faults),
+        )
+
+
+# --- OpenAI ------------------------------------------------------------------
+
+_NEGATIVE_HINTS = re.compile(r"newsletter|% off|deal #|shop now|new login|no action is needed", re.I)
+_MEETING_HINTS = re.compile(r"meeting|invite|sync", re.I)
+
+
+def fake_classification(prompt: str, reasoning: bool = False) -> dict:
+    """A keyword stand-in for the model's JSON answer, shaped like the real prompt asks."""
+    subject_match = re.search(r"^Subject: (.*)$", prompt, re.M)
+    subject = subject_match.group(1).strip() if subject_match else "Email task"
+    email_part = prompt[subject_match.start():] if subject_match else prompt
+    is_meeting = bool(_MEETING_HINTS.search(subject))
+    should_create = not _NEGATIVE_HINTS.search(email_part)
+    answer = {
+        "should_create": should_create,
+        "confidence": 0.9 if should_create else 0.85,
+        "title": subject[:60],
+        "notes": "Emulated notes for: " + subject,
+        "category": None,
+    }
+    if reasoning:
+        answer["reasoning"] = "emulated"
+    answer["meeting"] = {
+        "summary": subject,
+        "location": "https://meet.example.com/abc",
+        "start_datetime": "2030-01-03T14:00:00Z",
+        "end_datetime": "2030-01-03T15:00:00Z",
+        "participants": [],
+        "category": None,
+    } if is_meeting else None
+    return answer
+
+
+class FakeOpenAI:
+    """Duck-types the parts of openai.OpenAI the classifier uses."""
+
+    def __init__(self, faults: FaultInjector, llm_latency_ms: float = 0.0, **_):
+        self._faults = faults
+        self._llm_latency_ms = llm_latency_ms
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        # Batch API stand-in: batches complete as soon as they are created
+        self.uploaded: dict[str, bytes] = {}
+        self.batches_by_id: dict[str, SimpleNamespace] = {}
+        self.files = SimpleNamespace(create=self._upload, content=self._file_content)
+        self.batches = SimpleNamespace(create=self._create_batch, retrieve=lambda batch_id: self.batches_by_id[batch_id])
+        # Hashes of prompt prefixes seen so far, for the emulated prompt cache
+        self._prefixes: set[int] = set()
+
+    def _upload(self, file, purpose: str, **_):
+        data = file[1] if isinstance(file, tuple) else file.read()
+        file_id = f"file-{len(self.uploaded) + 1}"
+        self.uploaded[file_id] = data if isinstance(data, bytes) else data.encode("utf-8")
+        return SimpleNamespace(id=file_id, purpose=purpose)
+
+    def _file_content(self, file_id: str):
+        return SimpleNamespace(text=self.uploaded[file_id].decode("utf-8"))
+
+    def _create_batch(self, input_file_id: str, endpoint: str, completion_window: str, **_):
+        outputs, errors = [], []
+        for n, line in enumerate(self.uploaded[input_file_id].decode("utf-8").splitlines()):
+            request = json.loads(line)
+            try:
+                response = self._create(**request["body"])
+            except HttpError as e:
+                errors.append({"id": f"req-{n}", "custom_id": request["custom_id"], "response": {"status_code": e.resp.status, "body": {}}, "error": None})
+                continue
+            body = {"model": response.model, "choices": [{"index": 0, "message": {"role": "assistant", "content": response.choices[0].message.content}, "finish_reason": "stop"}]}
+            outputs.append({"id": f"req-{n}", "custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None})
+        batch_id = f"batch-{len(self.batches_by_id) + 1}"
+        output_file_id = self._upload(("output.jsonl", "".join(json.dumps(o) + "\n" for o in outputs)), "batch_output").id
+        error_file_id = self._upload(("errors.jsonl", "".join(json.dumps(e) + "\n" for e in errors)), "batch_output").id if errors else None
+        batch = SimpleNamespace(
+            id=batch_id, status="completed", endpoint=endpoint, input_file_id=input_file_id,
+            output_file_id=output_file_id, error_file_id=error_file_id,
+            request_counts=SimpleNamespace(total=len(outputs) + len(errors), completed=len(outputs), failed=len(errors)),
+        )
+        self.batches_by_id[batch_id] = batch
+        return batch
+
+    def _create(self, model: str, messages: list[dict], **kwargs):
+        self._faults(latency_ms=self._llm_latency_ms)
+        return self._respond(model, messages, kwargs.get("max_tokens"))
+
+    def _cached_tokens(self, prompt: str) -> int:
+        """Like OpenAI prompt caching: the longest previously seen prefix, in 128-token steps from 1024 tokens."""
+        block = 128 * 4
+        boundaries = range(block, len(prompt) + 1, block)
+        cached = 0
+        for end in boundaries:
+            if hash(prompt[:end]) not in self._prefixes:
+                break
+            cached = end // 4
+        self._prefixes.update(hash(prompt[:end]) for end in boundaries)
+        return cached if cached >= 1024 else 0
+
+    def _respond(self, model: str, messages: list[dict], max_tokens: int | None = None):
+        prompt = "\n".join(m.get("content", "") for m in messages)
+        # Answer with a reasoning field only when the prompt's answer format has one
+        reasoning = '"reasoning":' in prompt
+        if "### Email id: " in prompt:
+            # Batched prompt (ml.build_batch_prompt): one answer per email section
+            sections = re.split(r"^### Email id: (\S+)$", prompt, flags=re.M)
+            results = [{"id": email_id, **fake_classification(text, reasoning)} for email_id, text in zip(sections[1::2], sections[2::2])]
+            content = json.dumps({"results": results})
+        else:
+            content = json.dumps(fake_classification(prompt, reasoning))
+        finish_reason = "stop"
+        if max_tokens and len(content) // 4 > max_tokens:
+            # Like the real API: the answer is cut off mid-JSON at max_tokens
+            content, finish_reason = content[:max_tokens * 4], "length"
+        usage = SimpleNamespace(
+            prompt_tokens=len(prompt) // 4,
+            completion_tokens=len(content) // 4,
+            total_tokens=(len(prompt) + len(content)) // 4,
+            prompt_tokens_details=SimpleNamespace(cached_tokens=self._cached_tokens(prompt)),
+        )
+        message = SimpleNamespace(content=content, role="assistant")
+        return SimpleNamespace(model=model, choices=[SimpleNamespace(message=message, finish_reason=finish_reason)], usage=usage)
+
+
+class FakeAsyncOpenAI:
+    """Duck-types openai.AsyncOpenAI over a FakeOpenAI; latency is awaited, not slept on a thread."""
+
+    def __init__(self, sync: FakeOpenAI):
+        self._sync = sync
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, model: str, messages: list[dict], **kwargs):
+        latency_ms = self._sync._llm_latency_ms
+        self._sync._faults(latency_ms=0)
+        if latency_ms:
+            await asyncio.sleep(latency_ms * random.uniform(0.5, 1.5) / 1000)
+        return self._sync._respond(model, messages, kwargs.get("max_tokens"))
+
+    async def close(self):
+        pass
+
+
+# --- Installation ------------------------------------------------------------
+
+class Emulator:
+    """Holds the fake backends (one mailbox per credential token) and installs them."""
+
+    def __init__(self, config: EmulatorConfig | None = None):
+        self.config = config or EmulatorConfig()
+        self.faults = FaultInjector(self.config)
+        self.mailboxes: dict[str, SyntheticMailbox] = {}
+        self.tasks = FakeTasks(self.faults)
+        self.calendar = FakeCalendar(self.faults)
+        self.openai = FakeOpenAI(self.faults, llm_latency_ms=self.config.llm_latency_ms)
+        self._lock = threading.Lock()
+
+    def mailbox(self, key: str) -> SyntheticMailbox:
+        with self._lock:
+            if key not in self.mailboxes:
+                self.mailboxes[key] = SyntheticMailbox(self.config, seed=self.config.seed + len(self.mailboxes))
+            return self.mailboxes[key]
+
+    def service(self, name: str, version: str, creds) -> Any:
+        if name == "gmail":
+            return FakeGmail(self.mailbox(getattr(creds, "token", None) or "default"), self.faults)
+        if name == "tasks":
+            return self.tasks
+        if name == "calendar":
+            return self.calendar
+        raise ValueError(f"Emulator has no '{name}' service")
+
+    def install(self):
+        from server import utils, ml
+        utils.set_service_factory(self.service)
+        ml.set_openai_client_factory(lambda **kwargs: self.openai)
+        ml.set_async_openai_client_factory(lambda **kwargs: FakeAsyncOpenAI(self.openai))
+        os.environ.setdefault("OPENAI_API_KEY", "emulator")
+        return self
+
+    @staticmethod
+    def uninstall():
+        from server import utils, ml
+        utils.set_service_factory(None)
+        ml.set_openai_client_factory(None)
+        ml.set_async_openai_client_factory(None)
+
+
+def emulated_credentials(token: str):
+    """Credentials object accepted by the pipeline; the token selects the mailbox."""
+    from google.oauth2.credentials import Credentials
+    return Credentials(token=token, refresh_token="emulator", token_uri="emulator://token", client_id="emulator", client_secret="emulator")
+
+
+# --- Load test driver --------------------------------------------------------
+
+def _percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run_load_test(args) -> Dict[str, Any]:
+    """Drive /fetch-emails (and confirm endpoints for review mode) through the Flask app for N users in parallel."""
+    from server.app import app
+    from server.db import db_session, UserSettings
+    from server.utils import encode_jwt, get_or_create_user
+    from server.quota import quota_stats
+    from server.classification_cache import cache_stats
+    from server.local_classifier import local_classifier_stats
+    from server.ml import tier_stats, usage_stats
+    from server.text_reduction import reduction_stats
+
+    emulator = Emulator(EmulatorConfig(
+        messages=args.messages, mime=args.mime, html_kb=args.html_kb, latency_ms=args.latency_ms,
+        llm_latency_ms=args.llm_latency_ms, error_rate=args.error_rate, rate_limit_rate=args.rate_limit_rate, seed=args.seed,
+    )).install()
+
+    timings: list[float] = []
+    totals: dict[str, int] = {"processed": 0, "considered": 0, "errors": 0, "confirmed": 0}
+    totals_lock = threading.Lock()
+
+    def drive(n: int):
+        email = f"user{n}@emulator.local"
+        with db_session() as s:
+            user = get_or_create_user(s, email)
+            if args.review:
+                s.add(UserSettings(user_id=user.id, auto_generate=False))
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess["credentials"] = {
+                "token": f"mailbox-{n}", "refresh_token": "emulator", "token_uri": "emulator://token",
+                "client_id": "emulator", "client_secret": "emulator", "scopes": None,
+            }
+        headers = {"Authorization": f"Bearer {encode_jwt(email)}"}
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            resp = client.post(f"/fetch-emails?window=7d&max={args.messages}", headers=headers)
+            elapsed = time.perf_counter() - started
+            body = resp.get_json() or {}
+            confirmed = 0
+            if args.review:
+                task_ids = [t["id"] for t in (client.get("/tasks/all", headers=headers).get_json() or {}).get("tasks", []) if t["status"] == "pending"]
+                if task_ids:
+                    confirmed += (client.post("/tasks/confirm", json={"task_ids": task_ids}, headers=headers).get_json() or {}).get("confirmed_count", 0)
+                event_ids = [e["id"] for e in (client.get("/calendar-events/all", headers=headers).get_json() or {}).get("events", []) if e["status"] == "pending"]
+                if event_ids:
+                    confirmed += (client.post("/calendar-events/confirm", json={"event_ids": event_ids}, headers=headers).get_json() or {}).get("confirmed_count", 0)
+                elapsed = time.perf_counter() - started
+            with totals_lock:
+                timings.append(elapsed)
+                totals["processed"] += body.get("processed", 0)
+                totals["considered"] += body.get("considered", 0)
+                totals["errors"] += len(body.get("errors", []))
+                totals["confirmed"] += confirmed
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=drive, args=(n,)) for n in range(args.users)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+
+    return {
+        "users": args.users,
+        "messages_per_user": args.messages,
+        "wall_seconds": round(wall, 3),
+        "requests": len(timings),
+        "latency_p50": round(_percentile(timings, 50), 3),
+        "latency_p95": round(_percentile(timings, 95), 3),
+        "latency_mean": round(statistics.mean(timings), 3) if timings else 0.0,
+        "messages_per_second": round(totals["considered"] / wall, 1) if wall else 0.0,
+        **totals,
+        "backend_calls": emulator.faults.counters["calls"],
+        "injected_errors": emulator.faults.counters["errors"],
+        "injected_429s": emulator.faults.counters["rate_limited"],
+        "google_api": quota_stats(),
+        "classification_cache": cache_stats(),
+        "local_classifier": local_classifier_stats(),
+        "classify_tiers": tier_stats(),
+        "openai_usage": usage_stats(),
+        "text_reduction": reduction_stats(),
+    }
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Run the email pipeline end-to-end against emulated Google/OpenAI backends.")
+    parser.add_argument("--users", type=int, default=2)
+    parser.add_argument("--messages", type=int, default=50, help="messages per synthetic mailbox")
+    parser.add_argument("--rounds", type=int, default=1, help="fetches per user (later rounds hit the incremental path)")
+    parser.add_argument("--mime", choices=MIME_KINDS + ["random"], default="random")
+    parser.add_argument("--html-kb", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=30.0, help="per Google API round-trip")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--review", action="store_true", help="auto_generate off, then confirm pending tasks/events")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", default=None, help="defaults to a temporary SQLite file")
+    args = parser.parse_args(argv)
+
+    # Must be set before server.db is imported by the app
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='taskflow-emulator-')}/taskflow.db"
+    logging.getLogger().setLevel(logging.WARNING)
+    print(json.dumps(run_load_test(args), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""Gmail API helpers: message listing, incremental history sync and batched fetching."""
+
+from __future__ import annotations
+import logging
+import re
+import time
+from typing import Hashable, Iterable, Iterator, Tuple
+from googleapiclient.discovery import Resource
+from googleapiclient.errors import HttpError
+from server import quota
+from server.config import GMAIL_BATCH_SIZE, GOOGLE_API_MAX_RETRIES
+from server.quota import GMAIL_UNITS
+
+logger = logging.getLogger(__name__)
+
+# Gmail rejects batch requests with more than 100 calls
+MAX_BATCH_SIZE = 100
+
+# Messages carrying these labels never show up in a default Gmail search
+HISTORY_EXCLUDED_LABELS = {"DRAFT", "SPAM", "TRASH"}
+
+
+# history.list takes no search query, so incremental sync only covers queries it can reproduce:
+# query -> labelId that narrows history to the same messages (None = no label filter needed)
+HISTORY_QUERY_LABELS = {"in:inbox": "INBOX"}
+_WINDOW_QUERY = re.compile(r"^newer_than:\d+[dmy]$")
+
+
+def history_label_for_query(query: str) -> Tuple[bool, str | None]:
+    """
+    Whether gmail_history_ids can reproduce query, and the labelId to pass it.
+    New mail always falls inside a newer_than: window, so a bare window needs no filter.
+    """
+    if query in HISTORY_QUERY_LABELS:
+        return True, HISTORY_QUERY_LABELS[query]
+    return bool(_WINDOW_QUERY.match(query)), None
+
+
+class HistoryExpiredError(RuntimeError):
+    """Raised when a stored historyId is too old for users.history.list."""
+
+
+def get_history_id(service: Resource, user_key: Hashable | None = None) -> str | None:
+    """Return the mailbox's current historyId."""
+    profile = quota.execute(service.users().getProfile(userId="me"), "gmail", GMAIL_UNITS["getProfile"], user_key)
+    return profile.get("historyId")
+
+
+def gmail_history_ids(
+    service: Resource,
+    start_history_id: str,
+    user_key: Hashable | None = None,
+    label_id: str | None = None,
+) -> Tuple[list[str], str]:
+    """
+    List IDs of messages added to the mailbox since start_history_id, only
+    those carrying label_id if given (see history_label_for_query).
+    Returns (ids oldest first, latest historyId). Raises HistoryExpiredError when
+    Gmail no longer has history that far back and a full list is needed.
+    """
+    label_filter = {"labelId": label_id} if label_id else {}
+    ids: list[str] = []
+    seen: set[str] = set()
+    latest_history_id = start_history_id
+    page_token = None
+
+    while True:
+        try:
+            resp = quota.execute(
+                service.users()
+                .history()
+                .list(
+                    userId="me",
+                    startHistoryId=start_history_id,
+                    historyTypes=["messageAdded"],
+                    pageToken=page_token,
+                    **label_filter,
+                ),
+                "gmail",
+                GMAIL_UNITS["history.list"],
+                user_key,
+            )
+        except HttpError as e:
+            if getattr(e.resp, "status", None) == 404:
+                raise HistoryExpiredError(f"historyId {start_history_id} is no longer available") from e
+            raise
+
+        for record in resp.get("history", []):
+            for added in record.get("messagesAdded", []):
+                message = added.get("message", {})
+                message_id = message.get("id")
+                if not message_id or message_id in seen:
+                    continue
+                labels = message.get("labelIds", [])
+                if HISTORY_EXCLUDED_LABELS.intersection(labels) or (label_id and label_id not in labels):
+                    continue
+                seen.add(message_id)
+                ids.append(message_id)
+
+        latest_history_id = resp.get("historyId", latest_history_id)
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            break
+
+    return ids, latest_history_id
+
+
+def gmail_list_ids(service: Resource, q: str, max_list: int | None = 50, user_key: Hashable | None = None) -> list[str]:
+    """
+    List message IDs matching query.
+    - max_list=None => fetch all pages (no cap; beware quota/time).
+    Exact time cutoffs should be pushed into the query as `after:<epoch seconds>`.
+    """
+    ids: list[str] = []
+
+    # Page size is capped by Gmail at 100 anyway
+    page_size = 100 if max_list is None else min(100, max_list if max_list > 0 else 100)
+
+    for page in gmail_list_pages(service, q, page_size, user_key):
+        ids.extend(page)
+
+        # Stop if we reached requested max
+        if max_list is not None and len(ids) >= max_list:
+            return ids[:max_list]
+
+    return ids
+
+
+def gmail_list_pages(service: Resource, q: str, page_size: int = 100, user_key: Hashable | None = None) -> Iterator[list[str]]:
+    """Yield the message IDs matching query one page at a time (newest first); stop iterating to stop listing."""
+    page_token = None
+    while True:
+        resp = quota.execute(
+            service.users()
+            .messages()
+            .list(userId="me", q=q, maxResults=page_size, pageToken=page_token),
+            "gmail",
+            GMAIL_UNITS["messages.list"],
+            user_key,
+        )
+        yield [m["id"] for m in resp.get("messages", [])]
+
+        page_token = resp.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def batch_get_messages(
+    service: Resource,
+    message_ids: Iterable[str],
+    format: str = "full",
+    metadata_headers: list[str] | None = None,
+    batch_size: int = GMAIL_BATCH_SIZE,
+    user_key: Hashable | None = None,
+) -> Iterator[Tuple[str, dict | None, Exception | None]]:
+    """
+    Fetch messages with Gmail batch HTTP requests, one round-trip per chunk.
+    Yields (message_id, message, error) in input order; exactly one of
+    message/error is set, so a failing item never aborts the rest of the batch.
+    Items failing with a retryable error (429, 5xx, rate-limit 403) are
+    re-sent in a smaller batch after a backoff.
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    message_ids = list(message_ids)
+
+    for start in range(0, len(message_ids), batch_size):
+        chunk = message_ids[start:start + batch_size]
+        results: dict[str, Tuple[dict | None, Exception | None]] = {}
+        todo = chunk
+        attempt = 0
+
+        while todo:
+            responses: dict[str, Tuple[dict | None, Exception | None]] = {}
+
+            def on_response(request_id, response, exception):
+                responses[request_id] = (response, exception)
+
+            batch = service.new_batch_http_request(callback=on_response)
+            for message_id in todo:
+                kwargs = {"userId": "me", "id": message_id, "format": format}
+                if format == "metadata":
+                    kwargs["metadataHeaders"] = metadata_headers or []
+                batch.add(service.users().messages().get(**kwargs), request_id=message_id)
+
+            # Batches are billed per inner call
+            quota.acquire("gmail", GMAIL_UNITS["messages.get"] * len(todo), user_key)
+            quota.count("gmail", "calls", len(todo))
+            try:
+                with quota.limiter("gmail"):
+                    batch.execute()
+            except Exception as e:
+                # The whole batch failed (e.g. transport error); report it per item
+                logger.error(f"Gmail batch fetch FAILED - {len(todo)} message(s) | Error: {str(e)}")
+                for message_id in todo:
+                    responses.setdefault(message_id, (None, e))
+
+            errors = [responses[m][1] for m in todo if m in responses and responses[m][1] is not None]
+            throttled = sum(1 for e in errors if quota.is_throttle(e))
+            if throttled:
+                quota.limiter("gmail").on_throttle()
+                quota.count("gmail", "throttled", throttled)
+            elif len(errors) < len(todo):
+                quota.limiter("gmail").on_success()
+
+            retry = []
+            for message_id in todo:
+                message, error = responses.get(message_id, (None, None))
+                if error is not None and attempt < GOOGLE_API_MAX_RETRIES and quota.is_retryable(error):
+                    retry.append(message_id)
+                else:
+                    results[message_id] = (message, error)
+                    if error is not None:
+                        quota.count("gmail", "failed")
+
+            if retry:
+                delay = quota.backoff_delay(attempt, errors[0] if errors else None)
+                logger.warning(f"Gmail batch retrying {len(retry)} message(s) in {delay:.2f}s (attempt {attempt + 1}/{GOOGLE_API_MAX_RETRIES})")
+                quota.count("gmail", "retried", len(retry))
+                time.sleep(delay)
+                attempt += 1
+            todo = retry
+
+        for message_id in chunk:
+            message, error = results.get(message_id, (None, None))
+            if message is None and error is None:
+                error = RuntimeError("No response in Gmail batch")
+            yield message_id, message, error
@@ -0,0 +1,73 @@
+"""
+HTML email -> plain text.
+
+The single extraction stage used for both the stored Email.body and the ML
+prompt. One lxml parse (libxml2, C) and an iterative walk over the tree,
+instead of BeautifulSoup's Python-level tree plus repeated find_all passes.
+"""
+
+from __future__ import annotations
+import re
+from lxml import etree
+import lxml.html
+
+# Subtrees that never contain readable text
+SKIP_TAGS = {"script", "style", "meta", "link", "noscript", "template", "svg", "head"}
+
+# Tags that start and end a line of text
+BLOCK_TAGS = {
+    "address", "article", "aside", "blockquote", "br", "dd", "div", "dl", "dt", "fieldset", "figcaption",
+    "figure", "footer", "form", "h1", "h2", "h3", "h4", "h5", "h6", "header", "hr", "li", "main", "nav",
+    "ol", "p", "pre", "section", "table", "tbody", "thead", "tfoot", "tr", "ul",
+}
+
+# Tags separating cells on the same line
+CELL_TAGS = {"td", "th"}
+
+_HORIZONTAL_WS = re.compile(r"[ \t\r\f\v\u00a0\u200b\u200c\u200d\ufeff]+")
+
+
+def _parse(html: str):
+    try:
+        return lxml.html.fromstring(html)
+    except ValueError:
+        # Unicode strings with an XML encoding declaration must be parsed as bytes
+        return lxml.html.fromstring(html.encode("utf-8"))
+
+
+def html_to_text(html: str) -> str:
+    """Readable text of an HTML body: one line per block, blank lines and padding removed."""
+    if not html or not html.strip():
+        return ""
+    try:
+        root = _parse(html)
+    except (etree.ParserError, ValueError):
+        return ""
+
+    chunks: list[str] = []
+    stack: list[tuple] = [(root, False)]
+    while stack:
+        el, closing = stack.pop()
+        tag = el.tag if isinstance(el.tag, str) else None
+        if closing:
+            if tag in BLOCK_TAGS:
+                chunks.append("\n")
+            elif tag in CELL_TAGS:
+                chunks.append(" ")
+            if el.tail:
+                chunks.append(el.tail)
+            continue
+        # Comments, processing instructions and skipped subtrees keep only their tail
+        if tag is None or tag.lower() in SKIP_TAGS:
+            if el.tail:
+                chunks.append(el.tail)
+            continue
+        if tag in BLOCK_TAGS:
+            chunks.append("\n")
+        if el.text:
+            chunks.append(el.text)
+        stack.append((el, True))
+        stack.extend((child, False) for child in reversed(el))
+
+    lines = (_HORIZONTAL_WS.sub(" ", line).strip() for line in "".join(chunks).split("\n"))
+    return "\n".join(line for line in lines if line)
@@ -0,0 +1,194 @@
+"""
+Background /fetch-emails jobs.
+Jobs are persisted in the fetch_jobs table (so any gunicorn worker can report
+progress) and run on an in-process thread pool through the same pipeline as
+the request/response mode.
+
+Jobs are not durable: the pool and the job's credentials live in the worker
+process, so a restart (deploy, gunicorn timeout, crash) loses whatever it was
+running. Each process refreshes heartbeat_at on the jobs it owns; a queued or
+running job whose heartbeat is older than JOB_STALE_SECONDS is marked failed
+(at startup and when it is polled), so clients stop waiting and can resubmit.
+"""
+
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict
+from sqlalchemy import or_, select, update
+from server.config import JOB_STALE_SECONDS, JOB_WORKERS
+from server.db import db_session, FetchJob
+from server.pipeline import run_fetch, collect_fetch_result, fetch_params_to_kwargs
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between progress writes while a job runs
+PROGRESS_INTERVAL = 1.0
+# Heartbeats per JOB_STALE_SECONDS, so a few missed writes don't fail a live job
+HEARTBEATS_PER_STALE_PERIOD = 4
+
+STALE_JOB_ERROR = "The server process running this job stopped before it finished (jobs do not survive restarts); start a new fetch"
+
+_executor: ThreadPoolExecutor | None = None
+_executor_pid: int | None = None
+_executor_lock = threading.Lock()
+# Ids of this process's queued and running jobs, kept alive by the heartbeat thread
+_owned_jobs: set[int] = set()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    """Return this process's job pool, created lazily so each forked gunicorn worker gets its own."""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            _executor = ThreadPoolExecutor(max_workers=max(1, JOB_WORKERS), thread_name_prefix="fetch-job")
+            _executor_pid = os.getpid()
+            _owned_jobs.clear()
+            threading.Thread(target=_heartbeat_loop, args=(_executor_pid,), name="fetch-job-heartbeat", daemon=True).start()
+        return _executor
+
+
+def _heartbeat_loop(pid: int):
+    while _executor_pid == pid:
+        time.sleep(JOB_STALE_SECONDS / HEARTBEATS_PER_STALE_PERIOD)
+        with _executor_lock:
+            job_ids = list(_owned_jobs)
+        if not job_ids:
+            continue
+        try:
+            with db_session() as s:
+                s.execute(update(FetchJob).where(FetchJob.id.in_(job_ids)).values(heartbeat_at=datetime.now(timezone.utc)))
+        except Exception as e:
+            logger.warning(f"Fetch job heartbeat FAILED - Jobs: {job_ids} | Error: {str(e)}")
+
+
+def fail_stale_jobs(job_id: int | None = None) -> int:
+    """
+    Mark queued/running jobs (or just job_id) whose heartbeat is older than
+    JOB_STALE_SECONDS as failed: the process that owned them is gone.
+    Returns how many were marked.
+    """
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=JOB_STALE_SECONDS)
+    stmt = (
+        update(FetchJob)
+        .where(FetchJob.status.in_(("queued", "running")))
+        .where(or_(FetchJob.heartbeat_at.is_(None), FetchJob.heartbeat_at < cutoff))
+        .values(status="failed", error=STALE_JOB_ERROR, finished_at=datetime.now(timezone.utc))
+    )
+    if job_id is not None:
+        stmt = stmt.where(FetchJob.id == job_id)
+    with db_session() as s:
+        failed = s.execute(stmt).rowcount
+    if failed:
+        logger.warning(f"Marked {failed} stale fetch job(s) failed - no heartbeat for {JOB_STALE_SECONDS:.0f}s")
+    return failed
+
+
+def enqueue_fetch_job(user_id: int, credentials, params: Dict[str, Any]) -> int:
+    """Persist a queued job and schedule it on the worker pool. Returns the job id."""
+    with db_session() as s:
+        job = FetchJob(user_id=user_id, status="queued", params=params, heartbeat_at=datetime.now(timezone.utc))
+        s.add(job)
+        s.flush()
+        job_id = job.id
+    executor = _get_executor()
+    with _executor_lock:
+        _owned_jobs.add(job_id)
+    executor.submit(_run_job, job_id, user_id, credentials, params)
+    return job_id
+
+
+def _run_job(job_id: int, user_id: int, credentials, params: Dict[str, Any]):
+    try:
+        _run_owned_job(job_id, user_id, credentials, params)
+    finally:
+        with _executor_lock:
+            _owned_jobs.discard(job_id)
+
+
+def _run_owned_job(job_id: int, user_id: int, credentials, params: Dict[str, Any]):
+    with db_session() as s:
+        job = s.get(FetchJob, job_id)
+        job.status = "running"
+        job.started_at = datetime.now(timezone.utc)
+        job.heartbeat_at = job.started_at
+
+    counters = {"considered": 0, "created": 0, "skipped": 0, "errors": 0}
+    last_write = 0.0
+
+    def save_progress():
+        with db_session() as s:
+            job = s.get(FetchJob, job_id)
+            for name, value in counters.items():
+                setattr(job, name, value)
+
+    def on_record(record: Dict[str, Any]):
+        nonlocal last_write
+        if record["type"] == "listed":
+            # Already-processed mail is dropped before the per-message records; count it from the start
+            counters["skipped"] += record["skipped_known"]
+            save_progress()
+            last_write = time.monotonic()
+            return
+        if record["type"] != "message":
+            return
+        counters["considered"] += 1
+        status = record["status"]
+        if status in ("created", "pending"):
+            counters["created"] += 1
+        elif status in ("skipped", "already_processed", "out_of_range", "triaged"):
+            counters["skipped"] += 1
+        elif status == "error":
+            counters["errors"] += 1
+        if time.monotonic() - last_write >= PROGRESS_INTERVAL:
+            save_progress()
+            last_write = time.monotonic()
+
+    try:
+        result = collect_fetch_result(run_fetch(user_id, credentials, **fetch_params_to_kwargs(params)), on_record=on_record)
+    except Exception as e:
+        logger.error(f"Fetch emails job {job_id} FAILED - Error: {str(e)}")
+        with db_session() as s:
+            job = s.get(FetchJob, job_id)
+            for name, value in counters.items():
+                setattr(job, name, value)
+            job.status = "failed"
+            job.error = str(e)
+            job.finished_at = datetime.now(timezone.utc)
+        return
+
+    with db_session() as s:
+        job = s.get(FetchJob, job_id)
+        for name, value in counters.items():
+            setattr(job, name, value)
+        job.status = "completed"
+        job.result = result
+        job.finished_at = datetime.now(timezone.utc)
+    logger.info(f"Fetch emails job {job_id} completed: {counters}")
+
+
+def get_job(user_id: int, job_id: int) -> Dict[str, Any] | None:
+    """Return a job's status and counters, or None if it doesn't belong to the user."""
+    fail_stale_jobs(job_id)
+    with db_session() as s:
+        stmt = select(FetchJob).where(FetchJob.id == job_id).where(FetchJob.user_id == user_id)
+        job = s.execute(stmt).scalar_one_or_none()
+        if not job:
+            return None
+        return {
+            "id": job.id,
+            "status": job.status,
+            "considered": job.considered,
+            "created": job.created,
+            "skipped": job.skipped,
+            "errors": job.errors,
+            "result": job.result,
+            "error": job.error,
+            "created_at": job.created_at.isoformat() if job.created_at else None,
+            "started_at": job.started_at.isoformat() if job.started_at else None,
+            "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+        }
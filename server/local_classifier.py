@@ -0,0 +1,364 @@
+"""
+First-pass should_create classifier trained on our own decisions.
+
+Every email the LLM (or the user, by confirming or deleting what it produced)
+decided carries a label: it either produced a task or calendar event
+(positive) or was skipped (negative). Emails decided by this classifier, by
+triage or by the fallback are left out, so the model never trains on its own
+or a rule's guesses. A multinomial naive
+Bayes model over hashed sender / subject / body tokens is fitted on those
+labels, globally and per user once they have LOCAL_CLASSIFIER_MIN_EXAMPLES
+emails, and stored in local_classifier_models. With LOCAL_CLASSIFIER_SKIP_CONFIDENCE
+set, ml_decide consults it before calling OpenAI: emails it is at least that
+sure are not tasks are skipped outright, and with LOCAL_CLASSIFIER_CREATE_CONFIDENCE
+set, sure positives become tasks titled after the subject. Anything less
+certain, and anything that looks like a meeting invite (the model cannot fill
+in a calendar event), goes to the LLM as before.
+
+Usage:
+    python -m server.local_classifier --retrain [--user ID] [--holdout 0.2]
+    python -m server.local_classifier                  # stored models and their held-out metrics
+
+--retrain holds out a slice of the labelled emails, reports the LLM-call
+reduction and agreement the thresholds would give on it, then fits the
+stored model on everything.
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import logging
+import math
+import re
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+from email.utils import parseaddr
+from typing import Any, Dict, Iterable
+from sqlalchemy import exists, select
+from sqlalchemy.orm import undefer
+from server.config import (
+    LOCAL_CLASSIFIER_SKIP_CONFIDENCE, LOCAL_CLASSIFIER_CREATE_CONFIDENCE, LOCAL_CLASSIFIER_MIN_EXAMPLES, TEXT_REDUCTION_RULES,
+)
+from server.db import db_session, CalendarEvent, Email, LocalClassifierModel, Task
+from server.html_text import html_to_text
+from server.text_reduction import parse_rules, reduce_payload
+
+logger = logging.getLogger(__name__)
+
+# Hashed feature space and Laplace smoothing
+BUCKETS = 1 << 18
+ALPHA = 1.0
+# Characters of body text the features are taken from (as much as the prompt sees)
+BODY_CHARS = 2000
+# Stored models are re-read from the database this often, so a retrain reaches running workers
+RELOAD_SECONDS = 300
+# Email.decided_by values whose decision is a training label
+TRAINING_DECIDERS = ("llm", "tier1", "tier2", "user")
+# Mail that may be an invitation; only the LLM extracts the meeting, so it is never decided locally
+_MEETING_HINT = re.compile(
+    r"\b(meeting|invit(e|ed|ation)|webinar|appointment|interview|rsvp|agenda|conference call)\b|^\s*when\s*:"
+    r"|meet\.google\.com|zoom\.us/|teams\.microsoft\.com|webex\.com",
+    re.I | re.M,
+)
+# Confidence levels reported by --retrain alongside the configured thresholds
+SWEEP = (0.9, 0.95, 0.98, 0.99, 0.995, 0.999)
+
+_TOKEN = re.compile(r"[a-z0-9][a-z0-9'_-]{1,29}")
+
+_lock = threading.Lock()
+_counters = {"skipped": 0, "created": 0, "passed": 0, "meetings": 0, "no_model": 0, "errors": 0}
+_models: Dict[str, tuple[float, Dict[str, Any] | None]] = {}
+
+
+def enabled() -> bool:
+    return LOCAL_CLASSIFIER_SKIP_CONFIDENCE > 0 or LOCAL_CLASSIFIER_CREATE_CONFIDENCE > 0
+
+
+def _count(name: str, n: int = 1):
+    with _lock:
+        _counters[name] += n
+
+
+def user_scope(user_id: int) -> str:
+    return f"user:{user_id}"
+
+
+# --- Features and model --------------------------------------------------------
+
+def _email_text(payload: Dict[str, Any]) -> tuple[str, str]:
+    body = payload.get("body") or ""
+    if not body and payload.get("html"):
+        body = html_to_text(payload["html"])
+    return payload.get("subject") or "", (body or payload.get("snippet") or "")[:BODY_CHARS]
+
+
+def features(payload: Dict[str, Any]) -> list[int]:
+    """Hashed buckets of the sender address and domain, subject words and bigrams, and body words (each counted once)."""
+    address = parseaddr(payload.get("sender") or "")[1].lower()
+    subject, body = _email_text(payload)
+    subject_words = _TOKEN.findall(subject.lower())
+    tokens = [f"from:{address}", f"domain:{address.rpartition('@')[2]}"]
+    tokens += [f"s:{w}" for w in subject_words]
+    tokens += [f"s2:{a} {b}" for a, b in zip(subject_words, subject_words[1:])]
+    tokens += [f"b:{w}" for w in _TOKEN.findall(body.lower())]
+    return sorted({zlib.crc32(t.encode("utf-8")) % BUCKETS for t in tokens})
+
+
+def fit(examples: Iterable[tuple[list[int], bool]]) -> Dict[str, Any]:
+    """Naive Bayes counts from (features, should_create) pairs; JSON-serializable."""
+    docs = [0, 0]
+    totals = [0, 0]
+    counts: Dict[str, list[int]] = {}
+    for feats, label in examples:
+        c = int(label)
+        docs[c] += 1
+        totals[c] += len(feats)
+        for f in feats:
+            counts.setdefault(str(f), [0, 0])[c] += 1
+    return {"buckets": BUCKETS, "docs": docs, "totals": totals, "counts": counts}
+
+
+def predict(model: Dict[str, Any], feats: list[int]) -> float:
+    """Probability that the email should become a task."""
+    counts = model["counts"]
+    vocabulary = len(counts) + 1
+    docs = sum(model["docs"])
+    scores = []
+    for c in (0, 1):
+        denominator = model["totals"][c] + ALPHA * vocabulary
+        score = math.log((model["docs"][c] + ALPHA) / (docs + 2 * ALPHA))
+        for f in feats:
+            score += math.log((counts.get(str(f), (0, 0))[c] + ALPHA) / denominator)
+        scores.append(score)
+    return 1.0 / (1.0 + math.exp(max(-700.0, min(700.0, scores[0] - scores[1]))))
+
+
+# --- Cascade stage ---------------------------------------------------------------
+
+def _load(scope: str) -> Dict[str, Any] | None:
+    now = time.monotonic()
+    with _lock:
+        cached = _models.get(scope)
+    if cached is not None and now - cached[0] < RELOAD_SECONDS:
+        return cached[1]
+    with db_session() as s:
+        model = s.execute(select(LocalClassifierModel.model).where(LocalClassifierModel.scope == scope)).scalar_one_or_none()
+    with _lock:
+        _models[scope] = (now, model)
+    return model
+
+
+def reset_models():
+    """Forget loaded models so the next decision re-reads them."""
+    with _lock:
+        _models.clear()
+
+
+def decide(payload: Dict[str, Any], user_id: int | None = None) -> Dict[str, Any] | None:
+    """
+    A classification result when the user's (or the global) model is confident
+    enough to stand in for the LLM, otherwise None.
+    """
+    if not enabled():
+        return None
+    if _MEETING_HINT.search("\n".join(_email_text(payload))):
+        _count("meetings")
+        return None
+    try:
+        scope = user_scope(user_id) if user_id is not None else "global"
+        model = _load(scope) if user_id is not None else None
+        if model is None:
+            scope, model = "global", _load("global")
+        if model is None:
+            _count("no_model")
+            return None
+        p_create = predict(model, features(payload))
+    except Exception as e:
+        logger.warning(f"Local classifier FAILED - Error: {str(e)}")
+        _count("errors")
+        return None
+
+    subject = payload.get("subject") or "(No subject)"
+    if LOCAL_CLASSIFIER_SKIP_CONFIDENCE > 0 and 1.0 - p_create >= LOCAL_CLASSIFIER_SKIP_CONFIDENCE:
+        _count("skipped")
+        return {
+            "should_create": False,
+            "confidence": round(1.0 - p_create, 4),
+            "title": subject,
+            "notes": "",
+            "category": None,
+            "reasoning": f"Local classifier ({scope}): not a task with p={1.0 - p_create:.4f}",
+            "meeting": None,
+            "source": "local",
+        }
+    if LOCAL_CLASSIFIER_CREATE_CONFIDENCE > 0 and p_create >= LOCAL_CLASSIFIER_CREATE_CONFIDENCE:
+        _count("created")
+        return {
+            "should_create": True,
+            "confidence": round(p_create, 4),
+            "title": subject,
+            "notes": _email_text(payload)[1],
+            "category": None,
+            "reasoning": f"Local classifier ({scope}): task with p={p_create:.4f}",
+            "meeting": None,
+            "source": "local",
+        }
+    _count("passed")
+    return None
+
+
+def local_classifier_stats() -> Dict[str, Any]:
+    with _lock:
+        stats = dict(_counters)
+    decided = stats["skipped"] + stats["created"]
+    consulted = decided + stats["passed"] + stats["meetings"] + stats["no_model"]
+    stats["llm_call_reduction"] = round(decided / consulted, 3) if consulted else 0.0
+    return stats
+
+
+# --- Training --------------------------------------------------------------------
+
+def load_examples(user_id: int | None = None) -> list[tuple[int, str, list[int], bool]]:
+    """
+    (user_id, gmail_message_id, features, should_create) for every processed
+    email decided by one of TRAINING_DECIDERS, with the stored body reduced
+    the way ml_decide reduces it.
+    """
+    has_task = exists().where(Task.email_id == Email.id)
+    has_event = exists().where(CalendarEvent.email_id == Email.id)
+    query = (
+        select(Email, has_task | has_event)
+        .where(Email.processed.is_(True), Email.decided_by.in_(TRAINING_DECIDERS))
+        .options(undefer(Email.legacy_body), undefer(Email.body_blob))
+        .order_by(Email.id)
+        .execution_options(yield_per=500)
+    )
+    if user_id is not None:
+        query = query.where(Email.user_id == user_id)
+    rules = parse_rules(TEXT_REDUCTION_RULES)
+    examples = []
+    with db_session() as s:
+        for email_row, label in s.execute(query):
+            payload = {"subject": email_row.subject, "sender": email_row.sender, "snippet": email_row.snippet, "body": email_row.body}
+            if rules:
+                payload = reduce_payload(payload, rules, record=False)
+            examples.append((email_row.user_id, email_row.gmail_message_id, features(payload), bool(label)))
+    return examples
+
+
+def _held_out(message_id: str, holdout: float) -> bool:
+    return zlib.crc32(message_id.encode("utf-8")) % 1000 < holdout * 1000
+
+
+def _cascade_metrics(probabilities: list[tuple[float, bool]], skip_confidence: float, create_confidence: float) -> Dict[str, Any]:
+    decided = agreed = 0
+    for p_create, label in probabilities:
+        if skip_confidence > 0 and 1.0 - p_create >= skip_confidence:
+            decided += 1
+            agreed += not label
+        elif create_confidence > 0 and p_create >= create_confidence:
+            decided += 1
+            agreed += label
+    return {
+        "llm_call_reduction": round(decided / len(probabilities), 4) if probabilities else 0.0,
+        "agreement": round(agreed / decided, 4) if decided else None,
+        "decided": decided,
+    }
+
+
+def evaluate(model: Dict[str, Any], examples: list[tuple[list[int], bool]]) -> Dict[str, Any]:
+    """LLM-call reduction and agreement with the stored decisions, at the configured thresholds and across SWEEP."""
+    probabilities = [(predict(model, feats), label) for feats, label in examples]
+    return {
+        "held_out": len(probabilities),
+        "accuracy": round(sum((p >= 0.5) == label for p, label in probabilities) / len(probabilities), 4) if probabilities else None,
+        **_cascade_metrics(probabilities, LOCAL_CLASSIFIER_SKIP_CONFIDENCE, LOCAL_CLASSIFIER_CREATE_CONFIDENCE),
+        "skip_sweep": {str(c): _cascade_metrics(probabilities, c, 0) for c in SWEEP},
+        "create_sweep": {str(c): _cascade_metrics(probabilities, 0, c) for c in SWEEP},
+    }
+
+
+def train_scope(scope: str, user_id: int | None, examples: list[tuple[int, str, list[int], bool]], holdout: float = 0.2) -> Dict[str, Any]:
+    """Evaluate on a held-out slice, then fit on all examples and store the model under scope."""
+    positives = sum(1 for e in examples if e[3])
+    report: Dict[str, Any] = {"scope": scope, "examples": len(examples), "positives": positives}
+    if positives == 0 or positives == len(examples):
+        report["status"] = "skipped: needs both task and non-task emails"
+        return report
+    train = [(feats, label) for _, message_id, feats, label in examples if not _held_out(message_id, holdout)]
+    test = [(feats, label) for _, message_id, feats, label in examples if _held_out(message_id, holdout)]
+    report["metrics"] = evaluate(fit(train), test)
+    model = fit((feats, label) for _, _, feats, label in examples)
+    now = datetime.now(timezone.utc)
+    with db_session() as s:
+        row = s.get(LocalClassifierModel, scope)
+        if row is None:
+            row = LocalClassifierModel(scope=scope, user_id=user_id)
+            s.add(row)
+        row.model = model
+        row.examples = len(examples)
+        row.metrics = report["metrics"]
+        row.trained_at = now
+    with _lock:
+        _models.pop(scope, None)
+    report["status"] = "trained"
+    logger.info(
+        f"Local classifier trained - Scope: {scope} | Examples: {len(examples)} | "
+        f"Held-out LLM-call reduction: {report['metrics']['llm_call_reduction']} | Agreement: {report['metrics']['agreement']}"
+    )
+    return report
+
+
+def retrain(user_id: int | None = None, holdout: float = 0.2, min_examples: int = LOCAL_CLASSIFIER_MIN_EXAMPLES) -> list[Dict[str, Any]]:
+    """
+    Retrain one user's model, or (without user_id) the global model plus a
+    model for every user with at least min_examples labelled emails.
+    """
+    examples = load_examples(user_id)
+    by_user: Dict[int, list] = {}
+    for example in examples:
+        by_user.setdefault(example[0], []).append(example)
+    reports = []
+    if user_id is None:
+        reports.append(train_scope("global", None, examples, holdout))
+    for uid, user_examples in sorted(by_user.items()):
+        if len(user_examples) >= min_examples:
+            reports.append(train_scope(user_scope(uid), uid, user_examples, holdout))
+        else:
+            reports.append({"scope": user_scope(uid), "examples": len(user_examples), "status": f"skipped: fewer than {min_examples} examples"})
+    return reports
+
+
+def model_report() -> list[Dict[str, Any]]:
+    with db_session() as s:
+        rows = s.execute(
+            select(LocalClassifierModel.scope, LocalClassifierModel.examples, LocalClassifierModel.trained_at, LocalClassifierModel.metrics)
+            .order_by(LocalClassifierModel.scope)
+        ).all()
+    return [
+        {"scope": scope, "examples": examples, "trained_at": trained_at.isoformat(), "metrics": metrics}
+        for scope, examples, trained_at, metrics in rows
+    ]
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Train and inspect the local first-pass classifier.")
+    parser.add_argument("--retrain", action="store_true", help="retrain from processed emails and their tasks")
+    parser.add_argument("--user", type=int, help="only retrain this user's model")
+    parser.add_argument("--holdout", type=float, default=0.2, help="share of emails held out for the reported metrics")
+    parser.add_argument("--min-examples", type=int, default=LOCAL_CLASSIFIER_MIN_EXAMPLES)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    from server.db import init_db
+    init_db()
+    if args.retrain:
+        print(json.dumps(retrain(args.user, args.holdout, args.min_examples), indent=2))
+    else:
+        print(json.dumps(model_report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
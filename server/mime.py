@@ -0,0 +1,146 @@
+"""
+Gmail message payload -> the flat dict the pipeline works with.
+Kept free of Flask/DB imports so it can run in parse worker processes.
+"""
+
+from __future__ import annotations
+import base64
+from datetime import datetime, timezone
+from typing import Tuple
+from server.config import MIME_PART_MAX_BYTES
+from server.html_text import html_to_text
+
+
+def header_index(payload: dict) -> dict[str, str]:
+    """Lower-cased header name -> value (first occurrence wins), built once per part."""
+    index: dict[str, str] = {}
+    for header in payload.get("headers", []):
+        index.setdefault(header.get("name", "").lower(), header.get("value"))
+    return index
+
+def get_header(payload: dict, name: str, index: dict[str, str] | None = None) -> str | None:
+    if index is None:
+        index = header_index(payload)
+    return index.get(name.lower())
+
+def _part_charset(headers: dict[str, str]) -> str:
+    lower = (headers.get("content-type") or "").lower()
+    if "charset=" not in lower:
+        return "utf-8"
+    charset = lower.split("charset=", 1)[1]
+    if ";" in charset:
+        charset = charset.split(";", 1)[0]
+    return charset.strip().strip('"').strip("'") or "utf-8"
+
+def decode_part_text(part: dict, max_bytes: int | None = None, headers: dict[str, str] | None = None) -> str:
+    """
+    Decode a part's inline body. With max_bytes, only the leading base64 needed
+    for that many bytes is decoded, so huge parts cost no more than the cap.
+    """
+    body = part.get("body", {})
+    data = body.get("data")
+    if not data:
+        return ""
+    if max_bytes is not None and len(data) > (max_bytes + 2) // 3 * 4:
+        data = data[:(max_bytes + 2) // 3 * 4]
+    raw = base64.urlsafe_b64decode(data.encode("utf-8") + b"=" * (-len(data) % 4))
+    charset = _part_charset(headers if headers is not None else header_index(part))
+    try:
+        return raw.decode(charset, errors="replace")
+    except Exception:
+        return raw.decode("utf-8", errors="replace")
+
+def _is_attachment(part: dict, headers: dict[str, str]) -> bool:
+    if part.get("filename"):
+        return True
+    if (headers.get("content-disposition") or "").strip().lower().startswith("attachment"):
+        return True
+    # Bodies Gmail didn't inline have to be fetched separately; never worth it here
+    return bool(part.get("body", {}).get("attachmentId")) and not part.get("body", {}).get("data")
+
+def gather_bodies(payload: dict, max_bytes: int | None = MIME_PART_MAX_BYTES) -> Tuple[str, str]:
+    """
+    Return (first non-empty text/plain, first non-empty text/html) in one
+    depth-first pass. Attachments are skipped, each part is decoded up to
+    max_bytes, and once a plain-text body is found nothing else is decoded
+    (the HTML is only needed when there is no text, so it comes back "").
+    """
+    html = ""
+    stack = [payload] if payload else []
+    while stack:
+        part = stack.pop()
+        children = part.get("parts")
+        if children:
+            stack.extend(reversed(children))
+            continue
+        mime = (part.get("mimeType") or "").lower()
+        if not (mime.startswith("text/plain") or (mime.startswith("text/html") and not html)):
+            continue
+        headers = header_index(part)
+        if _is_attachment(part, headers):
+            continue
+        decoded = decode_part_text(part, max_bytes=max_bytes, headers=headers)
+        if not decoded.strip():
+            continue
+        if mime.startswith("text/plain"):
+            return decoded, ""
+        html = decoded
+    return "", html
+
+class ParsedMessage:
+    """
+    A Gmail message reduced to the fields the pipeline uses. The raw HTML is
+    dropped once the text body has been extracted. .get() mirrors dict.get so
+    code written for payload dicts (ml.classify_and_generate_task,
+    get_or_create_email) accepts it unchanged.
+    """
+
+    __slots__ = ("message_id", "thread_id", "subject", "sender", "received_at", "body", "snippet")
+
+    def __init__(
+        self,
+        message_id: str = "",
+        thread_id: str = "",
+        subject: str = "(No subject)",
+        sender: str = "",
+        received_at: str | None = None,
+        body: str = "",
+        snippet: str = "",
+    ):
+        self.message_id = message_id
+        self.thread_id = thread_id
+        self.subject = subject
+        self.sender = sender
+        self.received_at = received_at
+        self.body = body
+        self.snippet = snippet
+
+    def get(self, key: str, default=None):
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def __repr__(self) -> str:
+        return f"ParsedMessage(message_id={self.message_id!r}, subject={self.subject!r})"
+
+def message_to_payload(message: dict) -> ParsedMessage:
+    payload = message.get("payload", {})
+    headers = header_index(payload)
+    text_body, html_body = gather_bodies(payload)
+    body = text_body or html_to_text(html_body)
+
+    internal = message.get("internalDate")
+    received_at = None
+    if internal:
+        try:
+            received_at = datetime.fromtimestamp(int(internal) / 1000, tz=timezone.utc).isoformat()
+        except Exception:
+            received_at = None
+
+    return ParsedMessage(
+        message_id=message.get("id", ""),
+        thread_id=message.get("threadId", ""),
+        subject=headers.get("subject") or "(No subject)",
+        sender=headers.get("from") or "",
+        received_at=received_at,
+        body=body.strip(),
+        snippet=message.get("snippet", ""),
+    )
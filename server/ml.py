@@ -9,53 +9,296 @@ Uses OpenAI API to:
 
 from __future__ import annotations
 import os
+import asyncio
+import hashlib
 import json
-import re
 import logging
-from typing import Dict, Any, Optional, Union
-from bs4 import BeautifulSoup
+import re
+import threading
+from functools import lru_cache
+from typing import AsyncIterator, Dict, Any, Iterable, Optional, Union
+from server.config import (
+    CLASSIFY_ASYNC_CONCURRENCY, CLASSIFY_ASYNC_TIMEOUT, CLASSIFY_BATCH_SIZE, CLASSIFY_BATCH_TOKENS,
+    CLASSIFY_TIER1_MODEL, CLASSIFY_TIER1_MIN_CONFIDENCE, CLASSIFY_TIER1_ESCALATE_MEETINGS, CLASSIFY_TIER2_MODEL,
+    CLASSIFY_BODY_TOKENS, CLASSIFY_BODY_TOKENS_BY_MODEL, TEXT_REDUCTION_RULES,
+    CLASSIFY_STRUCTURED_OUTPUTS, CLASSIFY_REASONING,
+    OPENAI_CONNECT_TIMEOUT, OPENAI_READ_TIMEOUT, OPENAI_MAX_RETRIES,
+    OPENAI_MAX_CONNECTIONS, OPENAI_MAX_KEEPALIVE, OPENAI_KEEPALIVE_EXPIRY,
+)
+from server import classification_cache, local_classifier, text_reduction
+from server.html_text import html_to_text
 
 logger = logging.getLogger(__name__)
 
 try:
-    from openai import OpenAI
+    from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient, DefaultAsyncHttpxClient
     OPENAI_AVAILABLE = True
 except ImportError:
     OPENAI_AVAILABLE = False
 
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# Bump whenever the classification prompt or result handling changes; it is part of the cache key
+PROMPT_VERSION = "3"
+
+# Completion tokens budgeted per answer field (value, key and punctuation); max_tokens is their sum
+# A meeting covers summary, location and times plus MEETING_PARTICIPANTS addresses of PARTICIPANT_TOKENS each
+MEETING_PARTICIPANTS = 25
+PARTICIPANT_TOKENS = 12
+FIELD_TOKENS = {
+    "id": 6, "should_create": 6, "confidence": 6, "title": 24, "notes": 140, "category": 14,
+    "reasoning": 70, "meeting": 100 + MEETING_PARTICIPANTS * PARTICIPANT_TOKENS,
+}
+# Braces and whitespace around each answer
+ANSWER_OVERHEAD_TOKENS = 8
+# Floor per answer (the old fixed cap): truncated JSON fails validation and falls back to creating a task
+MIN_ANSWER_TOKENS = 500
+
+# Characters per token assumed without tiktoken, and the most a single token is assumed to span
+CHARS_PER_TOKEN = 4
+MAX_CHARS_PER_TOKEN = 16
+
+# Replace the OpenAI / AsyncOpenAI constructors when set (see server/emulator.py)
+_openai_client_factory = None
+_async_openai_client_factory = None
+
+# One client (and so one keep-alive connection pool) per (api_key, base_url) in this process
+_clients: Dict[tuple, Any] = {}
+_clients_lock = threading.Lock()
+_http_counters = {"requests": 0, "new_connections": 0, "tls_handshakes": 0, "clients_created": 0}
+
+# Input tokens served from the provider's prompt cache vs billed in full, summed over completions
+_usage_lock = threading.Lock()
+_usage_counters = {"requests": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+
+# Which tier decided, and why tier one was overruled (two-tier mode only)
+_tier_lock = threading.Lock()
+_tier_counters = {"tier1": 0, "tier2": 0, "escalated_low_confidence": 0, "escalated_meeting": 0, "escalated_error": 0}
+
+
+def set_openai_client_factory(factory):
+    """Build chat clients with factory(**kwargs) instead of OpenAI(**kwargs); None restores the default."""
+    global _openai_client_factory
+    _openai_client_factory = factory
+    reset_openai_clients()
+
+
+def set_async_openai_client_factory(factory):
+    """Build async chat clients with factory(**kwargs) instead of AsyncOpenAI(**kwargs); None restores the default."""
+    global _async_openai_client_factory
+    _async_openai_client_factory = factory
+
+
+def _count_http(name: str):
+    with _clients_lock:
+        _http_counters[name] += 1
+
+
+def _trace(event_name: str, info: dict):
+    # httpcore reports connection setup through the request's "trace" extension;
+    # requests that never emit these events went out on a pooled keep-alive connection
+    if event_name == "connection.connect_tcp.complete":
+        _count_http("new_connections")
+    elif event_name == "connection.start_tls.complete":
+        _count_http("tls_handshakes")
+
+
+def _on_request(request):
+    _count_http("requests")
+    request.extensions["trace"] = _trace
+
+
+async def _async_trace(event_name: str, info: dict):
+    _trace(event_name, info)
+
+
+async def _on_async_request(request):
+    _count_http("requests")
+    request.extensions["trace"] = _async_trace
+
+
+def _http_options() -> Dict[str, Any]:
+    return {
+        "timeout": httpx.Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        "limits": httpx.Limits(
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+    }
+
+
+def _build_client(**kwargs):
+    http_client = DefaultHttpxClient(**_http_options(), event_hooks={"request": [_on_request]})
+    kwargs.setdefault("max_retries", OPENAI_MAX_RETRIES)
+    return OpenAI(http_client=http_client, **kwargs)
+
+
+def new_async_openai_client(**kwargs):
+    """
+    A new AsyncOpenAI client. Its connections belong to the running event loop,
+    so it is not shared through the registry: close it when the loop is done.
+    """
+    if _async_openai_client_factory is not None:
+        return _async_openai_client_factory(**kwargs)
+    http_client = DefaultAsyncHttpxClient(**_http_options(), event_hooks={"request": [_on_async_request]})
+    kwargs.setdefault("max_retries", OPENAI_MAX_RETRIES)
+    return AsyncOpenAI(http_client=http_client, **kwargs)
+
+
+def get_openai_client(**kwargs):
+    """Return the shared client for these settings, creating it on first use in this process."""
+    if _openai_client_factory is not None:
+        return _openai_client_factory(**kwargs)
+    key = tuple(sorted(kwargs.items()))
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _clients[key] = _build_client(**kwargs)
+            _http_counters["clients_created"] += 1
+        return client
+
+
+def reset_openai_clients():
+    """Close and drop every cached client (their connection pools go with them)."""
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"Closing OpenAI client FAILED - Error: {str(e)}")
+
+
+def openai_client_stats() -> Dict[str, Any]:
+    with _clients_lock:
+        stats = {**_http_counters, "clients": len(_clients)}
+    requests = stats["requests"]
+    stats["reuse_rate"] = round(1 - stats["new_connections"] / requests, 3) if requests else 0.0
+    return stats
+
+
+def _after_fork_in_child():
+    # gunicorn forks workers after importing the app. The parent's sockets are not
+    # ours to use or close, and another thread may have held the lock mid-fork.
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    _clients.clear()
+    for name in _http_counters:
+        _http_counters[name] = 0
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+def record_usage(response, model: str):
+    """Add a completion's token usage to usage_stats (and log cached vs uncached input tokens at debug level)."""
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    cached_tokens = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    with _usage_lock:
+        _usage_counters["requests"] += 1
+        _usage_counters["prompt_tokens"] += prompt_tokens
+        _usage_counters["cached_tokens"] += cached_tokens
+        _usage_counters["completion_tokens"] += completion_tokens
+    logger.debug(
+        f"OpenAI usage - Model: {model} | Prompt tokens: {prompt_tokens} | "
+        f"Cached: {cached_tokens} | Uncached: {prompt_tokens - cached_tokens} | Completion: {completion_tokens}"
+    )
+
+
+def usage_stats() -> Dict[str, Any]:
+    with _usage_lock:
+        stats = dict(_usage_counters)
+    stats["uncached_tokens"] = stats["prompt_tokens"] - stats["cached_tokens"]
+    stats["cached_ratio"] = round(stats["cached_tokens"] / stats["prompt_tokens"], 3) if stats["prompt_tokens"] else 0.0
+    return stats
+
+
+def _parse_token_overrides(raw: str) -> Dict[str, int]:
+    overrides = {}
+    for item in raw.split(","):
+        name, _, tokens = item.partition("=")
+        if name.strip() and tokens.strip().isdigit():
+            overrides[name.strip()] = int(tokens)
+    return overrides
+
+
+_body_token_overrides = _parse_token_overrides(CLASSIFY_BODY_TOKENS_BY_MODEL)
+_reduction_rules = text_reduction.parse_rules(TEXT_REDUCTION_RULES)
+
+
+def reduce_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """payload with quoted replies, signatures and disclaimers removed (see server/text_reduction.py)."""
+    return text_reduction.reduce_payload(payload, _reduction_rules) if _reduction_rules else payload
+
+
+def body_token_budget(model: str | None = None) -> int:
+    """Email-body tokens the classifier sends to model."""
+    return _body_token_overrides.get(model or "", CLASSIFY_BODY_TOKENS)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    """The tiktoken encoding for model (o200k_base for unknown names), or None without tiktoken or its data files."""
+    if not TIKTOKEN_AVAILABLE:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f"Tokenizer unavailable - Model: {model} | Error: {str(e)} | Estimating tokens from length")
+        return None
+
+
+def estimate_tokens(text: str, model: str | None = None) -> int:
+    """Token count of text for model; about 4 characters per token when tiktoken is not installed."""
+    encoding = _encoding(model or "gpt-4o-mini")
+    if encoding is None:
+        return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str | None = None) -> str:
+    """text cut to its first max_tokens tokens, with "..." appended when anything was cut."""
+    encoding = _encoding(model or "gpt-4o-mini")
+    if encoding is None:
+        limit = max_tokens * CHARS_PER_TOKEN
+        return text if len(text) <= limit else text[:limit] + "..."
+    # Only encode a head that is sure to hold more than max_tokens tokens
+    head_chars = max_tokens * MAX_CHARS_PER_TOKEN
+    tokens = encoding.encode(text[:head_chars], disallowed_special=())
+    if len(tokens) <= max_tokens and len(text) <= head_chars:
+        return text
+    return encoding.decode(tokens[:max_tokens]) + "..."
+
 
 def clean_html_to_text(html: str) -> str:
-    if not html or not html.strip():
-        return ""
-    
-    soup = BeautifulSoup(html, "lxml")
-    
-    for element in soup(["script", "style", "meta", "link"]):
-        element.decompose()
-    
-    for br in soup.find_all("br"):
-        br.replace_with("\n")
-    
-    for p in soup.find_all("p"):
-        p.insert_after("\n")
-    
-    for div in soup.find_all("div"):
-        div.insert_after("\n")
-    
-    text = soup.get_text("\n")
-    
-    text = re.sub(r'\n\s*\n\s*\n+', '\n\n', text)
-    
-    lines = [line.strip() for line in text.split('\n')]
-    text = '\n'.join(line for line in lines if line)
-    
-    return text.strip()
+    return html_to_text(html)
 
 
-def prepare_email_content(payload: Dict[str, Any]) -> Dict[str, str]:
+def prepare_email_content(payload: Dict[str, Any], model: str | None = None) -> Dict[str, str]:
     """
     Prepare email content for ML processing.
-    Extracts and cleans subject, body, and snippet.
+    Extracts and cleans subject, body, and snippet; the body is cut to
+    model's token budget (see body_token_budget).
     """
     subject = payload.get("subject", "")
     body = payload.get("body", "")
@@ -65,8 +308,8 @@ def prepare_email_content(payload: Dict[str, Any]) -> Dict[str, str]:
     if not body and html:
         body = clean_html_to_text(html)
     
-    if len(body) > 2000:
-        body = body[:2000] + "..."
+    if body:
+        body = truncate_to_tokens(body, body_token_budget(model), model)
     
     return {
         "subject": subject,
@@ -112,6 +355,326 @@ def normalize_categories(raw: list[str] | list[dict] | None) -> list[dict[str, s
     return normalized
 
 
+def format_categories_block(label: str, categories: list[dict[str, str]]) -> str:
+    """The "Available <label> Categories" section of the prompt."""
+    if not categories:
+        return f"Available {label} Categories: None"
+    return f"Available {label} Categories:\n" + "\n".join(
+        f"  - {cat['name']}" + (f": {cat['description']}" if cat['description'] else "")
+        for cat in categories
+    )
+
+
+INSTRUCTIONS = """
+You are an intelligent email assistant that helps users manage their tasks and meetings by analyzing emails.
+
+Instructions:
+
+1. Determine if the email represents:
+   a) a task to be created
+   b) a meeting invitation
+
+2. If it's a task:
+    - Generate a concise task title (3-8 words)
+    - Generate detailed task notes (2-4 sentences)
+    - Provide a confidence score (0.0-1.0)
+    - For the "category" field in your response: You MUST select one of the category names from the Available Task Categories list below, or null if none fit.
+      IMPORTANT: Use the exact category name as shown (the text after the "- " and before the colon, if present).
+      Do not include descriptions or any additional text - only the category name itself.
+{reasoning_instruction}
+
+3. If it's a meeting:
+   - Detect if it is indeed a meeting; if it is not, "meeting" is null
+   - Extract meeting details:
+       * summary: meeting title
+       * location: physical or virtual link (leave empty if unknown)
+        * start_datetime: RFC3339 UTC start time (leave empty if unknown)
+        * end_datetime: RFC3339 UTC end time (leave empty if unknown)
+        * participants: list of email addresses (leave empty list if unknown)
+        * category: For the meeting["category"] field in your response: You MUST select one of the category names from the Available Calendar Categories list below, or null if none fit.
+          IMPORTANT: Use the exact category name as shown (the text after the "- " and before the colon, if present).
+          Do not include descriptions or any additional text - only the category name itself.
+   - Use context clues like "meeting", "invite", "agenda", "call", "Zoom", "conference", "link"
+
+"""
+
+
+CLASSIFICATION_GUIDELINES = """Classification Guidelines:
+- CREATE TASK for emails that contain:
+  * Action items or requests
+  * Reminders or deadlines
+  * Meeting invitations requiring preparation
+  * Bills or payments due
+  * Follow-up items
+  * Tasks delegated to you
+  * Important information that needs review or response
+
+- DO NOT CREATE TASK for emails that are:
+  * Pure newsletters or marketing
+  * Automated notifications with no action needed
+  * Spam or promotional content
+  * Social media notifications
+  * Purely informational with no action required
+  * "FYI only" messages
+  * Auto-replies or out-of-office messages
+
+"""
+
+def _result_format(reasoning: bool) -> str:
+    """The answer shape as shown in the prompt (the JSON schema enforces it when structured outputs are on)."""
+    reasoning_field = '  "reasoning": "Brief explanation of decision",\n' if reasoning else ""
+    return (
+        "{\n"
+        '  "should_create": true/false,\n'
+        '  "confidence": 0.0-1.0,\n'
+        '  "title": "Concise task title (3-8 words)",\n'
+        '  "notes": "Detailed task description with key information",\n'
+        '  "category": "Exact category name from Available Task Categories list, or null",\n'
+        + reasoning_field
+        + '  "meeting": null unless the email is a meeting, then {\n'
+        '      "summary": "",\n'
+        '      "location": "",\n'
+        '      "start_datetime": "",\n'
+        '      "end_datetime": "",\n'
+        '      "participants": [],\n'
+        '      "category": "Exact category name from Available Calendar Categories list, or null"\n'
+        "  }\n"
+        "}\n\n"
+    )
+
+
+OUTPUT_RULES = """CRITICAL: For both "category" fields:
+- Use the EXACT category name as listed in the Available Categories sections below
+- Do NOT include descriptions, colons, or any additional text
+- Use null if no category fits
+
+For task title:
+- Make it actionable (start with a verb if appropriate)
+- Keep it under 60 characters
+- Remove "RE:", "FWD:", etc. prefixes
+
+For task notes:
+- Include key details, dates, or requirements
+- Keep it concise but informative (2-4 sentences max)
+- Extract actionable information from the email body
+"""
+
+
+def _email_prompt_block(email_content: Dict[str, str], sender: str) -> str:
+    return (
+        f"From: {sender}\n"
+        f"Subject: {email_content['subject']}\n\n"
+        f"Body:\n{email_content['body'] or email_content['snippet']}"
+    )
+
+
+def build_prompt_prefix(reasoning: bool = CLASSIFY_REASONING) -> str:
+    return (
+        INSTRUCTIONS.format(reasoning_instruction="    - Explain your reasoning\n" if reasoning else "")
+        + CLASSIFICATION_GUIDELINES
+        + "Each email is classified as a JSON object in this exact format:\n" + _result_format(reasoning)
+        + OUTPUT_RULES
+    )
+
+
+# Identical for every email, user and model, and sent first so provider-side prompt caching can reuse it
+PROMPT_PREFIX = build_prompt_prefix()
+
+
+def _categories_prompt(task_categories: list[dict[str, str]], calendar_categories: list[dict[str, str]]) -> str:
+    return (
+        "\n" + format_categories_block("Task", task_categories)
+        + "\n\n" + format_categories_block("Calendar", calendar_categories) + "\n"
+    )
+
+
+def build_classification_prompt(
+    email_content: Dict[str, str],
+    sender: str,
+    task_categories: list[dict[str, str]],
+    calendar_categories: list[dict[str, str]],
+) -> str:
+    """The single-email prompt: the static PROMPT_PREFIX, then the user's categories, then the email."""
+    return (
+        PROMPT_PREFIX
+        + _categories_prompt(task_categories, calendar_categories)
+        + "\nEmail Details:\n"
+        + _email_prompt_block(email_content, sender)
+        + "\n\nRespond ONLY with valid JSON: one object in the format above."
+    )
+
+
+def build_batch_prompt(
+    emails: list[tuple[str, Dict[str, str], str]],
+    task_categories: list[dict[str, str]],
+    calendar_categories: list[dict[str, str]],
+) -> str:
+    """One prompt for several (email_id, email_content, sender) entries; the instructions are sent once."""
+    blocks = "\n\n".join(f"### Email id: {email_id}\n{_email_prompt_block(content, sender)}" for email_id, content, sender in emails)
+    return (
+        PROMPT_PREFIX
+        + _categories_prompt(task_categories, calendar_categories)
+        + f"\nThere are {len(emails)} emails below. Classify each one independently.\n\n"
+        + blocks
+        + '\n\nRespond ONLY with valid JSON of the form {"results": [...]}, with exactly one object in the format above '
+        + 'per email id, in the same order, each with an added "id" field (the email id).'
+    )
+
+
+def classification_schema(reasoning: bool = CLASSIFY_REASONING, with_id: bool = False) -> Dict[str, Any]:
+    """JSON schema of one answer (strict structured-outputs subset: every property required, nothing extra)."""
+    category = {"type": ["string", "null"]}
+    meeting = {
+        "type": "object",
+        "properties": {
+            "summary": {"type": "string"},
+            "location": {"type": "string"},
+            "start_datetime": {"type": "string"},
+            "end_datetime": {"type": "string"},
+            "participants": {"type": "array", "items": {"type": "string"}},
+            "category": category,
+        },
+        "required": ["summary", "location", "start_datetime", "end_datetime", "participants", "category"],
+        "additionalProperties": False,
+    }
+    properties: Dict[str, Any] = {"id": {"type": "string"}} if with_id else {}
+    properties.update({
+        "should_create": {"type": "boolean"},
+        "confidence": {"type": "number"},
+        "title": {"type": "string"},
+        "notes": {"type": "string"},
+        "category": category,
+    })
+    if reasoning:
+        properties["reasoning"] = {"type": "string"}
+    properties["meeting"] = {"anyOf": [meeting, {"type": "null"}]}
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+def batch_schema(reasoning: bool = CLASSIFY_REASONING) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {"results": {"type": "array", "items": classification_schema(reasoning, with_id=True)}},
+        "required": ["results"],
+        "additionalProperties": False,
+    }
+
+
+def answer_max_tokens(schema: Dict[str, Any]) -> int:
+    """Completion tokens one answer of schema can need: the FIELD_TOKENS of its properties plus overhead, at least MIN_ANSWER_TOKENS."""
+    return max(MIN_ANSWER_TOKENS, ANSWER_OVERHEAD_TOKENS + sum(FIELD_TOKENS[name] for name in schema["properties"]))
+
+
+_JSON_TYPES = {
+    "object": dict, "array": list, "string": str, "boolean": bool, "null": type(None),
+    "number": (int, float), "integer": int,
+}
+
+
+def validate_answer(value: Any, schema: Dict[str, Any], path: str = "$"):
+    """Check value against the schema subset classification_schema uses; raises ValueError naming the first mismatch."""
+    if "anyOf" in schema:
+        errors = []
+        for option in schema["anyOf"]:
+            try:
+                return validate_answer(value, option, path)
+            except ValueError as e:
+                errors.append(str(e))
+        raise ValueError(" and ".join(errors))
+    types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+    # bool is an int subclass, but true is not a number in JSON
+    if not any(isinstance(value, _JSON_TYPES[t]) and not (isinstance(value, bool) and t in ("number", "integer")) for t in types):
+        raise ValueError(f"{path} should be {' or '.join(types)}, got {type(value).__name__}")
+    if isinstance(value, dict):
+        missing = [name for name in schema.get("required", []) if name not in value]
+        if missing:
+            raise ValueError(f"{path} is missing {', '.join(missing)}")
+        extra = [name for name in value if name not in schema.get("properties", {})]
+        if extra and schema.get("additionalProperties") is False:
+            raise ValueError(f"{path} has unexpected {', '.join(extra)}")
+        for name, subschema in schema.get("properties", {}).items():
+            if name in value:
+                validate_answer(value[name], subschema, f"{path}.{name}")
+    elif isinstance(value, list) and "items" in schema:
+        for i, item in enumerate(value):
+            validate_answer(item, schema["items"], f"{path}[{i}]")
+
+
+def chat_request(prompt: str, model: str, batch_size: int = 0) -> Dict[str, Any]:
+    """
+    Keyword arguments for chat.completions.create (also the body of a Batch
+    API request line). batch_size > 0 asks for a {"results": [...]} answer
+    covering that many emails; max_tokens is sized from the answer schema.
+    """
+    schema = batch_schema() if batch_size else classification_schema()
+    if batch_size:
+        max_tokens = ANSWER_OVERHEAD_TOKENS + batch_size * answer_max_tokens(schema["properties"]["results"]["items"])
+    else:
+        max_tokens = answer_max_tokens(schema)
+    if CLASSIFY_STRUCTURED_OUTPUTS:
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {"name": "classifications" if batch_size else "classification", "strict": True, "schema": schema},
+        }
+    else:
+        response_format = {"type": "json_object"}
+    return {
+        "model": model,
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are a helpful email classification assistant. Always respond with valid JSON only."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ],
+        "temperature": 0.3,
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+    }
+
+
+def _classification_from_json(result: Any, email_content: Dict[str, str], schema: Dict[str, Any] | None = None) -> Dict[str, Any]:
+    """
+    Turn the model's JSON answer for one email into the classification dict.
+    Raises ValueError if the answer does not match schema (classification_schema() by default).
+    """
+    validate_answer(result, schema or classification_schema())
+    subject = email_content.get("subject", "(No subject)")
+    should_create = result["should_create"]
+    confidence = min(max(float(result["confidence"]), 0.0), 1.0)
+    reasoning = result.get("reasoning", "")[:500]
+    title = (result["title"] or email_content["subject"])[:200]
+    meeting_info = dict(result["meeting"], is_meeting=True) if result["meeting"] else None
+
+    classification_status = "SUCCESS" if should_create else "SKIPPED"
+    logger.info(
+        f"Email classification completed - Subject: '{subject}' | "
+        f"Decision: {classification_status} | "
+        f"Confidence: {confidence:.2f} | "
+        f"Reasoning: {reasoning[:100]}{'...' if len(reasoning) > 100 else ''}"
+    )
+
+    if meeting_info:
+        logger.info(
+            f"Meeting detected in email - Subject: '{subject}' | "
+            f"Summary: '{meeting_info['summary'] or 'N/A'}' | "
+            f"Start: {meeting_info['start_datetime'] or 'N/A'}"
+        )
+
+    return {
+        "should_create": should_create,
+        "confidence": confidence,
+        "title": title,
+        "notes": (result["notes"] or email_content["body"] or email_content["snippet"])[:2000],
+        "category": result["category"],
+        "reasoning": reasoning,
+        "meeting": meeting_info,
+    }
+
+
 def classify_and_generate_task(
     payload: Dict[str, Any],
     api_key: Optional[str] = None,
@@ -153,7 +716,8 @@ def classify_and_generate_task(
             "confidence": 0.5,
             "title": payload.get("subject", "Email Task"),
             "notes": payload.get("body", payload.get("snippet", "")),
-            "reasoning": "OpenAI library not available, using default behavior"
+            "reasoning": "OpenAI library not available, using default behavior",
+            "fallback": True,
         }
     
     api_key = api_key or os.getenv("OPENAI_API_KEY")
@@ -167,10 +731,11 @@ def classify_and_generate_task(
             "confidence": 0.5,
             "title": payload.get("subject", "Email Task"),
             "notes": payload.get("body", payload.get("snippet", "")),
-            "reasoning": "No OpenAI API key configured, using default behavior"
+            "reasoning": "No OpenAI API key configured, using default behavior",
+            "fallback": True,
         }
     
-    email_content = prepare_email_content(payload)
+    email_content = prepare_email_content(payload, model)
     sender = payload.get("sender", "Unknown")
     subject = email_content.get("subject", "(No subject)")
     
@@ -188,182 +753,37 @@ def classify_and_generate_task(
         f"({sum(1 for c in normalized_cal_cats if c['description'])}) with descriptions"
     )
     
-    # Format categories as blocks for prompt
-    if normalized_task_cats:
-        task_categories_block = "Available Task Categories:\n" + "\n".join(
-            f"  - {cat['name']}" + (f": {cat['description']}" if cat['description'] else "")
-            for cat in normalized_task_cats
-        )
-    else:
-        task_categories_block = "Available Task Categories: None"
-    
-    if normalized_cal_cats:
-        calendar_categories_block = "Available Calendar Categories:\n" + "\n".join(
-            f"  - {cat['name']}" + (f": {cat['description']}" if cat['description'] else "")
-            for cat in normalized_cal_cats
-        )
-    else:
-        calendar_categories_block = "Available Calendar Categories: None"
-    
     logger.info(f"Processing email for classification - Subject: '{subject}', Sender: '{sender}'")
-    prompt = f"""
-You are an intelligent email assistant that helps users manage their tasks and meetings by analyzing emails.
-
-{task_categories_block}
-
-{calendar_categories_block}
-
-Instructions:
-
-1. Determine if the email represents:
-   a) a task to be created
-   b) a meeting invitation
-
-2. If it's a task:
-    - Generate a concise task title (3-8 words)
-    - Generate detailed task notes (2-4 sentences)
-    - Provide a confidence score (0.0-1.0)
-    - For the "category" field in your response: You MUST select one of the category names from the Available Task Categories list above, or null if none fit.
-      IMPORTANT: Use the exact category name as shown (the text after the "- " and before the colon, if present).
-      Do not include descriptions or any additional text - only the category name itself.
-    - Explain your reasoning
-
-
-3. If it's a meeting:
-   - Detect if it is indeed a meeting (is_meeting: true/false)
-   - Extract meeting details:
-       * summary: meeting title
-       * location: physical or virtual link (leave empty if unknown)
-        * start_datetime: RFC3339 UTC start time (leave empty if unknown)
-        * end_datetime: RFC3339 UTC end time (leave empty if unknown)
-        * participants: list of email addresses (leave empty list if unknown)
-        * category: For the meeting["category"] field in your response: You MUST select one of the category names from the Available Calendar Categories list above, or null if none fit.
-          IMPORTANT: Use the exact category name as shown (the text after the "- " and before the colon, if present).
-          Do not include descriptions or any additional text - only the category name itself.
-   - Use context clues like "meeting", "invite", "agenda", "call", "Zoom", "conference", "link"
-
-Email Details:
-From: {sender}
-Subject: {email_content['subject']}
-
-Body:
-{email_content['body'] or email_content['snippet']}
-
-Classification Guidelines:
-- CREATE TASK for emails that contain:
-  * Action items or requests
-  * Reminders or deadlines
-  * Meeting invitations requiring preparation
-  * Bills or payments due
-  * Follow-up items
-  * Tasks delegated to you
-  * Important information that needs review or response
-
-- DO NOT CREATE TASK for emails that are:
-  * Pure newsletters or marketing
-  * Automated notifications with no action needed
-  * Spam or promotional content
-  * Social media notifications
-  * Purely informational with no action required
-  * "FYI only" messages
-  * Auto-replies or out-of-office messages
-
-Respond ONLY with valid JSON in this exact format:
-{{
-  "should_create": true/false,
-  "confidence": 0.0-1.0,
-  "title": "Concise task title (3-8 words)",
-  "notes": "Detailed task description with key information",
-  "category": "Exact category name from Available Task Categories list, or null",
-  "reasoning": "Brief explanation of decision",
-  "meeting": {{
-      "is_meeting": true/false,
-      "summary": "",
-      "location": "",
-      "start_datetime": "",
-      "end_datetime": "",
-      "start_datetime": "",
-      "end_datetime": "",
-      "participants": [],
-      "category": "Exact category name from Available Calendar Categories list, or null"
-  }}
-}}
-
-CRITICAL: For both "category" fields:
-- Use the EXACT category name as listed in the Available Categories sections above
-- Do NOT include descriptions, colons, or any additional text
-- Use null if no category fits
-
-For task title:
-- Make it actionable (start with a verb if appropriate)
-- Keep it under 60 characters
-- Remove "RE:", "FWD:", etc. prefixes
-
-For task notes:
-- Include key details, dates, or requirements
-- Keep it concise but informative (2-4 sentences max)
-- Extract actionable information from the email body
-"""
+    prompt = build_classification_prompt(email_content, sender, normalized_task_cats, normalized_cal_cats)
 
 
     result: Dict[str, Any] = {}
     try:
-        client = OpenAI(api_key=api_key)
+        client = get_openai_client(api_key=api_key)
         
-        response = client.chat.completions.create(
-            model=model,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a helpful email classification assistant. Always respond with valid JSON only."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ],
-            temperature=0.3,
-            max_tokens=500,
-            response_format={"type": "json_object"}
-        )
+        response = client.chat.completions.create(**chat_request(prompt, model))
+        record_usage(response, model)
         
         result_text = response.choices[0].message.content
         result = json.loads(result_text)
+        return _classification_from_json(result, email_content)
         
-        should_create = bool(result.get("should_create", True))
-        confidence = float(result.get("confidence", 0.5))
-        reasoning = str(result.get("reasoning", ""))[:500]
-        title = str(result.get("title", email_content["subject"]))[:200]
-        meeting_info = result.get("meeting")
-        
-        classification_status = "SUCCESS" if should_create else "SKIPPED"
-        logger.info(
-            f"Email classification completed - Subject: '{subject}' | "
-            f"Decision: {classification_status} | "
-            f"Confidence: {confidence:.2f} | "
-            f"Reasoning: {reasoning[:100]}{'...' if len(reasoning) > 100 else ''}"
+    except json.JSONDecodeError as e:
+        logger.error(
+            f"Classification FAILED (JSON parsing error) - Subject: '{subject}' | "
+            f"Error: {str(e)} | Using fallback behavior"
         )
-        
-        if meeting_info and meeting_info.get("is_meeting"):
-            logger.info(
-                f"Meeting detected in email - Subject: '{subject}' | "
-                f"Summary: '{meeting_info.get('summary', 'N/A')}' | "
-                f"Start: {meeting_info.get('start_datetime', 'N/A')}"
-            )
-        
         return {
-            "should_create": should_create,
-            "confidence": confidence,
-            "title": title,
-            "notes": str(result.get("notes", email_content["body"] or email_content["snippet"]))[:2000],
-            "category": result.get("category"),
-            "reasoning": reasoning,
-            "meeting": meeting_info,
+            "should_create": True,
+            "confidence": 0.5,
+            "title": email_content["subject"],
+            "notes": email_content["body"] or email_content["snippet"],
+            "reasoning": "JSON parsing failed, using fallback",
+            "fallback": True,
         }
-        
-    except json.JSONDecodeError as e:
+    except ValueError as e:
         logger.error(
-            f"Classification FAILED (JSON parsing error) - Subject: '{subject}' | "
+            f"Classification FAILED (schema validation error) - Subject: '{subject}' | "
             f"Error: {str(e)} | Using fallback behavior"
         )
         return {
@@ -371,7 +791,8 @@ For task notes:
             "confidence": 0.5,
             "title": email_content["subject"],
             "notes": email_content["body"] or email_content["snippet"],
-            "reasoning": "JSON parsing failed, using fallback"
+            "reasoning": f"Answer did not match the schema, using fallback: {str(e)}",
+            "fallback": True,
         }
     except Exception as e:
         logger.error(
@@ -384,33 +805,513 @@ For task notes:
             "title": email_content["subject"],
             "notes": email_content["body"] or email_content["snippet"],
             "reasoning": f"API error: {str(e)}",
-            "meeting": result.get("meeting") if isinstance(result, dict) else None,
+            "fallback": True,
         }
 
 
-def ml_decide(
+def _batch_groups(blocks: list[str], token_budget: int, max_batch: int, model: str | None = None) -> list[list[int]]:
+    """Split email indices into groups whose email blocks fit token_budget (an oversized email goes alone)."""
+    groups: list[list[int]] = []
+    current: list[int] = []
+    used = 0
+    for i, block in enumerate(blocks):
+        tokens = estimate_tokens(block, model)
+        if current and (used + tokens > token_budget or len(current) >= max_batch):
+            groups.append(current)
+            current, used = [], 0
+        current.append(i)
+        used += tokens
+    if current:
+        groups.append(current)
+    return groups
+
+
+def _classify_group(
+    payloads: list[Dict[str, Any]],
+    contents: list[Dict[str, str]],
+    api_key: str,
+    model: str,
+    task_categories: list[dict[str, str]],
+    calendar_categories: list[dict[str, str]],
+) -> list[Dict[str, Any]]:
+    """Classify a group of emails in one request; emails the answer does not cover are classified one by one."""
+    emails = [(str(i), content, payload.get("sender", "Unknown")) for i, (payload, content) in enumerate(zip(payloads, contents))]
+    prompt = build_batch_prompt(emails, task_categories, calendar_categories)
+    by_id: Dict[str, Any] = {}
+    try:
+        client = get_openai_client(api_key=api_key)
+        response = client.chat.completions.create(**chat_request(prompt, model, batch_size=len(emails)))
+        record_usage(response, model)
+        answer = json.loads(response.choices[0].message.content)
+        entries = answer.get("results") if isinstance(answer, dict) else answer
+        if not isinstance(entries, list):
+            raise ValueError("response has no results array")
+        by_id = {str(entry.get("id")): entry for entry in entries if isinstance(entry, dict)}
+    except Exception as e:
+        logger.error(
+            f"Batch classification FAILED - Emails: {len(emails)} | "
+            f"Error: {str(e)} | Classifying one by one"
+        )
+
+    item_schema = batch_schema()["properties"]["results"]["items"]
+    results = []
+    missing = 0
+    for (email_id, content, _), payload in zip(emails, payloads):
+        entry = by_id.get(email_id)
+        try:
+            if entry is None:
+                raise KeyError(email_id)
+            results.append(_classification_from_json(entry, content, item_schema))
+        except (KeyError, ValueError) as e:
+            if entry is not None:
+                logger.warning(f"Batch classification entry INVALID - ID: {email_id} | Error: {str(e)} | Classifying alone")
+            missing += 1
+            results.append(classify_and_generate_task(
+                payload, api_key=api_key, model=model,
+                task_categories=task_categories, calendar_categories=calendar_categories,
+            ))
+    if by_id and missing:
+        logger.warning(f"Batch classification incomplete - Emails: {len(emails)} | Missing: {missing} | Classified one by one")
+    return results
+
+
+def classify_batch(
+    payloads: list[Dict[str, Any]],
+    api_key: Optional[str] = None,
+    model: str = "gpt-4o-mini",
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+    token_budget: int = CLASSIFY_BATCH_TOKENS,
+    max_batch: int = CLASSIFY_BATCH_SIZE,
+) -> list[Dict[str, Any]]:
+    """
+    Classify several emails, packing up to max_batch of them (and at most
+    token_budget tokens of email content) into each request so the
+    instructions are sent once per group instead of once per email.
+
+    Returns one classify_and_generate_task-shaped dict per payload, in order.
+    A malformed or failed batch answer falls back to per-email requests.
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not OPENAI_AVAILABLE or not api_key or len(payloads) <= 1 or max_batch <= 1:
+        return [
+            classify_and_generate_task(p, api_key=api_key, model=model, task_categories=task_categories, calendar_categories=calendar_categories)
+            for p in payloads
+        ]
+
+    normalized_task_cats = normalize_categories(task_categories)
+    normalized_cal_cats = normalize_categories(calendar_categories)
+    contents = [prepare_email_content(p, model) for p in payloads]
+    blocks = [_email_prompt_block(c, p.get("sender", "Unknown")) for c, p in zip(contents, payloads)]
+
+    results: list[Dict[str, Any]] = [{} for _ in payloads]
+    for group in _batch_groups(blocks, token_budget, max_batch, model):
+        if len(group) == 1:
+            i = group[0]
+            results[i] = classify_and_generate_task(
+                payloads[i], api_key=api_key, model=model,
+                task_categories=normalized_task_cats, calendar_categories=normalized_cal_cats,
+            )
+            continue
+        logger.info(f"Classifying email batch - Emails: {len(group)}")
+        group_results = _classify_group(
+            [payloads[i] for i in group], [contents[i] for i in group],
+            api_key, model, normalized_task_cats, normalized_cal_cats,
+        )
+        for i, result in zip(group, group_results):
+            results[i] = result
+    return results
+
+
+def tiered() -> bool:
+    return bool(CLASSIFY_TIER1_MODEL)
+
+
+def tier_models() -> tuple[str, str]:
+    """(tier-one model, tier-two model); tier two defaults to OPENAI_MODEL."""
+    return CLASSIFY_TIER1_MODEL, CLASSIFY_TIER2_MODEL or os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+
+def classification_model() -> str:
+    """The model (or tier configuration) results are produced by, as recorded in the classification cache."""
+    if not tiered():
+        return os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    tier1_model, tier2_model = tier_models()
+    meetings = "+meetings" if CLASSIFY_TIER1_ESCALATE_MEETINGS else ""
+    return f"{tier1_model}>{tier2_model}@{CLASSIFY_TIER1_MIN_CONFIDENCE}{meetings}"
+
+
+def _summary_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """What tier one sees: subject, sender and snippet, no body."""
+    return {key: payload.get(key) for key in ("subject", "sender", "snippet") if payload.get(key) is not None}
+
+
+def _escalation_reason(result: Dict[str, Any]) -> str | None:
+    if result.get("fallback"):
+        return "error"
+    if float(result.get("confidence", 0.0)) < CLASSIFY_TIER1_MIN_CONFIDENCE:
+        return "low_confidence"
+    if CLASSIFY_TIER1_ESCALATE_MEETINGS and (result.get("meeting") or {}).get("is_meeting"):
+        return "meeting"
+    return None
+
+
+def _decided_by(result: Dict[str, Any], tier: int, model: str, escalation: str | None = None) -> Dict[str, Any]:
+    result["tier"] = tier
+    result["tier_model"] = model
+    if escalation:
+        result["escalation"] = escalation
+    with _tier_lock:
+        _tier_counters[f"tier{tier}"] += 1
+        if escalation:
+            _tier_counters[f"escalated_{escalation}"] += 1
+    return result
+
+
+def _log_escalation(payload: Dict[str, Any], result: Dict[str, Any], reason: str):
+    logger.info(
+        f"Escalating classification - Subject: '{payload.get('subject', '(No subject)')}' | "
+        f"Reason: {reason} | Tier-one confidence: {float(result.get('confidence', 0.0)):.2f}"
+    )
+
+
+def classify_tiered(
     payload: Dict[str, Any],
+    api_key: Optional[str] = None,
     task_categories: list[str] | list[dict] | None = None,
     calendar_categories: list[str] | list[dict] | None = None,
 ) -> Dict[str, Any]:
     """
-    Main entry point for email classification.
-    Uses environment variables for configuration.
+    Two-tier classify_and_generate_task: the tier-one model answers from the
+    subject, sender and snippet; low-confidence answers, meetings and failures
+    are re-classified from the full body by the tier-two model. The result
+    records the deciding tier, its model and (for tier two) why it escalated.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-    
-    result = classify_and_generate_task(
-        payload, 
-        api_key=api_key, 
-        model=model,
-        task_categories=task_categories,
-        calendar_categories=calendar_categories
+    tier1_model, tier2_model = tier_models()
+    first = classify_and_generate_task(
+        _summary_payload(payload), api_key=api_key, model=tier1_model,
+        task_categories=task_categories, calendar_categories=calendar_categories,
     )
-    
+    reason = _escalation_reason(first)
+    if reason is None:
+        return _decided_by(first, 1, tier1_model)
+    _log_escalation(payload, first, reason)
+    second = classify_and_generate_task(
+        payload, api_key=api_key, model=tier2_model,
+        task_categories=task_categories, calendar_categories=calendar_categories,
+    )
+    return _decided_by(second, 2, tier2_model, reason)
+
+
+def classify_batch_tiered(
+    payloads: list[Dict[str, Any]],
+    api_key: Optional[str] = None,
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+) -> list[Dict[str, Any]]:
+    """classify_tiered for several emails, each tier going through classify_batch."""
+    tier1_model, tier2_model = tier_models()
+    results = classify_batch(
+        [_summary_payload(p) for p in payloads], api_key=api_key, model=tier1_model,
+        task_categories=task_categories, calendar_categories=calendar_categories,
+    )
+    reasons = [_escalation_reason(result) for result in results]
+    escalated = [i for i, reason in enumerate(reasons) if reason is not None]
+    for i in escalated:
+        _log_escalation(payloads[i], results[i], reasons[i])
+    second = classify_batch(
+        [payloads[i] for i in escalated], api_key=api_key, model=tier2_model,
+        task_categories=task_categories, calendar_categories=calendar_categories,
+    )
+    for i, result in zip(escalated, second):
+        results[i] = result
+    return [
+        _decided_by(result, 2, tier2_model, reason) if reason else _decided_by(result, 1, tier1_model)
+        for result, reason in zip(results, reasons)
+    ]
+
+
+def tier_stats() -> Dict[str, Any]:
+    with _tier_lock:
+        stats = dict(_tier_counters)
+    decided = stats["tier1"] + stats["tier2"]
+    stats["escalation_rate"] = round(stats["tier2"] / decided, 3) if decided else 0.0
+    return stats
+
+
+def batch_request_line(
+    custom_id: str,
+    payload: Dict[str, Any],
+    model: str,
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+) -> Dict[str, Any]:
+    """One OpenAI Batch API input line carrying the same request classify_and_generate_task would send."""
+    payload = reduce_payload(payload)
+    prompt = build_classification_prompt(
+        prepare_email_content(payload, model), payload.get("sender", "Unknown"),
+        normalize_categories(task_categories), normalize_categories(calendar_categories),
+    )
+    return {"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": chat_request(prompt, model)}
+
+
+def classification_from_content(content: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """The ml_decide result for a model answer received out of band. Raises ValueError on malformed JSON."""
+    return _drop_incomplete_meeting(_classification_from_json(json.loads(content), prepare_email_content(payload)))
+
+
+def classification_cache_key(
+    user_id: int,
+    payload: Dict[str, Any],
+    model: str,
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+) -> str:
+    """Hash of everything the prompt is built from, so equal keys mean equal prompts."""
+    email_content = prepare_email_content(payload, model)
+    key_fields = {
+        "user_id": user_id,
+        "sender": (payload.get("sender") or "").strip().lower(),
+        "subject": re.sub(r"\s+", " ", email_content["subject"] or "").strip(),
+        "body": re.sub(r"\s+", " ", email_content["body"] or email_content["snippet"] or "").strip(),
+        "task_categories": normalize_categories(task_categories),
+        "calendar_categories": normalize_categories(calendar_categories),
+        "model": model,
+        "prompt_version": PROMPT_VERSION,
+    }
+    return hashlib.sha256(json.dumps(key_fields, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _drop_incomplete_meeting(result: Dict[str, Any]) -> Dict[str, Any]:
     meeting_info = result.get("meeting")
     if meeting_info:
         required_keys = ["is_meeting", "summary", "start_datetime", "end_datetime"]
         if not all(k in meeting_info for k in required_keys):
             result["meeting"] = None
     return result
+
+
+def ml_decide(
+    payload: Dict[str, Any],
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+    user_id: int | None = None,
+) -> Dict[str, Any]:
+    """
+    Main entry point for email classification.
+    Uses environment variables for configuration. The body is reduced first
+    (reduce_payload). With a user_id, results are served from and stored in
+    the classification cache.
+    """
+    api_key = os.getenv("OPENAI_API_KEY")
+    model = classification_model()
+    payload = reduce_payload(payload)
+
+    cache_key = None
+    if user_id is not None and classification_cache.enabled():
+        cache_key = classification_cache_key(user_id, payload, model, task_categories, calendar_categories)
+        cached = classification_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"Classification cache hit - Subject: '{payload.get('subject', '(No subject)')}'")
+            return cached
+
+    # Confident local decisions skip the LLM; they are cheap to recompute, so not cached
+    local = local_classifier.decide(payload, user_id)
+    if local is not None:
+        logger.info(f"Local classifier decision - Subject: '{payload.get('subject', '(No subject)')}' | {local['reasoning']}")
+        return local
+
+    if tiered():
+        result = classify_tiered(payload, api_key=api_key, task_categories=task_categories, calendar_categories=calendar_categories)
+    else:
+        result = classify_and_generate_task(
+            payload, 
+            api_key=api_key, 
+            model=model,
+            task_categories=task_categories,
+            calendar_categories=calendar_categories
+        )
+    
+    result = _drop_incomplete_meeting(result)
+    # Fallbacks stand in for a real answer and must be retried next time
+    if cache_key is not None and not result.get("fallback"):
+        classification_cache.put(cache_key, user_id, model, result)
+    return result
+
+
+def ml_decide_batch(
+    payloads: list[Dict[str, Any]],
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+    user_id: int | None = None,
+) -> list[Dict[str, Any]]:
+    """ml_decide for several emails: cache hits and local decisions are served directly, the rest go through classify_batch."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    model = classification_model()
+    payloads = [reduce_payload(payload) for payload in payloads]
+
+    results: list[Dict[str, Any] | None] = [None] * len(payloads)
+    cache_keys: list[str | None] = [None] * len(payloads)
+    if user_id is not None and classification_cache.enabled():
+        for i, payload in enumerate(payloads):
+            cache_keys[i] = classification_cache_key(user_id, payload, model, task_categories, calendar_categories)
+            results[i] = classification_cache.get(cache_keys[i])
+    for i, payload in enumerate(payloads):
+        if results[i] is None:
+            results[i] = local_classifier.decide(payload, user_id)
+
+    pending = [i for i, result in enumerate(results) if result is None]
+    if tiered():
+        fresh = classify_batch_tiered(
+            [payloads[i] for i in pending], api_key=api_key,
+            task_categories=task_categories, calendar_categories=calendar_categories,
+        )
+    else:
+        fresh = classify_batch(
+            [payloads[i] for i in pending], api_key=api_key, model=model,
+            task_categories=task_categories, calendar_categories=calendar_categories,
+        )
+    for i, result in zip(pending, fresh):
+        results[i] = _drop_incomplete_meeting(result)
+        if cache_keys[i] is not None and not result.get("fallback"):
+            classification_cache.put(cache_keys[i], user_id, model, results[i])
+    return results
+
+
+async def classify_and_generate_task_async(
+    payload: Dict[str, Any],
+    client,
+    model: str = "gpt-4o-mini",
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+    timeout: float = CLASSIFY_ASYNC_TIMEOUT,
+) -> Dict[str, Any]:
+    """classify_and_generate_task on an AsyncOpenAI client; falls back if no answer arrives within timeout seconds."""
+    email_content = prepare_email_content(payload, model)
+    subject = email_content.get("subject", "(No subject)")
+    prompt = build_classification_prompt(
+        email_content, payload.get("sender", "Unknown"),
+        normalize_categories(task_categories), normalize_categories(calendar_categories),
+    )
+    try:
+        response = await asyncio.wait_for(client.chat.completions.create(**chat_request(prompt, model)), timeout)
+        record_usage(response, model)
+        return _classification_from_json(json.loads(response.choices[0].message.content), email_content)
+    except asyncio.TimeoutError:
+        reasoning = f"No answer within {timeout}s, using fallback"
+    except json.JSONDecodeError:
+        reasoning = "JSON parsing failed, using fallback"
+    except ValueError as e:
+        reasoning = f"Answer did not match the schema, using fallback: {str(e)}"
+    except Exception as e:
+        reasoning = f"API error: {str(e)}"
+    logger.error(f"Classification FAILED - Subject: '{subject}' | Error: {reasoning} | Using fallback behavior")
+    return {
+        "should_create": True,
+        "confidence": 0.5,
+        "title": email_content["subject"],
+        "notes": email_content["body"] or email_content["snippet"],
+        "reasoning": reasoning,
+        "fallback": True,
+    }
+
+
+async def classify_tiered_async(
+    payload: Dict[str, Any],
+    client,
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+    timeout: float = CLASSIFY_ASYNC_TIMEOUT,
+) -> Dict[str, Any]:
+    """classify_tiered on an AsyncOpenAI client; each tier gets its own timeout."""
+    tier1_model, tier2_model = tier_models()
+    first = await classify_and_generate_task_async(
+        _summary_payload(payload), client, model=tier1_model,
+        task_categories=task_categories, calendar_categories=calendar_categories, timeout=timeout,
+    )
+    reason = _escalation_reason(first)
+    if reason is None:
+        return _decided_by(first, 1, tier1_model)
+    _log_escalation(payload, first, reason)
+    second = await classify_and_generate_task_async(
+        payload, client, model=tier2_model,
+        task_categories=task_categories, calendar_categories=calendar_categories, timeout=timeout,
+    )
+    return _decided_by(second, 2, tier2_model, reason)
+
+
+async def ml_decide_async(
+    payload: Dict[str, Any],
+    client,
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+    user_id: int | None = None,
+    timeout: float = CLASSIFY_ASYNC_TIMEOUT,
+) -> Dict[str, Any]:
+    """ml_decide for an event loop: the cache and local classifier run off the loop."""
+    model = classification_model()
+    payload = reduce_payload(payload)
+
+    cache_key = None
+    if user_id is not None and classification_cache.enabled():
+        cache_key = classification_cache_key(user_id, payload, model, task_categories, calendar_categories)
+        cached = await asyncio.to_thread(classification_cache.get, cache_key)
+        if cached is not None:
+            return cached
+    local = await asyncio.to_thread(local_classifier.decide, payload, user_id)
+    if local is not None:
+        return local
+
+    if tiered():
+        result = await classify_tiered_async(
+            payload, client, task_categories=task_categories, calendar_categories=calendar_categories, timeout=timeout,
+        )
+    else:
+        result = await classify_and_generate_task_async(
+            payload, client, model=model, task_categories=task_categories, calendar_categories=calendar_categories, timeout=timeout,
+        )
+    result = _drop_incomplete_meeting(result)
+    if cache_key is not None and not result.get("fallback"):
+        await asyncio.to_thread(classification_cache.put, cache_key, user_id, model, result)
+    return result
+
+
+async def ml_decide_many(
+    payloads: Iterable[Dict[str, Any]],
+    task_categories: list[str] | list[dict] | None = None,
+    calendar_categories: list[str] | list[dict] | None = None,
+    user_id: int | None = None,
+    concurrency: int = CLASSIFY_ASYNC_CONCURRENCY,
+    timeout: float = CLASSIFY_ASYNC_TIMEOUT,
+) -> AsyncIterator[tuple[int, Dict[str, Any]]]:
+    """
+    Classify payloads concurrently, yielding (index, result) as each completes.
+
+    At most `concurrency` classifications run at once and each gets `timeout`
+    seconds before it falls back. Closing the generator early (or cancelling
+    the task consuming it) cancels the calls still in flight.
+    """
+    payloads = list(payloads)
+    api_key = os.getenv("OPENAI_API_KEY")
+    if _async_openai_client_factory is None and (not OPENAI_AVAILABLE or not api_key):
+        # Nothing to wait on: classify_and_generate_task returns its fallback at once
+        for i, payload in enumerate(payloads):
+            yield i, ml_decide(payload, task_categories, calendar_categories, user_id=user_id)
+        return
+
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    client = new_async_openai_client(api_key=api_key)
+
+    async def decide(i: int, payload: Dict[str, Any]) -> tuple[int, Dict[str, Any]]:
+        async with semaphore:
+            return i, await ml_decide_async(payload, client, task_categories, calendar_categories, user_id=user_id, timeout=timeout)
+
+    tasks = [asyncio.ensure_future(decide(i, payload)) for i, payload in enumerate(payloads)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await client.close()
@@ -0,0 +1,112 @@
+"""
+Optional process pool for message parsing (base64 decoding and HTML -> text).
+
+Parsing is pure CPU, so on the pipeline's threads it is serialised by the GIL.
+With PARSE_PROCESSES > 0, parse_message() ships the raw Gmail message to a
+worker process and waits up to PARSE_TIMEOUT seconds for the parsed payload.
+A running task can't be cancelled, so on a timeout the pool is replaced and
+its workers terminated; parses in flight on it fall back to in-process.
+If the pool is disabled, can't start, or breaks, parsing runs in-process.
+"""
+
+from __future__ import annotations
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict
+from server.config import PARSE_PROCESSES, PARSE_TIMEOUT
+from server.mime import ParsedMessage, message_to_payload
+
+logger = logging.getLogger(__name__)
+
+
+class ParseTimeoutError(RuntimeError):
+    """Raised when a message takes longer than PARSE_TIMEOUT to parse in the pool."""
+
+
+_pool: ProcessPoolExecutor | None = None
+_pool_pid: int | None = None
+_pool_lock = threading.Lock()
+_counters = {"pooled": 0, "in_process": 0, "timeouts": 0, "fallbacks": 0, "recycled": 0}
+
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    """Return this process's parse pool, created lazily so each forked gunicorn worker gets its own."""
+    global _pool, _pool_pid
+    if PARSE_PROCESSES <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            # Never fork a process that already runs pipeline threads
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            _pool = ProcessPoolExecutor(max_workers=PARSE_PROCESSES, mp_context=context)
+            _pool_pid = os.getpid()
+        return _pool
+
+
+def _reset_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def _recycle_pool(pool: ProcessPoolExecutor):
+    """Replace pool (unless another thread already did) and terminate its workers, including a stuck one."""
+    global _pool
+    with _pool_lock:
+        if _pool is not pool:
+            return
+        _pool = None
+        _counters["recycled"] += 1
+    processes = list((getattr(pool, "_processes", None) or {}).values())
+    pool.shutdown(wait=False, cancel_futures=True)
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+
+
+def _count(name: str):
+    with _pool_lock:
+        _counters[name] += 1
+
+
+def parse_message(message: dict, timeout: float = PARSE_TIMEOUT) -> ParsedMessage:
+    """Parse a full-format Gmail message into a ParsedMessage, in the pool when enabled."""
+    pool = _get_pool()
+    if pool is None:
+        _count("in_process")
+        return message_to_payload(message)
+
+    try:
+        future = pool.submit(message_to_payload, message)
+    except (BrokenProcessPool, RuntimeError) as e:
+        logger.warning(f"Parse pool unavailable, parsing in-process - Error: {str(e)}")
+        _reset_pool()
+        _count("fallbacks")
+        return message_to_payload(message)
+
+    try:
+        payload = future.result(timeout=timeout)
+    except FutureTimeoutError:
+        # The worker keeps running the message; only terminating it frees the slot
+        _count("timeouts")
+        _recycle_pool(pool)
+        raise ParseTimeoutError(f"Parsing took longer than {timeout}s")
+    except BrokenProcessPool as e:
+        logger.warning(f"Parse pool broke, parsing in-process - Error: {str(e)}")
+        _reset_pool()
+        _count("fallbacks")
+        return message_to_payload(message)
+    _count("pooled")
+    return payload
+
+
+def parse_stats() -> Dict[str, int]:
+    with _pool_lock:
+        return {**_counters, "processes": PARSE_PROCESSES}
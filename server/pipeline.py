@@ -0,0 +1,1010 @@
+"""
+Email ingestion pipeline.
+
+Lists a user's Gmail messages, fetches them in batches and runs each one
+through two bounded thread-pool stages:
+0. triage on headers/labels from a cheap metadata fetch (server/triage.py)
+1. parse + classify (parse_message, ml_decide; grouped through ml_decide_batch or
+   ml_decide_many with CLASSIFY_BATCH_SIZE > 1 or CLASSIFY_ASYNC_CONCURRENCY > 0)
+2. dispatch (Google Tasks / Google Calendar inserts)
+Outcomes are consumed in input order by a single writer that owns the DB
+session, so output order and per-message error handling stay deterministic.
+"""
+
+from __future__ import annotations
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from dateutil import parser as dateutil_parser
+from sqlalchemy import select
+from server import quota
+from server.bodies import attach_body
+from server.config import (
+    TASKS_LIST_TITLE, CLASSIFY_WORKERS, CLASSIFY_ASYNC_CONCURRENCY, CLASSIFY_BATCH_SIZE, DISPATCH_WORKERS, GMAIL_BATCH_SIZE, TRIAGE_RULES,
+)
+from server.db import db_session, Email, Task, CalendarEvent, UserSettings, SyncCursor
+from server.gmail import (
+    gmail_list_pages, gmail_history_ids, get_history_id, batch_get_messages, history_label_for_query, HistoryExpiredError,
+)
+from server.ml import ml_decide, ml_decide_batch, ml_decide_many, normalize_categories
+from server.parse_pool import parse_message
+from server.providers.google_tasks import create_task as create_google_task, resolve_tasklist, GoogleTasksError
+from server.triage import TRIAGE_HEADERS, parse_rules, triage_message
+from server.utils import get_thread_service, message_to_payload
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_client_timezone(timezone_name: str | None):
+    if not timezone_name:
+        return timezone.utc
+    try:
+        return ZoneInfo(timezone_name)
+    except ZoneInfoNotFoundError:
+        logger.warning("Unknown timezone '%s', defaulting to UTC", timezone_name)
+        return timezone.utc
+
+def parse_datetime_with_timezone(value: str | None, tzinfo):
+    if not value:
+        return None
+    try:
+        dt = dateutil_parser.isoparse(value)
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        return dt.replace(tzinfo=tzinfo)
+    return dt
+
+def timezone_name_from_dt(dt: datetime):
+    tz = dt.tzinfo
+    if isinstance(tz, ZoneInfo):
+        return tz.key
+    if tz:
+        name = getattr(tz, "zone", None)
+        if name:
+            return name
+        return tz.tzname(None) or "UTC"
+    return "UTC"
+
+def known_message_ids(session, user_id: int, message_ids: list[str], chunk_size: int = 500) -> set[str]:
+    """
+    Return the subset of message_ids already stored as processed for this user.
+    Resolved with set-based IN queries (chunked to stay under SQLite's bound-parameter limit).
+    """
+    known: set[str] = set()
+    for start in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[start:start + chunk_size]
+        stmt = (
+            select(Email.gmail_message_id)
+            .where(Email.user_id == user_id)
+            .where(Email.gmail_message_id.in_(chunk))
+            .where(Email.processed.is_(True))
+        )
+        known.update(session.execute(stmt).scalars())
+    return known
+
+def message_ids_with_tasks(session, user_id: int, message_ids: list[str], provider: str, chunk_size: int = 500) -> set[str]:
+    """Return the subset of message_ids that already have a task for this provider."""
+    found: set[str] = set()
+    for start in range(0, len(message_ids), chunk_size):
+        chunk = message_ids[start:start + chunk_size]
+        stmt = (
+            select(Email.gmail_message_id)
+            .join(Task, Task.email_id == Email.id)
+            .where(Email.user_id == user_id)
+            .where(Email.gmail_message_id.in_(chunk))
+            .where(Task.provider == provider)
+        )
+        found.update(session.execute(stmt).scalars())
+    return found
+
+def get_or_create_email(session, user_id: int, message_id: str, meta: dict | None = None) -> Email:
+    e = session.query(Email).filter_by(user_id=user_id, gmail_message_id=message_id).one_or_none()
+    if e:
+        return e
+    e = Email(
+        user_id=user_id,
+        gmail_message_id=message_id,
+        gmail_thread_id=(meta or {}).get("thread_id"),
+        subject=(meta or {}).get("subject"),
+        sender=(meta or {}).get("sender"),
+        received_at=(dateutil_parser.isoparse(meta.get("received_at")) if meta and meta.get("received_at") else None),
+        snippet=(meta or {}).get("snippet"),
+        processed=False,
+        created_at=datetime.now(timezone.utc),
+        updated_at=datetime.now(timezone.utc),
+    )
+    session.add(e)
+    attach_body(session, e, (meta or {}).get("body"))
+    session.flush()
+    return e
+
+def task_exists(session, user_id: int, email_id: int, provider: str) -> bool:
+    return session.query(Task.id).filter_by(user_id=user_id, email_id=email_id, provider=provider).first() is not None
+
+def dispatch_task(provider: str, payload: dict, tasks_service, tasklist_id: str | None = None, user_key=None) -> dict:
+    if provider == "google_tasks":
+        if not tasks_service:
+            raise GoogleTasksError("Not authenticated for Google Tasks")
+        return create_google_task(tasks_service, TASKS_LIST_TITLE, payload, tasklist_id=tasklist_id, user_key=user_key)
+
+    raise ValueError(f"Unsupported provider '{provider}'")
+
+def create_google_calendar_event(meeting: dict, client_timezone: str | None, service, user_key=None):
+    """
+    Create a Google Calendar event for a meeting.
+    Use the client's timezone to interpret naive meeting times so the
+    wall-clock time remains consistent.
+    """
+    if not service:
+        return None
+
+    raw_start = meeting.get("start_datetime")
+    raw_end = meeting.get("end_datetime")
+    user_tz = resolve_client_timezone(client_timezone)
+    now_utc = datetime.now(timezone.utc).replace(second=0, microsecond=0)
+
+    start_obj = parse_datetime_with_timezone(raw_start, user_tz)
+    if start_obj is None:
+        start_obj = now_utc.astimezone(user_tz)
+    else:
+        if start_obj.tzinfo is None:
+            start_obj = start_obj.replace(tzinfo=user_tz)
+
+    start_obj_utc = start_obj.astimezone(timezone.utc)
+    if start_obj_utc < now_utc:
+        start_obj = now_utc.astimezone(start_obj.tzinfo or user_tz)
+
+    end_obj = parse_datetime_with_timezone(raw_end, user_tz)
+    if end_obj:
+        if end_obj.tzinfo is None:
+            end_obj = end_obj.replace(tzinfo=user_tz)
+        end_obj = end_obj.astimezone(start_obj.tzinfo or user_tz)
+        if end_obj <= start_obj:
+            end_obj = start_obj + timedelta(hours=1)
+    else:
+        end_obj = start_obj + timedelta(hours=1)
+
+    start_dt = start_obj.isoformat()
+    end_dt = end_obj.isoformat()
+    event_timezone = timezone_name_from_dt(start_obj)
+
+    event = {
+        "summary": meeting.get("summary") or "Meeting",
+        "location": meeting.get("location"),
+        "description": meeting.get("summary"),
+        "start": {"dateTime": start_dt, "timeZone": event_timezone},
+        "end": {"dateTime": end_dt, "timeZone": event_timezone},
+        "attendees": [{"email": p} for p in meeting.get("participants", []) if p],
+    }
+
+    try:
+        created_event = quota.execute(
+            service.events().insert(calendarId="primary", body=event), "calendar", user_key=user_key, idempotent=False,
+        )
+        return created_event
+    except Exception as e:
+        logger.error(
+            f"Calendar event creation FAILED - Summary: '{event.get('summary', 'N/A')}' | "
+            f"Error: {str(e)}"
+        )
+        return None
+
+def parse_since_to_utc(since_iso: str | None):
+    """
+    Return a UTC-aware datetime cutoff or None.
+    Accepts:
+      - since_iso: ISO 8601 like "2025-10-28T12:30:00Z" or "2025-10-28 12:30:00-04:00"
+    """
+    # Handle explicit ISO datetime
+    if since_iso:
+        s = since_iso.strip()
+        if s:
+            try:
+                dt = dateutil_parser.isoparse(s)
+                if dt.tzinfo is None:
+                    dt = dt.replace(tzinfo=timezone.utc)
+                return dt.astimezone(timezone.utc)
+            except Exception:
+                pass
+
+    return None
+
+def fetch_params_to_kwargs(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn JSON-safe fetch parameters (as sent to /fetch-emails or stored on a job) into run_fetch kwargs."""
+    kwargs = {k: v for k, v in params.items() if k != "since"}
+    kwargs["since_dt"] = parse_since_to_utc(params.get("since"))
+    return kwargs
+
+def build_gmail_query(custom_query: str | None, window: str | None, since_dt: datetime | None) -> str:
+    query_parts = []
+    if custom_query:
+        query_parts.append(custom_query)
+
+    # Time narrowing: Gmail accepts epoch seconds in after:, which is exact
+    if since_dt:
+        query_parts.append(f"after:{int(since_dt.timestamp())}")
+    elif window:
+        query_parts.append(f"newer_than:{window}")
+
+    return " ".join(query_parts) or "in:inbox"
+
+
+class FetchRun:
+    """Per-run state shared by the pipeline stages (read-only once the stages start)."""
+
+    def __init__(
+        self,
+        user_id: int,
+        credentials,
+        provider: str,
+        auto_generate: bool,
+        task_categories: list[dict],
+        calendar_categories: list[dict],
+        client_timezone: str | None = None,
+        since_dt: datetime | None = None,
+        category: str | None = None,
+    ):
+        self.user_id = user_id
+        self.credentials = credentials
+        self.provider = provider
+        self.auto_generate = auto_generate
+        self.task_categories = task_categories
+        self.calendar_categories = calendar_categories
+        self.client_timezone = client_timezone
+        self.since_ms = int(since_dt.timestamp() * 1000) if since_dt else None
+        self.category = category
+        self.existing_task_ids: set[str] = set()
+        self._tasklist_id: str | None = None
+        self._tasklist_lock = threading.Lock()
+
+    def tasklist_id(self, tasks_service) -> str:
+        """Resolve the target tasklist once per run instead of once per task."""
+        with self._tasklist_lock:
+            if self._tasklist_id is None:
+                self._tasklist_id = resolve_tasklist(tasks_service, TASKS_LIST_TITLE or "Tasks", user_key=self.user_id)
+            return self._tasklist_id
+
+
+def _short_id(message_id: str) -> str:
+    return message_id[:20] + "..." if len(message_id) > 20 else message_id
+
+def _classified_by(ml_result: Dict[str, Any]) -> str:
+    """Which stage decided: local (first-pass classifier), tier1 / tier2 (two-tier mode), llm or fallback."""
+    if ml_result.get("source"):
+        return ml_result["source"]
+    if ml_result.get("fallback"):
+        return "fallback"
+    if ml_result.get("tier"):
+        return f"tier{ml_result['tier']}"
+    return "llm"
+
+def _parse_stage(run: FetchRun, message_id: str, full_msg: dict) -> Dict[str, Any]:
+    """Parse one message onto a new outcome (payload, or out_of_range). Raises on parse errors."""
+    outcome: Dict[str, Any] = {"message_id": message_id, "error": None}
+    # precise guard if since was provided
+    if run.since_ms is not None and int(full_msg.get("internalDate", 0)) < run.since_ms:
+        outcome["out_of_range"] = True
+        return outcome
+
+    payload = parse_message(full_msg)
+    logger.info(
+        f"Processing email - ID: {_short_id(message_id)} | "
+        f"Subject: '{payload.subject}' | "
+        f"Sender: '{payload.sender or 'Unknown'}' | "
+        f"Received: {payload.received_at or 'N/A'}"
+    )
+    outcome["payload"] = payload
+    return outcome
+
+def _apply_classification(outcome: Dict[str, Any], ml_result: Dict[str, Any]):
+    payload = outcome["payload"]
+    outcome["ml_result"] = ml_result
+
+    # Task content from the ML-generated title and notes; exactly the
+    # fields providers.google_tasks.create_task reads
+    outcome["task_payload"] = {
+        "subject": (ml_result.get("title") or payload.subject or "Email task").strip(),
+        "body": (ml_result.get("notes") or payload.body or payload.snippet or "").strip(),
+        "sender": payload.sender,
+        "due": ml_result.get("due"),
+    }
+
+def _classify_stage(run: FetchRun, message_id: str, full_msg: dict) -> Dict[str, Any]:
+    """Parse and classify one message. Never raises: failures are recorded on the outcome."""
+    outcome: Dict[str, Any] = {"message_id": message_id, "error": None}
+    try:
+        outcome = _parse_stage(run, message_id, full_msg)
+        if outcome.get("out_of_range"):
+            return outcome
+        ml_result = ml_decide(
+            outcome["payload"], task_categories=run.task_categories, calendar_categories=run.calendar_categories, user_id=run.user_id
+        )
+        _apply_classification(outcome, ml_result)
+    except Exception as e:
+        logger.error(f"Email classification FAILED - ID: {_short_id(message_id)} | Error: {str(e)}")
+        outcome["error"] = f"Error processing email: {str(e)}"
+    return outcome
+
+def _parse_group(run: FetchRun, messages: list[tuple[str, dict]]) -> list[Dict[str, Any]]:
+    outcomes: list[Dict[str, Any]] = []
+    for message_id, full_msg in messages:
+        try:
+            outcomes.append(_parse_stage(run, message_id, full_msg))
+        except Exception as e:
+            logger.error(f"Email classification FAILED - ID: {_short_id(message_id)} | Error: {str(e)}")
+            outcomes.append({"message_id": message_id, "error": f"Error processing email: {str(e)}"})
+    return outcomes
+
+def _classify_batch_stage(run: FetchRun, messages: list[tuple[str, dict]], slots: list[Future]):
+    """Parse several messages and classify them together (ml_decide_batch), then resolve their slots. Never raises."""
+    outcomes = _parse_group(run, messages)
+    ready = [o for o in outcomes if not o["error"] and not o.get("out_of_range")]
+    try:
+        ml_results = ml_decide_batch(
+            [o["payload"] for o in ready], task_categories=run.task_categories, calendar_categories=run.calendar_categories, user_id=run.user_id
+        )
+        for outcome, ml_result in zip(ready, ml_results):
+            _apply_classification(outcome, ml_result)
+    except Exception as e:
+        for outcome in ready:
+            logger.error(f"Email classification FAILED - ID: {_short_id(outcome['message_id'])} | Error: {str(e)}")
+            outcome["error"] = f"Error processing email: {str(e)}"
+    for slot, outcome in zip(slots, outcomes):
+        slot.set_result(outcome)
+
+def _classify_async_stage(run: FetchRun, messages: list[tuple[str, dict]], slots: list[Future]):
+    """
+    Parse a page of messages and classify them concurrently on an event loop
+    (ml_decide_many). Each slot is resolved as soon as its message is
+    classified, so dispatch starts before the slowest completion. Never raises.
+    """
+    ready: list[tuple[Future, Dict[str, Any]]] = []
+    for slot, outcome in zip(slots, _parse_group(run, messages)):
+        if outcome["error"] or outcome.get("out_of_range"):
+            slot.set_result(outcome)
+        else:
+            ready.append((slot, outcome))
+
+    async def classify_all():
+        results = ml_decide_many(
+            [outcome["payload"] for _, outcome in ready],
+            task_categories=run.task_categories, calendar_categories=run.calendar_categories, user_id=run.user_id,
+        )
+        async for i, ml_result in results:
+            slot, outcome = ready[i]
+            _apply_classification(outcome, ml_result)
+            slot.set_result(outcome)
+
+    try:
+        if ready:
+            asyncio.run(classify_all())
+    except Exception as e:
+        for slot, outcome in ready:
+            if not slot.done():
+                logger.error(f"Email classification FAILED - ID: {_short_id(outcome['message_id'])} | Error: {str(e)}")
+                outcome["error"] = f"Error processing email: {str(e)}"
+                slot.set_result(outcome)
+
+def _settle_slots(slots: list[Future], stage: Future):
+    """If a group stage was cancelled or crashed, fail the slots it did not resolve."""
+    for slot in slots:
+        if slot.done():
+            continue
+        if stage.cancelled():
+            slot.cancel()
+        elif stage.exception() is not None:
+            slot.set_exception(stage.exception())
+
+def _dispatch_stage(run: FetchRun, outcome: Dict[str, Any]) -> Dict[str, Any]:
+    """Create calendar events and tasks with the providers (auto_generate mode only)."""
+    if outcome["error"] or outcome.get("out_of_range") or not run.auto_generate:
+        return outcome
+
+    message_id = outcome["message_id"]
+    ml_result = outcome["ml_result"]
+    meeting_info = ml_result.get("meeting")
+    if meeting_info and meeting_info.get("is_meeting"):
+        calendar_service = get_thread_service("calendar", "v3", run.credentials)
+        outcome["calendar_event"] = create_google_calendar_event(meeting_info, run.client_timezone, calendar_service, user_key=run.user_id)
+
+    if ml_result.get("should_create", True) and message_id not in run.existing_task_ids:
+        try:
+            tasks_service = get_thread_service("tasks", "v1", run.credentials)
+            tasklist_id = run.tasklist_id(tasks_service) if run.provider == "google_tasks" else None
+            outcome["task"] = dispatch_task(run.provider, outcome["task_payload"], tasks_service, tasklist_id=tasklist_id, user_key=run.user_id)
+        except Exception as err:
+            logger.error(
+                f"Task creation FAILED - Email ID: {_short_id(message_id)} | "
+                f"Subject: '{outcome['task_payload'].get('subject')}' | "
+                f"Provider: {run.provider} | "
+                f"Error: {str(err)}"
+            )
+            outcome["error"] = f"Error creating task: {str(err)}"
+    return outcome
+
+def _then(first: Future, pool: ThreadPoolExecutor, fn, *args) -> Future:
+    """Run fn(*args, first.result()) on pool once first completes; returns the chained future."""
+    chained: Future = Future()
+
+    def forward(done: Future):
+        if done.cancelled():
+            chained.cancel()
+        elif done.exception() is not None:
+            chained.set_exception(done.exception())
+        else:
+            chained.set_result(done.result())
+
+    def on_first_done(done: Future):
+        if done.cancelled() or done.exception() is not None:
+            forward(done)
+            return
+        try:
+            pool.submit(fn, *args, done.result()).add_done_callback(forward)
+        except RuntimeError as e:
+            # Pool is shutting down because the consumer stopped early
+            chained.set_exception(e)
+
+    first.add_done_callback(on_first_done)
+    return chained
+
+def process_messages(
+    run: FetchRun,
+    fetched: Iterator[tuple[str, dict | None, Exception | None]],
+    classify_workers: int = CLASSIFY_WORKERS,
+    dispatch_workers: int = DISPATCH_WORKERS,
+    batch_size: int = CLASSIFY_BATCH_SIZE,
+    async_concurrency: int = CLASSIFY_ASYNC_CONCURRENCY,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Run fetched messages through the classify and dispatch stages concurrently.
+    Yields one outcome per message in input order; at most a bounded number of
+    messages is in flight so memory does not grow with the batch size.
+    With batch_size > 1, messages are classified in groups of batch_size per
+    OpenAI request; otherwise, with async_concurrency > 0, each page of
+    GMAIL_BATCH_SIZE messages is classified concurrently on an event loop.
+    """
+    if batch_size > 1:
+        group_size, group_stage = batch_size, _classify_batch_stage
+    elif async_concurrency > 0:
+        group_size, group_stage = GMAIL_BATCH_SIZE, _classify_async_stage
+    else:
+        group_size, group_stage = 1, None
+    classify_pool = ThreadPoolExecutor(max_workers=max(1, classify_workers), thread_name_prefix="classify")
+    dispatch_pool = ThreadPoolExecutor(max_workers=max(1, dispatch_workers), thread_name_prefix="dispatch")
+    max_inflight = 2 * (max(1, classify_workers) + max(1, dispatch_workers)) + group_size
+    inflight: deque[Future] = deque()
+    # Messages waiting for a full classification group, and the futures their outcomes will resolve
+    group: list[tuple[str, dict]] = []
+    group_slots: list[Future] = []
+
+    def submit_group():
+        slots = list(group_slots)
+        stage = classify_pool.submit(group_stage, run, list(group), slots)
+        stage.add_done_callback(lambda done: _settle_slots(slots, done))
+        group.clear()
+        group_slots.clear()
+
+    try:
+        for message_id, full_msg, fetch_error in fetched:
+            if fetch_error is not None:
+                logger.error(f"Email fetch FAILED - ID: {message_id} | Error: {str(fetch_error)}")
+                failed: Future = Future()
+                failed.set_result({"message_id": message_id, "error": f"Error fetching email: {str(fetch_error)}", "fetch_failed": True})
+                inflight.append(failed)
+            elif group_size > 1:
+                slot: Future = Future()
+                group.append((message_id, full_msg))
+                group_slots.append(slot)
+                inflight.append(_then(slot, dispatch_pool, _dispatch_stage, run))
+                if len(group) >= group_size:
+                    submit_group()
+            else:
+                classified = classify_pool.submit(_classify_stage, run, message_id, full_msg)
+                inflight.append(_then(classified, dispatch_pool, _dispatch_stage, run))
+
+            # Hand back finished results as soon as they are next in line
+            while inflight and (len(inflight) >= max_inflight or inflight[0].done()):
+                if group and not inflight[0].done():
+                    # Never wait on a message whose batch has not been sent
+                    submit_group()
+                yield inflight.popleft().result()
+
+        if group:
+            submit_group()
+        while inflight:
+            yield inflight.popleft().result()
+    finally:
+        classify_pool.shutdown(wait=True, cancel_futures=True)
+        dispatch_pool.shutdown(wait=True, cancel_futures=True)
+
+def _parse_event_times(calendar_event: dict):
+    start_dt = None
+    end_dt = None
+    event_timezone_str = calendar_event.get("start", {}).get("timeZone")
+    event_tz = resolve_client_timezone(event_timezone_str) if event_timezone_str else timezone.utc
+
+    if calendar_event.get("start", {}).get("dateTime"):
+        try:
+            parsed_start = dateutil_parser.isoparse(calendar_event["start"]["dateTime"])
+            if parsed_start.tzinfo is None:
+                parsed_start = parsed_start.replace(tzinfo=event_tz)
+            start_dt = parsed_start.astimezone(timezone.utc)
+        except Exception:
+            pass
+    if calendar_event.get("end", {}).get("dateTime"):
+        try:
+            parsed_end = dateutil_parser.isoparse(calendar_event["end"]["dateTime"])
+            if parsed_end.tzinfo is None:
+                parsed_end = parsed_end.replace(tzinfo=event_tz)
+            end_dt = parsed_end.astimezone(timezone.utc)
+        except Exception:
+            pass
+    return start_dt, end_dt
+
+def _mark_processed(email_row: Email, decided_by: str):
+    email_row.decided_by = decided_by
+    now = datetime.now(timezone.utc)
+    if not email_row.first_processed_at:
+        email_row.first_processed_at = now
+    email_row.last_processed_at = now
+    email_row.processed = True
+
+def apply_outcome(s, run: FetchRun, outcome: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Write one message outcome to the database (single writer) and return the
+    per-message record reported to the caller.
+    status is one of: created, pending, skipped, already_processed, out_of_range, error
+    (triaged records are emitted by run_fetch directly).
+    """
+    message_id = outcome["message_id"]
+    message_id_short = _short_id(message_id)
+    record: Dict[str, Any] = {"message_id": message_id, "provider": run.provider, "status": None, "task": None, "calendar_event": None}
+
+    if outcome.get("out_of_range"):
+        record["status"] = "out_of_range"
+        return record
+    if outcome["error"] and "payload" not in outcome:
+        record["status"] = "error"
+        record["error"] = outcome["error"]
+        return record
+
+    payload = outcome["payload"]
+    ml_result = outcome["ml_result"]
+    task_payload = outcome["task_payload"]
+    subject = payload.subject
+    should_create = ml_result.get("should_create", True)
+    confidence = ml_result.get("confidence", 0.5)
+    reasoning = ml_result.get("reasoning", "")
+    record["classified_by"] = _classified_by(ml_result)
+
+    logger.info(
+        f"Email classification result - ID: {message_id_short} | "
+        f"Subject: '{subject}' | "
+        f"Should create task: {should_create} | "
+        f"Confidence: {confidence:.2f}"
+    )
+
+    # Store email with ML metadata
+    email_row = get_or_create_email(s, run.user_id, message_id, payload)
+
+    # Record the meeting, if any
+    meeting_info = ml_result.get("meeting")
+    if meeting_info and meeting_info.get("is_meeting"):
+        if run.auto_generate:
+            calendar_event = outcome.get("calendar_event")
+            if calendar_event:
+                logger.info(
+                    f"Calendar event created successfully - Email ID: {message_id_short} | "
+                    f"Event ID: {calendar_event.get('id')} | "
+                    f"Summary: '{calendar_event.get('summary', 'N/A')}'"
+                )
+                start_dt, end_dt = _parse_event_times(calendar_event)
+                s.add(CalendarEvent(
+                    user_id=run.user_id,
+                    email_id=email_row.id,
+                    google_event_id=calendar_event.get("id"),
+                    summary=calendar_event.get("summary", "Meeting"),
+                    location=calendar_event.get("location"),
+                    start_datetime=start_dt,
+                    end_datetime=end_dt,
+                    html_link=calendar_event.get("htmlLink"),
+                    provider_metadata=calendar_event,
+                    status="created",
+                    category=run.category or meeting_info.get("category"),
+                ))
+                record["calendar_event"] = {
+                    "summary": calendar_event.get("summary", "Meeting"),
+                    "htmlLink": calendar_event.get("htmlLink"),
+                    "start": calendar_event.get("start", {}).get("dateTime"),
+                    "location": calendar_event.get("location"),
+                }
+            else:
+                logger.warning(
+                    f"Calendar event creation failed - Email ID: {message_id_short} | "
+                    f"Subject: '{subject}' | "
+                    f"Meeting Summary: '{meeting_info.get('summary', 'N/A')}'"
+                )
+        else:
+            # Create pending calendar event (don't create in Google Calendar yet)
+            logger.info(
+                f"Creating pending calendar event - Email ID: {message_id_short} | "
+                f"Subject: '{subject}' | "
+                f"Meeting Summary: '{meeting_info.get('summary', 'N/A')}'"
+            )
+            user_tz = resolve_client_timezone(run.client_timezone)
+            parsed_start = parse_datetime_with_timezone(meeting_info.get("start_datetime"), user_tz)
+            parsed_end = parse_datetime_with_timezone(meeting_info.get("end_datetime"), user_tz)
+
+            # Metadata for later creation on confirm
+            pending_event_metadata = {
+                "summary": meeting_info.get("summary", "Meeting"),
+                "location": meeting_info.get("location"),
+                "start_datetime": meeting_info.get("start_datetime"),
+                "end_datetime": meeting_info.get("end_datetime"),
+                "participants": meeting_info.get("participants", []),
+                "client_timezone": run.client_timezone,
+            }
+            s.add(CalendarEvent(
+                user_id=run.user_id,
+                email_id=email_row.id,
+                google_event_id=None,
+                summary=meeting_info.get("summary", "Meeting"),
+                location=meeting_info.get("location"),
+                start_datetime=parsed_start.astimezone(timezone.utc) if parsed_start else None,
+                end_datetime=parsed_end.astimezone(timezone.utc) if parsed_end else None,
+                html_link=None,
+                provider_metadata=pending_event_metadata,
+                status="pending",
+                category=run.category or meeting_info.get("category"),
+            ))
+            record["calendar_event"] = {
+                "summary": meeting_info.get("summary", "Meeting"),
+                "htmlLink": None,
+                "start": meeting_info.get("start_datetime"),
+                "location": meeting_info.get("location"),
+                "status": "pending",
+            }
+
+    # Skip if ML decides not to create task
+    if not should_create:
+        logger.info(
+            f"Email skipped (ML decision) - ID: {message_id_short} | "
+            f"Subject: '{subject}' | "
+            f"Reasoning: {reasoning[:100]}{'...' if len(reasoning) > 100 else ''}"
+        )
+        _mark_processed(email_row, record["classified_by"])
+        record["status"] = "skipped"
+        return record
+
+    # Dedupe per provider
+    if message_id in run.existing_task_ids or task_exists(s, run.user_id, email_row.id, run.provider):
+        logger.info(
+            f"Email already processed - ID: {message_id_short} | "
+            f"Subject: '{subject}' | "
+            f"Provider: {run.provider}"
+        )
+        record["status"] = "already_processed"
+        return record
+
+    if outcome["error"]:
+        # Task creation failed; leave the email unprocessed so the next run retries it
+        record["status"] = "error"
+        record["error"] = outcome["error"]
+        return record
+
+    title = task_payload["subject"]
+    if run.auto_generate:
+        task = outcome.get("task")
+        task_id = task.get("id") if isinstance(task, dict) else None
+        logger.info(
+            f"Task created successfully - Email ID: {message_id_short} | "
+            f"Subject: '{title}' | "
+            f"Task ID: {task_id} | "
+            f"Task Title: '{task.get('title') if isinstance(task, dict) else title}' | "
+            f"Provider: {run.provider} | "
+            f"Confidence: {confidence:.2f}"
+        )
+        s.add(Task(
+            user_id=run.user_id,
+            email_id=email_row.id,
+            provider=run.provider,
+            provider_task_id=task_id,
+            provider_metadata=task if isinstance(task, dict) else None,
+            status="created",
+            category=run.category or ml_result.get("category"),
+        ))
+        record["status"] = "created"
+        record["task"] = task
+    else:
+        # Create pending task (don't create in Google Tasks yet)
+        logger.info(
+            f"Creating pending task - Email ID: {message_id_short} | "
+            f"Subject: '{title}' | "
+            f"Provider: {run.provider} | "
+            f"Confidence: {confidence:.2f}"
+        )
+        pending_task_metadata = {
+            "title": title,
+            "notes": task_payload["body"],
+            "due": task_payload.get("due"),
+            "payload": task_payload,  # What confirm_tasks needs to create it later
+        }
+        s.add(Task(
+            user_id=run.user_id,
+            email_id=email_row.id,
+            provider=run.provider,
+            provider_task_id=None,
+            provider_metadata=pending_task_metadata,
+            status="pending",
+            category=run.category or ml_result.get("category"),
+        ))
+        record["status"] = "pending"
+        record["task"] = {"title": title, "status": "pending"}
+
+    _mark_processed(email_row, record["classified_by"])
+    return record
+
+def apply_classification(s, run: FetchRun, message_id: str, payload, ml_result: Dict[str, Any]) -> Dict[str, Any]:
+    """Dispatch and store one message classified outside the pipeline (see server/backfill.py)."""
+    outcome: Dict[str, Any] = {"message_id": message_id, "error": None, "payload": payload}
+    _apply_classification(outcome, ml_result)
+    return apply_outcome(s, run, _dispatch_stage(run, outcome))
+
+def triage_messages(service, message_ids: list[str], rules: list[str], user_key=None) -> tuple[list[str], list[tuple[str, str, dict]]]:
+    """
+    Fetch metadata for message_ids and apply the triage rules.
+    Returns (ids to fully process, [(message_id, rule, metadata message)] rejected).
+    Messages whose metadata fetch fails are kept; the full fetch reports the error.
+    """
+    kept: list[str] = []
+    rejected: list[tuple[str, str, dict]] = []
+    for message_id, meta, error in batch_get_messages(service, message_ids, format="metadata", metadata_headers=TRIAGE_HEADERS, user_key=user_key):
+        rule = triage_message(meta, rules) if meta else None
+        if rule:
+            rejected.append((message_id, rule, meta))
+        else:
+            kept.append(message_id)
+    return kept, rejected
+
+def load_user_preferences(user_id: int) -> tuple[bool, list[dict], list[dict]]:
+    """Return (auto_generate, task_categories, calendar_categories) for a user."""
+    with db_session() as s:
+        stmt = select(UserSettings).where(UserSettings.user_id == user_id)
+        user_settings = s.execute(stmt).scalar_one_or_none()
+        auto_generate = user_settings.auto_generate if user_settings and user_settings.auto_generate is not None else True
+        # Normalize categories to ensure we pass full {name, description} objects to ml_decide
+        # This handles backward compatibility with old string format in database
+        task_categories = normalize_categories(user_settings.task_categories if user_settings else [])
+        calendar_categories = normalize_categories(user_settings.calendar_categories if user_settings else [])
+    return auto_generate, task_categories, calendar_categories
+
+def run_fetch(
+    user_id: int,
+    credentials,
+    provider: str,
+    window: str | None = None,
+    custom_query: str | None = None,
+    max_msgs: int | None = None,
+    since_dt: datetime | None = None,
+    client_timezone: str | None = None,
+    category: str | None = None,
+    sync: str | None = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Fetch and process a user's mail. Yields a {"type": "listed", ...} record once
+    the message IDs are known, one record per considered message (see
+    apply_outcome), then a final {"type": "summary", ...} record.
+    Usable outside a Flask request: Google services are built from credentials.
+    """
+    service = get_thread_service("gmail", "v1", credentials)
+    query = build_gmail_query(custom_query, window, since_dt)
+    logger.info(f"Gmail query: {query}")
+
+    # Incremental sync only applies to plain inbox/window polling that the
+    # history API can reproduce; explicit queries and cutoffs always do a full list.
+    history_supported, history_label = history_label_for_query(query)
+    incremental_allowed = history_supported and not custom_query and not since_dt and sync != "full"
+    with db_session() as s:
+        cursor = s.execute(select(SyncCursor).where(SyncCursor.user_id == user_id)).scalar_one_or_none()
+        cursor_history_id = cursor.history_id if cursor and cursor.query == query else None
+
+    ids = None
+    sync_mode = "full"
+    new_history_id = None
+    if incremental_allowed and cursor_history_id:
+        try:
+            logger.info(f"Fetching email IDs added since historyId {cursor_history_id}...")
+            ids, new_history_id = gmail_history_ids(service, cursor_history_id, user_key=user_id, label_id=history_label)
+            sync_mode = "incremental"
+        except HistoryExpiredError:
+            logger.info(f"historyId {cursor_history_id} expired, falling back to full list")
+
+    if ids is None:
+        # Read the historyId before listing so mail arriving mid-run is seen next time
+        new_history_id = get_history_id(service, user_key=user_id)
+        logger.info(f"Fetching email IDs from Gmail (max={max_msgs} new)...")
+        # The cap counts new messages: listing stops once more than max_msgs
+        # unprocessed IDs are seen, so a capped run still knows it left a backlog
+        ids = []
+        new_count = 0
+        for page in gmail_list_pages(service, q=query, user_key=user_id):
+            ids.extend(page)
+            with db_session() as s:
+                new_count += len(page) - len(known_message_ids(s, user_id, page))
+            if max_msgs is not None and new_count > max_msgs:
+                break
+    logger.info(f"Found {len(ids)} email(s) ({sync_mode} sync)")
+
+    auto_generate, task_categories, calendar_categories = load_user_preferences(user_id)
+    logger.info(f"Auto-generate setting: {auto_generate}")
+
+    run = FetchRun(
+        user_id=user_id,
+        credentials=credentials,
+        provider=provider,
+        auto_generate=auto_generate,
+        task_categories=task_categories,
+        calendar_categories=calendar_categories,
+        client_timezone=client_timezone,
+        since_dt=since_dt,
+        category=category,
+    )
+
+    # Drop messages we've already processed before any Gmail fetch or ML call
+    with db_session() as s:
+        known_ids = known_message_ids(s, user_id, ids)
+        pending_ids = [message_id for message_id in ids if message_id not in known_ids]
+        run.existing_task_ids = message_ids_with_tasks(s, user_id, pending_ids, provider)
+    skipped_known = len(known_ids)
+    remaining = 0
+    if max_msgs is not None and len(pending_ids) > max_msgs:
+        # Keep the cursor where it is (or unset after a full list); the rest is
+        # picked up (and the processed part pre-filtered) on the next run
+        remaining = len(pending_ids) - max_msgs
+        pending_ids = pending_ids[:max_msgs]
+        new_history_id = None
+    logger.info(f"Skipping {skipped_known} already-processed email(s), {len(pending_ids)} left to process")
+    yield {"type": "listed", "sync_mode": sync_mode, "total_found": len(ids), "skipped_known": skipped_known,
+           "to_process": len(pending_ids), "remaining": remaining}
+
+    counts = {"created": 0, "pending": 0, "skipped": 0, "already_processed": 0, "out_of_range": 0, "triaged": 0, "error": 0}
+    calendar_events = 0
+    considered = 0
+    fetch_errors = 0
+    triage_skipped: Dict[str, int] = {}
+    triage_bytes_saved = 0
+    classified_by: Dict[str, int] = {}
+
+    with db_session() as s:
+        # Reject obvious bulk mail before the full download and the classifier call
+        triage_rules = parse_rules(TRIAGE_RULES)
+        if triage_rules and pending_ids:
+            pending_ids, rejected = triage_messages(service, pending_ids, triage_rules, user_key=user_id)
+            for message_id, rule, meta in rejected:
+                considered += 1
+                email_row = get_or_create_email(s, user_id, message_id, message_to_payload(meta))
+                _mark_processed(email_row, "triage")
+                s.commit()
+                counts["triaged"] += 1
+                triage_skipped[rule] = triage_skipped.get(rule, 0) + 1
+                triage_bytes_saved += int(meta.get("sizeEstimate", 0))
+                yield {"type": "message", "message_id": message_id, "provider": provider, "status": "triaged",
+                       "rule": rule, "task": None, "calendar_event": None}
+            logger.info(f"Triage rejected {len(rejected)} email(s) by rule: {triage_skipped}")
+
+        fetched = batch_get_messages(service, pending_ids, format="full", user_key=user_id)
+        for outcome in process_messages(run, fetched):
+            considered += 1
+            if outcome.get("fetch_failed"):
+                fetch_errors += 1
+            try:
+                record = apply_outcome(s, run, outcome)
+                s.commit()
+            except Exception as e:
+                s.rollback()
+                logger.error(f"Saving email FAILED - ID: {_short_id(outcome['message_id'])} | Error: {str(e)}")
+                record = {"message_id": outcome["message_id"], "provider": provider, "status": "error",
+                          "task": None, "calendar_event": None, "error": f"Error saving email: {str(e)}"}
+            counts[record["status"]] += 1
+            if record.get("classified_by"):
+                classified_by[record["classified_by"]] = classified_by.get(record["classified_by"], 0) + 1
+            if record["calendar_event"]:
+                calendar_events += 1
+            yield {"type": "message", **record}
+
+    if new_history_id and (counts["error"] or fetch_errors):
+        # Failed emails stay unprocessed; history after a moved cursor would never list them again
+        logger.warning(
+            f"Sync cursor NOT advanced - User: {user_id} | "
+            f"Errors: {counts['error']} | Fetch errors: {fetch_errors} | Retrying them next run"
+        )
+        new_history_id = None
+    if incremental_allowed and new_history_id:
+        with db_session() as s:
+            cursor = s.execute(select(SyncCursor).where(SyncCursor.user_id == user_id)).scalar_one_or_none()
+            if cursor:
+                cursor.history_id = str(new_history_id)
+                cursor.query = query
+            else:
+                s.add(SyncCursor(user_id=user_id, history_id=str(new_history_id), query=query))
+
+    processed = counts["created"] + counts["pending"]
+    already_processed = counts["already_processed"] + skipped_known
+    logger.info(
+        f"Email processing complete: {processed} tasks created, "
+        f"{calendar_events} calendar events created, "
+        f"{already_processed} already processed ({skipped_known} skipped before fetch), "
+        f"{counts['triaged']} rejected by triage, "
+        f"{len(ids)} total found, {considered} considered, {counts['error']} errors"
+    )
+    logger.info(f"Google API quota: {quota.quota_stats()}")
+
+    yield {
+        "type": "summary",
+        "processed": processed,
+        "query": query,
+        "sync_mode": sync_mode,
+        "total_found": len(ids),
+        "already_processed": already_processed,
+        "skipped_known": skipped_known,
+        "remaining": remaining,
+        "considered": considered,
+        "fetch_errors": fetch_errors,
+        "errors": counts["error"],
+        "calendar_events": calendar_events,
+        "triage_skipped": triage_skipped,
+        "triage_bytes_saved": triage_bytes_saved,
+        "classified_by": classified_by,
+    }
+
+def collect_fetch_result(
+    records: Iterable[Dict[str, Any]],
+    on_record: Callable[[Dict[str, Any]], None] | None = None,
+) -> Dict[str, Any]:
+    """Fold run_fetch records into the /fetch-emails response body."""
+    created_tasks = []
+    created_calendar_events = []
+    errors = []
+    summary: Dict[str, Any] = {}
+    for record in records:
+        if on_record:
+            on_record(record)
+        if record["type"] == "summary":
+            summary = record
+            continue
+        if record["type"] != "message":
+            continue
+        if record["task"]:
+            created_tasks.append({
+                "message_id": record["message_id"],
+                "provider": record["provider"],
+                "task": record["task"],
+            })
+        if record["calendar_event"]:
+            created_calendar_events.append(record["calendar_event"])
+        if record["status"] == "error":
+            errors.append({"message_id": record["message_id"], "error": record.get("error")})
+
+    return {
+        "processed": summary["processed"],
+        "query": summary["query"],
+        "sync_mode": summary["sync_mode"],
+        "created": created_tasks,
+        "total_found": summary["total_found"],
+        "already_processed": summary["already_processed"],
+        "skipped_known": summary["skipped_known"],
+        "remaining": summary["remaining"],
+        "considered": summary["considered"],
+        "fetch_errors": summary["fetch_errors"],
+        "triage_skipped": summary["triage_skipped"],
+        "triage_bytes_saved": summary["triage_bytes_saved"],
+        "classified_by": summary["classified_by"],
+        "errors": errors,
+        "calendar_events": created_calendar_events
+    }
@@ -1,8 +1,9 @@
 """Google Tasks provider."""
 
 from __future__ import annotations
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Hashable, Optional
 from googleapiclient.discovery import Resource
+from server import quota
 
 MAX_NOTES_LEN = 8000
 
@@ -21,28 +22,34 @@ def _truncate(s: str, limit: int = MAX_NOTES_LEN) -> str:
     return f"{head}\n...\n{tail}"
 
 
-def _get_or_create_tasklist(service: Resource, title: str) -> str:
+def _get_or_create_tasklist(service: Resource, title: str, user_key: Hashable | None = None) -> str:
     """Return tasklist id with given title. create it if missing."""
     try:
         req = service.tasklists().list(maxResults=100)
         while req is not None:
-            resp = req.execute()
+            resp = quota.execute(req, "tasks", user_key=user_key)
             tasklists = resp.get("items", [])
             for tl in tasklists:
                 if tl.get("title") == title:
                     return tl["id"]
             req = service.tasklists().list_next(req, resp)
-        created = service.tasklists().insert(body={"title": title}).execute()
+        created = quota.execute(service.tasklists().insert(body={"title": title}), "tasks", user_key=user_key, idempotent=False)
         return created["id"]
     except Exception as e:
         raise GoogleTasksError(f"Error accessing Google Tasks: {str(e)}")
 
 
+def resolve_tasklist(service: Resource, title: str, user_key: Hashable | None = None) -> str:
+    """Return the id of the tasklist with given title, creating it if missing."""
+    return _get_or_create_tasklist(service, title, user_key=user_key)
+
+
 def create_task(
     tasks_service: Resource,
     tasklist_title: str,
     payload: Dict[str, Any],
     tasklist_id: Optional[str] = None,
+    user_key: Hashable | None = None,
 ) -> Dict[str, Any]:
     """
     Create a Google Task in the chosen list (by title or explicit id).
@@ -71,11 +78,11 @@ def create_task(
 
     try:
         if not tasklist_id:
-            list_id = _get_or_create_tasklist(tasks_service, tasklist_title or "Tasks")
+            list_id = _get_or_create_tasklist(tasks_service, tasklist_title or "Tasks", user_key=user_key)
         else:
             list_id = tasklist_id
 
-        created = tasks_service.tasks().insert(tasklist=list_id, body=task_body).execute()
+        created = quota.execute(tasks_service.tasks().insert(tasklist=list_id, body=task_body), "tasks", user_key=user_key, idempotent=False)
     except Exception as e:
         raise GoogleTasksError(f"Error creating task: {str(e)}")
     web_url = f"https://tasks.google.com/"
@@ -94,12 +101,13 @@ def delete_task(
     tasks_service: Resource,
     tasklist_id: str,
     task_id: str,
+    user_key: Hashable | None = None,
 ) -> None:
     """
     Delete a Google Task from the specified tasklist.
     """
 
     try:
-        tasks_service.tasks().delete(tasklist=tasklist_id, task=task_id).execute()
+        quota.execute(tasks_service.tasks().delete(tasklist=tasklist_id, task=task_id), "tasks", user_key=user_key)
     except Exception as e:
         raise GoogleTasksError(f"Error deleting task: {str(e)}")
@@ -0,0 +1,268 @@
+"""
+Quota-aware execution for Google API calls.
+
+Every Gmail/Tasks/Calendar request goes through execute() (or, for Gmail
+batches, the per-item retry loop in server/gmail.py), which:
+- takes the call's quota units from a per-user and a global token bucket
+  per API, sized from the published quotas (see QUOTA_* in config);
+- holds a slot in an adaptive (AIMD) concurrency limit per API: +1/limit
+  per success, halved when Google throttles;
+- retries 429, 5xx and rate-limit 403s with exponential backoff and full
+  jitter, honouring Retry-After. Non-idempotent calls (inserts) are only
+  retried on errors Google returns before executing them (429 and
+  rate-limit 403s): after a 5xx or a timeout the write may have happened,
+  and replaying it would create a duplicate.
+Counters for calls, retries, throttles and bucket waits are kept per API
+(see quota_stats(); logged after every fetch run and exported by the scheduler).
+"""
+
+from __future__ import annotations
+import json
+import logging
+import random
+import socket
+import threading
+import time
+from typing import Any, Dict, Hashable
+from googleapiclient.errors import HttpError
+from server.config import (
+    GOOGLE_API_MAX_RETRIES,
+    QUOTA_GMAIL_PER_USER,
+    QUOTA_GMAIL_GLOBAL,
+    QUOTA_TASKS_PER_USER,
+    QUOTA_TASKS_GLOBAL,
+    QUOTA_CALENDAR_PER_USER,
+    QUOTA_CALENDAR_GLOBAL,
+)
+
+logger = logging.getLogger(__name__)
+
+# Quota units per second, (per user, global) per API. Gmail publishes
+# 250 units/user/second; Tasks and Calendar count one unit per request.
+QUOTA_RATES: Dict[str, tuple[float, float]] = {
+    "gmail": (QUOTA_GMAIL_PER_USER, QUOTA_GMAIL_GLOBAL),
+    "tasks": (QUOTA_TASKS_PER_USER, QUOTA_TASKS_GLOBAL),
+    "calendar": (QUOTA_CALENDAR_PER_USER, QUOTA_CALENDAR_GLOBAL),
+}
+
+# Gmail quota units per method (https://developers.google.com/gmail/api/reference/quota)
+GMAIL_UNITS = {
+    "messages.list": 5,
+    "messages.get": 5,
+    "history.list": 2,
+    "getProfile": 1,
+}
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded", "backendError"}
+# 403 reasons for requests rejected before execution, safe to replay even when not idempotent
+REJECTED_REASONS = {"rateLimitExceeded", "userRateLimitExceeded", "quotaExceeded"}
+
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 32.0
+
+# AIMD concurrency bounds per API
+CONCURRENCY_INITIAL = 8
+CONCURRENCY_MIN = 1
+CONCURRENCY_MAX = 64
+
+
+class TokenBucket:
+    """Classic token bucket; acquire() blocks until enough tokens are available."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, units: float = 1.0) -> float:
+        """Take units (more than capacity are taken a bucketful at a time); returns seconds spent waiting."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while units > 0:
+            chunk = min(units, self.capacity)
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= chunk:
+                    self._tokens -= chunk
+                    units -= chunk
+                    continue
+                delay = (chunk - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+        return waited
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: additive increase on success, multiplicative decrease on throttling."""
+
+    def __init__(self, initial: int = CONCURRENCY_INITIAL, minimum: int = CONCURRENCY_MIN, maximum: int = CONCURRENCY_MAX):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self.in_flight >= int(self.limit):
+                self._cond.wait()
+            self.in_flight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self.in_flight -= 1
+            self._cond.notify()
+        return False
+
+    def on_success(self):
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify()
+
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit / 2)
+
+
+_lock = threading.Lock()
+_global_buckets: Dict[str, TokenBucket] = {}
+_user_buckets: Dict[tuple[str, Hashable], TokenBucket] = {}
+_limiters: Dict[str, AdaptiveLimiter] = {}
+_counters: Dict[str, Dict[str, float]] = {}
+
+
+def _counter(api: str) -> Dict[str, float]:
+    return _counters.setdefault(api, {"calls": 0, "retried": 0, "throttled": 0, "failed": 0, "bucket_waits": 0, "bucket_wait_seconds": 0.0})
+
+
+def count(api: str, name: str, value: float = 1):
+    with _lock:
+        _counter(api)[name] += value
+
+
+def limiter(api: str) -> AdaptiveLimiter:
+    with _lock:
+        if api not in _limiters:
+            _limiters[api] = AdaptiveLimiter()
+        return _limiters[api]
+
+
+def acquire(api: str, units: float = 1, user_key: Hashable | None = None):
+    """Take quota units for one call from the user's and the global bucket."""
+    user_rate, global_rate = QUOTA_RATES.get(api, (0.0, 0.0))
+    with _lock:
+        buckets = []
+        if user_key is not None and user_rate > 0:
+            key = (api, user_key)
+            if key not in _user_buckets:
+                _user_buckets[key] = TokenBucket(user_rate)
+            buckets.append(_user_buckets[key])
+        if global_rate > 0:
+            if api not in _global_buckets:
+                _global_buckets[api] = TokenBucket(global_rate)
+            buckets.append(_global_buckets[api])
+    waited = sum(bucket.acquire(units) for bucket in buckets)
+    if waited:
+        count(api, "bucket_waits")
+        count(api, "bucket_wait_seconds", waited)
+
+
+def _error_reasons(error: HttpError) -> set[str]:
+    try:
+        details = json.loads(error.content.decode("utf-8")).get("error", {})
+    except Exception:
+        return set()
+    return {e.get("reason") for e in details.get("errors", []) if isinstance(e, dict)}
+
+
+def is_throttle(error: Exception) -> bool:
+    """True for Google's 'slow down' answers (429, or 403 with a rate-limit reason)."""
+    if not isinstance(error, HttpError):
+        return False
+    status = getattr(error.resp, "status", None)
+    return status == 429 or (status == 403 and bool(_error_reasons(error) & RATE_LIMIT_REASONS))
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, HttpError):
+        return getattr(error.resp, "status", None) in RETRYABLE_STATUSES or is_throttle(error)
+    # Transport hiccups: timeouts, resets
+    return isinstance(error, (socket.timeout, ConnectionError, TimeoutError))
+
+
+def is_rejected(error: Exception) -> bool:
+    """True for errors Google returns without executing the request (429, or 403 with a rate-limit reason)."""
+    if not isinstance(error, HttpError):
+        return False
+    status = getattr(error.resp, "status", None)
+    return status == 429 or (status == 403 and bool(_error_reasons(error) & REJECTED_REASONS))
+
+
+def backoff_delay(attempt: int, error: Exception | None = None) -> float:
+    """Full-jitter exponential backoff; a Retry-After header wins when Google sends one."""
+    if isinstance(error, HttpError):
+        retry_after = getattr(error.resp, "get", lambda *_: None)("retry-after")
+        if retry_after:
+            try:
+                return min(BACKOFF_MAX, float(retry_after))
+            except ValueError:
+                pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)))
+
+
+def note_failure(api: str, error: Exception, idempotent: bool = True) -> bool:
+    """Record a failed attempt (throttle feedback and counters); True if it's worth retrying."""
+    if is_throttle(error):
+        limiter(api).on_throttle()
+        count(api, "throttled")
+    return is_retryable(error) if idempotent else is_rejected(error)
+
+
+def execute(
+    request: Any,
+    api: str,
+    units: float = 1,
+    user_key: Hashable | None = None,
+    max_retries: int = GOOGLE_API_MAX_RETRIES,
+    idempotent: bool = True,
+) -> Any:
+    """
+    Execute a googleapiclient request under the quota buckets, concurrency limit and retry policy.
+    Pass idempotent=False for inserts: they are only retried when Google rejected them unexecuted.
+    """
+    attempt = 0
+    while True:
+        acquire(api, units, user_key)
+        count(api, "calls")
+        try:
+            with limiter(api):
+                response = request.execute()
+            limiter(api).on_success()
+            return response
+        except Exception as e:
+            if not note_failure(api, e, idempotent) or attempt >= max_retries:
+                count(api, "failed")
+                raise
+            delay = backoff_delay(attempt, e)
+            logger.warning(f"Google {api} call retrying in {delay:.2f}s (attempt {attempt + 1}/{max_retries}) - Error: {str(e)}")
+            count(api, "retried")
+            attempt += 1
+            time.sleep(delay)
+
+
+def quota_stats() -> Dict[str, Dict[str, float]]:
+    """Snapshot of per-API counters plus the current adaptive concurrency limit."""
+    with _lock:
+        stats = {api: dict(counters) for api, counters in _counters.items()}
+        for api, lim in _limiters.items():
+            stats.setdefault(api, dict(_counter(api)))
+            stats[api]["concurrency_limit"] = round(lim.limit, 2)
+            stats[api]["in_flight"] = lim.in_flight
+    return stats
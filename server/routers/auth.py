@@ -2,7 +2,7 @@ from flask import Blueprint, session, jsonify, redirect, request
 from google_auth_oauthlib.flow import Flow
 from googleapiclient.discovery import build
 from server.config import CLIENT_SECRETS_FILE, REDIRECT_URI, FRONTEND_URL
-from server.utils import SCOPES, get_or_create_user, encode_jwt
+from server.utils import SCOPES, get_or_create_user, encode_jwt, store_credentials
 from server.db import db_session
 import os
 import logging
@@ -89,7 +89,9 @@ def oauth2callback():
             if user_email:
                 session["user_email"] = user_email
                 with db_session() as s:
-                    get_or_create_user(s, user_email)
+                    user_id = get_or_create_user(s, user_email).id
+                # Keep credentials for the background scheduler (server/scheduler.py)
+                store_credentials(user_id, session["credentials"])
                 logger.info(f"User authenticated: {user_email}")
                 
                 # Generate JWT token
@@ -2,8 +2,9 @@ from flask import Blueprint, session, jsonify, request
 from datetime import datetime, timezone, timedelta
 from dateutil import parser as dateutil_parser
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
-from server.utils import get_current_user, get_calendar_service, require_auth
+from server.utils import get_current_user, get_calendar_service, mark_user_decided, require_auth
 from server.db import db_session, CalendarEvent, Email
+from server import quota
 from sqlalchemy import select
 import logging
 
@@ -112,10 +113,11 @@ def delete_calendar_events():
                     google_event_id = calendar_event.google_event_id
                     if google_event_id and calendar_service:
                         try:
-                            calendar_service.events().delete(calendarId="primary", eventId=google_event_id).execute()
-                        except Exception:
-                            pass
+                            quota.execute(calendar_service.events().delete(calendarId="primary", eventId=google_event_id), "calendar", user_key=user_id)
+                        except Exception as e:
+                            logger.warning(f"Calendar event delete FAILED - Event ID: {google_event_id} | Error: {str(e)}")
 
+                    mark_user_decided(s, calendar_event.email_id)
                     s.delete(calendar_event)
                     deleted_count += 1
                 except ValueError:
@@ -166,7 +168,7 @@ def timezone_name_from_dt(dt: datetime):
     return "UTC"
 
 
-def create_google_calendar_event(meeting: dict, client_timezone: str | None):
+def create_google_calendar_event(meeting: dict, client_timezone: str | None, user_key=None):
     """
     Create a Google Calendar event for a meeting.
     Use the client's timezone to interpret naive meeting times so the
@@ -216,7 +218,9 @@ def create_google_calendar_event(meeting: dict, client_timezone: str | None):
     }
 
     try:
-        created_event = calendar_service.events().insert(calendarId="primary", body=event).execute()
+        created_event = quota.execute(
+            calendar_service.events().insert(calendarId="primary", body=event), "calendar", user_key=user_key, idempotent=False,
+        )
         return created_event
     except Exception as e:
         logger.error(
@@ -272,7 +276,7 @@ def confirm_calendar_events():
                     
                     # Create event in Google Calendar
                     try:
-                        created_event = create_google_calendar_event(metadata, client_timezone)
+                        created_event = create_google_calendar_event(metadata, client_timezone, user_key=user_id)
                         if created_event:
                             calendar_event.google_event_id = created_event.get("id")
                             calendar_event.html_link = created_event.get("htmlLink")
@@ -300,6 +304,7 @@ def confirm_calendar_events():
                             
                             calendar_event.provider_metadata = created_event
                             calendar_event.status = "created"
+                            mark_user_decided(s, calendar_event.email_id)
                             confirmed_count += 1
                         else:
                             errors.append(f"Error creating event {event_id} in Google Calendar")
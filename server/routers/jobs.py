@@ -0,0 +1,19 @@
+from flask import Blueprint, jsonify
+from server.utils import get_current_user, require_auth
+from server.jobs import get_job
+
+jobs_bp = Blueprint('jobs', __name__)
+
+@jobs_bp.route("/jobs/<int:job_id>")
+@require_auth
+def api_get_job(job_id: int):
+    """Return status and live counters of a background fetch job."""
+
+    user = get_current_user()
+    if not user:
+        return jsonify({"error": "Could not determine user"}), 401
+
+    job = get_job(user.id, job_id)
+    if not job:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
@@ -2,6 +2,7 @@ from flask import Blueprint, session, jsonify, request
 from datetime import datetime, timezone
 from server.utils import get_current_user, require_auth
 from server.db import db_session, UserSettings
+from server import classification_cache
 from sqlalchemy import select
 
 settings_bp = Blueprint('settings', __name__)
@@ -108,6 +109,12 @@ def update_settings():
             stmt = select(UserSettings).where(UserSettings.user_id == user_id)
             user_settings = s.execute(stmt).scalar_one_or_none()
 
+            categories_changed = (
+                user_settings is None
+                or user_settings.task_categories != task_categories_normalized
+                or user_settings.calendar_categories != calendar_categories_normalized
+            )
+
             if user_settings:
                 # Update existing settings
                 user_settings.provider = "google_tasks"
@@ -142,6 +149,10 @@ def update_settings():
                 "auto_generate": user_settings.auto_generate if user_settings.auto_generate is not None else True,
             }
 
+        # Cached classifications were made against the old categories
+        if categories_changed:
+            classification_cache.invalidate_user(user_id)
+
         return jsonify(result)
     except Exception as e:
         return jsonify({"error": "Failed to update settings"}), 500
@@ -1,5 +1,5 @@
 from flask import Blueprint, session, jsonify, request
-from server.utils import get_current_user, get_tasks_service, require_auth
+from server.utils import get_current_user, get_tasks_service, mark_user_decided, require_auth
 from server.db import db_session, Task, Email
 from server.providers.google_tasks import delete_task as delete_google_task, create_task as create_google_task, GoogleTasksError
 from server.config import TASKS_LIST_TITLE
@@ -113,10 +113,11 @@ def delete_tasks():
 
                     if provider_task_id and task.provider == "google_tasks" and tasklist_id and tasks_service:
                         try:
-                            delete_google_task(tasks_service, tasklist_id, provider_task_id)
+                            delete_google_task(tasks_service, tasklist_id, provider_task_id, user_key=user_id)
                         except GoogleTasksError:
                             pass
 
+                    mark_user_decided(s, task.email_id)
                     s.delete(task)
                     deleted_count += 1
                 except ValueError:
@@ -179,10 +180,11 @@ def confirm_tasks():
                     
                     # Create task in Google Tasks
                     try:
-                        created_task = create_google_task(tasks_service, TASKS_LIST_TITLE, payload)
+                        created_task = create_google_task(tasks_service, TASKS_LIST_TITLE, payload, user_key=user_id)
                         task.provider_task_id = created_task.get("id") if isinstance(created_task, dict) else None
                         task.provider_metadata = created_task if isinstance(created_task, dict) else metadata
                         task.status = "created"
+                        mark_user_decided(s, task.email_id)
                         confirmed_count += 1
                     except GoogleTasksError as e:
                         errors.append(f"Error creating task {task_id} in Google Tasks: {str(e)}")
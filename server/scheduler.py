@@ -0,0 +1,362 @@
+"""
+Background mailbox polling.
+
+Polls every user with stored credentials (saved at login) through the same
+pipeline as /fetch-emails:
+- each user is due every SCHEDULER_INTERVAL seconds, with +/- SCHEDULER_JITTER
+  so users added together don't poll together;
+- a turn that finds no new mail doubles that user's interval, up to
+  SCHEDULER_MAX_INTERVAL; new mail resets it;
+- a turn processes at most SCHEDULER_MESSAGES_PER_TURN messages, and a user
+  with more waiting goes to the back of the ready queue, so one huge mailbox
+  takes turns with everyone else instead of holding a worker.
+
+Queue depth and lag are logged periodically and, with --metrics-port, served
+in Prometheus text format at /metrics.
+
+Usage:
+    python -m server.scheduler [--workers 4] [--metrics-port 9100]
+"""
+
+from __future__ import annotations
+import argparse
+import heapq
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict
+from google.auth.exceptions import RefreshError
+from sqlalchemy import select
+from server.config import (
+    DEFAULT_PROVIDER,
+    SCHEDULER_INTERVAL,
+    SCHEDULER_MAX_INTERVAL,
+    SCHEDULER_JITTER,
+    SCHEDULER_WORKERS,
+    SCHEDULER_MESSAGES_PER_TURN,
+)
+from server.db import db_session, init_db, StoredCredential, UserSettings
+from server.pipeline import run_fetch
+from server.classification_cache import cache_stats
+from server.local_classifier import local_classifier_stats
+from server.text_reduction import reduction_stats
+from server.ml import openai_client_stats, tier_stats, usage_stats
+from server.quota import quota_stats
+from server.utils import load_stored_credentials
+
+logger = logging.getLogger(__name__)
+
+# Seconds between scans of stored_credentials for new or removed users
+USER_REFRESH_INTERVAL = 60.0
+# Multiplier applied to a user's interval after an idle turn
+IDLE_BACKOFF = 2.0
+DEFAULT_WINDOW = "1d"
+
+
+class Scheduler:
+    def __init__(
+        self,
+        workers: int = SCHEDULER_WORKERS,
+        interval: float = SCHEDULER_INTERVAL,
+        max_interval: float = SCHEDULER_MAX_INTERVAL,
+        jitter: float = SCHEDULER_JITTER,
+        messages_per_turn: int = SCHEDULER_MESSAGES_PER_TURN,
+    ):
+        self.workers = max(1, workers)
+        self.interval = interval
+        self.max_interval = max(interval, max_interval)
+        self.jitter = jitter
+        self.messages_per_turn = max(1, messages_per_turn)
+
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._waiting: list[tuple[float, int]] = []  # heap of (due_at, user_id)
+        self._ready: deque[tuple[float, int]] = deque()  # FIFO of (due_at, user_id)
+        self._running: set[int] = set()
+        self._intervals: Dict[int, float] = {}
+        self._rng = random.Random()
+        self.counters = {"turns": 0, "turns_idle": 0, "turns_backlogged": 0, "turn_errors": 0, "messages": 0, "tasks": 0}
+        self._last_turn_lag = 0.0
+        self._max_turn_lag = 0.0
+
+    # --- scheduling ----------------------------------------------------------
+
+    def _jittered(self, seconds: float) -> float:
+        return seconds * (1 + self._rng.uniform(-self.jitter, self.jitter))
+
+    def sync_users(self):
+        """Add users who logged in since the last scan; drop ones whose credentials are gone or failing."""
+        with db_session() as s:
+            stmt = select(StoredCredential.user_id).where(StoredCredential.last_error.is_(None))
+            active = set(s.execute(stmt).scalars().all())
+        now = time.time()
+        with self._cond:
+            for user_id in active - set(self._intervals):
+                self._intervals[user_id] = self.interval
+                # Spread the first polls over one interval rather than all at once
+                heapq.heappush(self._waiting, (now + self._rng.uniform(0, self.interval), user_id))
+            for user_id in set(self._intervals) - active:
+                self._intervals.pop(user_id, None)
+            self._waiting = [(due, uid) for due, uid in self._waiting if uid in self._intervals]
+            heapq.heapify(self._waiting)
+            self._ready = deque((due, uid) for due, uid in self._ready if uid in self._intervals)
+            self._cond.notify_all()
+
+    def _promote_due(self, now: float):
+        while self._waiting and self._waiting[0][0] <= now:
+            self._ready.append(heapq.heappop(self._waiting))
+
+    def _next_turn(self) -> tuple[float, int] | None:
+        with self._cond:
+            while not self._stop.is_set():
+                now = time.time()
+                self._promote_due(now)
+                # Skip users already mid-turn; they are rescheduled when it ends
+                for _ in range(len(self._ready)):
+                    due, user_id = self._ready.popleft()
+                    if user_id not in self._running:
+                        self._running.add(user_id)
+                        return due, user_id
+                    self._ready.append((due, user_id))
+                timeout = self._waiting[0][0] - now if self._waiting else USER_REFRESH_INTERVAL
+                self._cond.wait(timeout=max(0.05, min(timeout, USER_REFRESH_INTERVAL)))
+        return None
+
+    def _reschedule(self, user_id: int, found: int, backlogged: bool):
+        with self._cond:
+            self._running.discard(user_id)
+            if user_id not in self._intervals:
+                return
+            now = time.time()
+            if backlogged:
+                # More mail waiting: straight to the back of the ready queue
+                self._ready.append((now, user_id))
+            else:
+                if found:
+                    self._intervals[user_id] = self.interval
+                else:
+                    self._intervals[user_id] = min(self.max_interval, self._intervals[user_id] * IDLE_BACKOFF)
+                heapq.heappush(self._waiting, (now + self._jittered(self._intervals[user_id]), user_id))
+            self._cond.notify_all()
+
+    # --- turns ---------------------------------------------------------------
+
+    def poll_user(self, user_id: int) -> Dict[str, Any]:
+        """Run one capped fetch for a user and return the pipeline's summary record."""
+        credentials = load_stored_credentials(user_id)
+        if credentials is None:
+            raise RefreshError("No usable stored credentials")
+        token_before = credentials.token
+
+        with db_session() as s:
+            user_settings = s.execute(select(UserSettings).where(UserSettings.user_id == user_id)).scalar_one_or_none()
+            provider = user_settings.provider if user_settings and user_settings.provider else DEFAULT_PROVIDER
+            window = user_settings.window if user_settings and user_settings.window else DEFAULT_WINDOW
+
+        summary: Dict[str, Any] = {}
+        for record in run_fetch(user_id, credentials, provider=provider, window=window, max_msgs=self.messages_per_turn):
+            if record["type"] == "summary":
+                summary = record
+
+        # Persist a refreshed access token so the next turn doesn't refresh again
+        if credentials.token != token_before:
+            with db_session() as s:
+                stored = s.execute(select(StoredCredential).where(StoredCredential.user_id == user_id)).scalar_one_or_none()
+                if stored:
+                    stored.info = {**stored.info, **json.loads(credentials.to_json())}
+        return summary
+
+    def _worker(self):
+        while True:
+            turn = self._next_turn()
+            if turn is None:
+                return
+            due, user_id = turn
+            lag = max(0.0, time.time() - due)
+            found, backlogged = 0, False
+            try:
+                summary = self.poll_user(user_id)
+                # Back off on new mail only: a full list also counts IDs already processed
+                found = summary.get("considered", 0)
+                backlogged = summary.get("remaining", 0) > 0
+                with self._cond:
+                    self.counters["turns"] += 1
+                    self.counters["messages"] += summary.get("considered", 0)
+                    self.counters["tasks"] += summary.get("processed", 0)
+                    if not found:
+                        self.counters["turns_idle"] += 1
+                    if backlogged:
+                        self.counters["turns_backlogged"] += 1
+            except RefreshError as e:
+                logger.warning(f"Polling disabled - User ID: {user_id} | Error: {str(e)}")
+                with db_session() as s:
+                    stored = s.execute(select(StoredCredential).where(StoredCredential.user_id == user_id)).scalar_one_or_none()
+                    if stored:
+                        stored.last_error = str(e)
+                with self._cond:
+                    self._intervals.pop(user_id, None)
+                    self.counters["turn_errors"] += 1
+            except Exception as e:
+                logger.error(f"Polling FAILED - User ID: {user_id} | Error: {str(e)}")
+                with self._cond:
+                    self.counters["turn_errors"] += 1
+            finally:
+                with self._cond:
+                    self._last_turn_lag = lag
+                    self._max_turn_lag = max(self._max_turn_lag, lag)
+                self._reschedule(user_id, found, backlogged)
+
+    # --- metrics -------------------------------------------------------------
+
+    def metrics(self) -> Dict[str, Any]:
+        with self._cond:
+            now = time.time()
+            self._promote_due(now)
+            oldest = min((due for due, _ in self._ready), default=None)
+            return {
+                "users": len(self._intervals),
+                "queue_depth": len(self._ready),
+                "running": len(self._running),
+                "waiting": len(self._waiting),
+                "queue_lag_seconds": round(now - oldest, 3) if oldest is not None else 0.0,
+                "last_turn_lag_seconds": round(self._last_turn_lag, 3),
+                "max_turn_lag_seconds": round(self._max_turn_lag, 3),
+                "workers": self.workers,
+                **self.counters,
+            }
+
+    def prometheus_metrics(self) -> str:
+        lines = []
+        for name, value in self.metrics().items():
+            kind = "counter" if name in self.counters else "gauge"
+            lines.append(f"# TYPE taskflow_scheduler_{name} {kind}")
+            lines.append(f"taskflow_scheduler_{name} {value}")
+        families: Dict[str, list[str]] = {}
+        for api, stats in quota_stats().items():
+            for name, value in stats.items():
+                families.setdefault(name, []).append(f'taskflow_google_api_{name}{{api="{api}"}} {value}')
+        for name, samples in families.items():
+            kind = "gauge" if name in ("concurrency_limit", "in_flight") else "counter"
+            lines.append(f"# TYPE taskflow_google_api_{name} {kind}")
+            lines.extend(samples)
+        for name, value in openai_client_stats().items():
+            kind = "gauge" if name in ("clients", "reuse_rate") else "counter"
+            lines.append(f"# TYPE taskflow_openai_http_{name} {kind}")
+            lines.append(f"taskflow_openai_http_{name} {value}")
+        for name, value in cache_stats().items():
+            kind = "gauge" if name == "hit_rate" else "counter"
+            lines.append(f"# TYPE taskflow_classification_cache_{name} {kind}")
+            lines.append(f"taskflow_classification_cache_{name} {value}")
+        for name, value in local_classifier_stats().items():
+            kind = "gauge" if name == "llm_call_reduction" else "counter"
+            lines.append(f"# TYPE taskflow_local_classifier_{name} {kind}")
+            lines.append(f"taskflow_local_classifier_{name} {value}")
+        for name, value in tier_stats().items():
+            kind = "gauge" if name == "escalation_rate" else "counter"
+            lines.append(f"# TYPE taskflow_classify_tier_{name} {kind}")
+            lines.append(f"taskflow_classify_tier_{name} {value}")
+        for name, value in usage_stats().items():
+            kind = "gauge" if name == "cached_ratio" else "counter"
+            lines.append(f"# TYPE taskflow_openai_usage_{name} {kind}")
+            lines.append(f"taskflow_openai_usage_{name} {value}")
+        reduction = reduction_stats()
+        for name, value in reduction.items():
+            if name == "rules":
+                continue
+            kind = "gauge" if name == "reduction" else "counter"
+            lines.append(f"# TYPE taskflow_text_reduction_{name} {kind}")
+            lines.append(f"taskflow_text_reduction_{name} {value}")
+        for name in ("hits", "chars_removed"):
+            lines.append(f"# TYPE taskflow_text_reduction_rule_{name} counter")
+            lines.extend(f'taskflow_text_reduction_rule_{name}{{rule="{rule}"}} {counts[name]}' for rule, counts in reduction["rules"].items())
+        return "\n".join(lines) + "\n"
+
+    def serve_metrics(self, port: int) -> ThreadingHTTPServer:
+        scheduler = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("/metrics", ""):
+                    self.send_error(404)
+                    return
+                body = scheduler.prometheus_metrics().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="scheduler-metrics", daemon=True).start()
+        logger.info(f"Scheduler metrics on :{port}/metrics")
+        return server
+
+    # --- lifecycle -----------------------------------------------------------
+
+    def run(self, metrics_interval: float = 60.0):
+        """Run until stop() (or Ctrl-C); blocks the calling thread."""
+        threads = [threading.Thread(target=self._worker, name=f"poll-{i}", daemon=True) for i in range(self.workers)]
+        for t in threads:
+            t.start()
+        last_sync = last_metrics = 0.0
+        try:
+            while not self._stop.is_set():
+                now = time.time()
+                if now - last_sync >= USER_REFRESH_INTERVAL:
+                    self.sync_users()
+                    last_sync = now
+                if now - last_metrics >= metrics_interval:
+                    logger.info(f"Scheduler metrics: {self.metrics()} | Google API: {quota_stats()} | OpenAI HTTP: {openai_client_stats()} | Classification cache: {cache_stats()} | Local classifier: {local_classifier_stats()} | Tiers: {tier_stats()} | Token usage: {usage_stats()} | Text reduction: {reduction_stats()}")
+                    last_metrics = now
+                self._stop.wait(1.0)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            for t in threads:
+                t.join()
+
+    def stop(self):
+        self._stop.set()
+        with self._cond:
+            self._cond.notify_all()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Poll every connected mailbox on a schedule.")
+    parser.add_argument("--workers", type=int, default=SCHEDULER_WORKERS)
+    parser.add_argument("--interval", type=float, default=SCHEDULER_INTERVAL, help="base seconds between polls per user")
+    parser.add_argument("--max-interval", type=float, default=SCHEDULER_MAX_INTERVAL, help="cap for idle backoff")
+    parser.add_argument("--messages-per-turn", type=int, default=SCHEDULER_MESSAGES_PER_TURN)
+    parser.add_argument("--metrics-port", type=int, default=None, help="serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-interval", type=float, default=60.0, help="seconds between metrics log lines")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        handlers=[logging.StreamHandler(sys.stdout)],
+    )
+    init_db()
+    scheduler = Scheduler(
+        workers=args.workers,
+        interval=args.interval,
+        max_interval=args.max_interval,
+        messages_per_turn=args.messages_per_turn,
+    )
+    if args.metrics_port:
+        scheduler.serve_metrics(args.metrics_port)
+    logger.info(f"Scheduler started: {args.workers} worker(s), interval {args.interval}s (max {args.max_interval}s)")
+    scheduler.run(metrics_interval=args.metrics_interval)
+
+
+if __name__ == "__main__":
+    main()
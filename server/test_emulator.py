@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+End-to-end fetch pipeline test against the emulated Gmail/Tasks/OpenAI backends.
+Usage: python3 -m pytest server/test_emulator.py
+"""
+
+import asyncio
+import os
+import tempfile
+import time
+from pathlib import Path
+import pytest
+
+# Keep the run off the real taskflow.db (must happen before server.db is imported)
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp(prefix='taskflow-test-')}/taskflow.db")
+
+from server import backfill, classification_cache, local_classifier, ml, pipeline
+from server.db import init_db, db_session
+from server.emulator import Emulator, EmulatorConfig, emulated_credentials
+from server.ml import classify_and_generate_task, classify_batch, ml_decide, ml_decide_batch, ml_decide_many
+from server.pipeline import run_fetch, collect_fetch_result
+from server.utils import get_or_create_user
+
+
+@pytest.fixture
+def openai_requests():
+    """An emulator with an empty mailbox, and the kwargs of every chat completion request sent to it."""
+    emulator = Emulator(EmulatorConfig(messages=0, rate_limit_rate=0.0)).install()
+    requests = []
+    create = emulator.openai.chat.completions.create
+    def recording(**kwargs):
+        requests.append(kwargs)
+        return create(**kwargs)
+    emulator.openai.chat.completions.create = recording
+    try:
+        yield emulator, requests
+    finally:
+        Emulator.uninstall()
+
+
+def test_fetch_against_emulator():
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=30, rate_limit_rate=0.0)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-test@example.com").id
+        creds = emulated_credentials("emulator-test")
+
+        first = collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", window="7d", max_msgs=30))
+        assert first["considered"] == 30
+        assert first["processed"] > 0
+        assert first["processed"] == len(emulator.tasks.tasks_by_id)
+        assert not first["errors"]
+
+        # Nothing new in the mailbox: the incremental sync finds no messages
+        second = collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", window="7d", max_msgs=30))
+        assert second["sync_mode"] == "incremental"
+        assert second["considered"] == 0
+
+        emulator.mailbox("emulator-test").add_messages(5)
+        third = collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", window="7d", max_msgs=30))
+        assert third["total_found"] == 5
+    finally:
+        Emulator.uninstall()
+
+
+def test_fetch_retries_injected_rate_limits():
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=10, rate_limit_rate=0.15, error_rate=0.05, seed=7)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-retry@example.com").id
+        result = collect_fetch_result(run_fetch(user_id, emulated_credentials("emulator-retry"), provider="google_tasks", window="7d", max_msgs=10))
+        assert emulator.faults.counters["rate_limited"] > 0
+        assert result["considered"] == 10
+        assert result["fetch_errors"] == 0
+        # Inserts are not replayed after a 5xx (the write may have happened); those emails are retried next run
+        assert all("503" in error["error"] for error in result["errors"])
+        emulator.faults.config.error_rate = 0.0
+        retry = collect_fetch_result(run_fetch(user_id, emulated_credentials("emulator-retry"), provider="google_tasks", window="7d", max_msgs=10))
+        assert retry["considered"] == len(result["errors"])
+        assert not retry["errors"]
+        assert len(emulator.tasks.tasks_by_id) == result["processed"] + retry["processed"]
+    finally:
+        Emulator.uninstall()
+
+
+def test_classification_cache_hits_and_invalidation():
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=0, rate_limit_rate=0.0)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-cache@example.com").id
+        payload = {"subject": "Please review the budget", "body": "Can you review the budget by Friday?", "sender": "boss@example.com"}
+
+        first = ml_decide(payload, task_categories=["Work"], user_id=user_id)
+        calls = emulator.faults.counters["calls"]
+        assert ml_decide(payload, task_categories=["Work"], user_id=user_id) == first
+        assert emulator.faults.counters["calls"] == calls
+
+        # Different categories build a different prompt
+        ml_decide(payload, task_categories=["Work", "Finance"], user_id=user_id)
+        assert emulator.faults.counters["calls"] == calls + 1
+
+        assert classification_cache.invalidate_user(user_id) == 2
+        ml_decide(payload, task_categories=["Work"], user_id=user_id)
+        assert emulator.faults.counters["calls"] == calls + 2
+    finally:
+        Emulator.uninstall()
+
+
+def test_batch_classification_and_fallback():
+    emulator = Emulator(EmulatorConfig(messages=0, rate_limit_rate=0.0)).install()
+    try:
+        payloads = [
+            {"subject": f"Please send the report #{n}", "body": "Can you send it by Friday?", "sender": "boss@example.com"}
+            for n in range(4)
+        ]
+        one_by_one = [classify_and_generate_task(p, api_key="emulator") for p in payloads]
+        calls = emulator.faults.counters["calls"]
+        assert classify_batch(payloads, api_key="emulator", max_batch=4) == one_by_one
+        assert emulator.faults.counters["calls"] == calls + 1
+
+        # A malformed batch answer falls back to one request per email
+        create = emulator.openai.chat.completions.create
+        def truncated(**kwargs):
+            response = create(**kwargs)
+            response.choices[0].message.content = response.choices[0].message.content[:40]
+            return response
+        emulator.openai.chat.completions.create = truncated
+        calls = emulator.faults.counters["calls"]
+        results = classify_batch(payloads, api_key="emulator", max_batch=4)
+        assert emulator.faults.counters["calls"] == calls + 1 + len(payloads)
+        assert all(r.get("fallback") for r in results)
+    finally:
+        Emulator.uninstall()
+
+
+def test_backfill_through_batch_api():
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=12, rate_limit_rate=0.0)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-backfill@example.com").id
+        creds = emulated_credentials("emulator-backfill")
+        workdir = Path(tempfile.mkdtemp(prefix="taskflow-backfill-"))
+
+        assert backfill.prepare(user_id, creds, workdir, window="30d")["requests"] == 12
+        assert backfill.submit(workdir)["batch_id"]
+        assert backfill.wait(workdir, interval=0)["status"] == "completed"
+        counts = backfill.apply(workdir, creds)
+        assert counts["created"] + counts["skipped"] == 12
+        assert counts["created"] == len(emulator.tasks.tasks_by_id)
+
+        # Everything is processed now, so the regular fetch has nothing left
+        result = collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", window="30d", max_msgs=12))
+        assert result["considered"] == 0
+    finally:
+        Emulator.uninstall()
+
+
+def test_async_classification_deadline_and_cancel():
+    emulator = Emulator(EmulatorConfig(messages=0, llm_latency_ms=300)).install()
+    try:
+        payloads = [{"subject": f"Please call me back #{n}", "body": "Call me today.", "sender": "a@example.com"} for n in range(6)]
+
+        async def collect(**kwargs):
+            return [pair async for pair in ml_decide_many(payloads, **kwargs)]
+
+        started = time.monotonic()
+        results = asyncio.run(collect(concurrency=6))
+        assert sorted(i for i, _ in results) == list(range(6))
+        assert not any(r.get("fallback") for _, r in results)
+        assert time.monotonic() - started < 1.5  # concurrent, not 6 x 300ms
+
+        timed_out = asyncio.run(collect(concurrency=6, timeout=0.05))
+        assert all(r.get("fallback") for _, r in timed_out)
+
+        async def first_only():
+            stream = ml_decide_many(payloads, concurrency=1)
+            first = await stream.__anext__()
+            await stream.aclose()  # cancels the calls still queued
+            return first
+
+        calls = emulator.faults.counters["calls"]
+        started = time.monotonic()
+        asyncio.run(first_only())
+        assert time.monotonic() - started < 1.0
+        assert emulator.faults.counters["calls"] - calls <= 2
+    finally:
+        Emulator.uninstall()
+
+
+def test_incremental_sync_matches_inbox_and_retries_failures():
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=3, rate_limit_rate=0.0)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-cursor@example.com").id
+        creds = emulated_credentials("emulator-cursor")
+        mailbox = emulator.mailbox("emulator-cursor")
+        assert collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks"))["considered"] == 3
+
+        # Sent mail is not in:inbox, so incremental sync must not pick it up either
+        mailbox.add_messages(1, labels=["SENT"])
+        mailbox.add_messages(2)
+        failing = mailbox.order[0]
+        get = mailbox.get
+        def flaky_get(message_id, **kw):
+            if message_id == failing:
+                raise RuntimeError("emulated fetch failure")
+            return get(message_id, **kw)
+        mailbox.get = flaky_get
+        second = collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks"))
+        assert second["sync_mode"] == "incremental" and second["total_found"] == 2
+        assert second["fetch_errors"] == 1
+
+        # The cursor stayed put, so the failed email is listed and retried
+        mailbox.get = get
+        third = collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks"))
+        assert third["sync_mode"] == "incremental" and third["considered"] == 1
+        assert not third["errors"] and not third["fetch_errors"]
+    finally:
+        Emulator.uninstall()
+
+
+def test_capped_full_sync_works_off_the_backlog_before_going_incremental():
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=45, rate_limit_rate=0.0)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-backlog@example.com").id
+        creds = emulated_credentials("emulator-backlog")
+        fetch = lambda: collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", max_msgs=20))
+
+        # Mail beyond the cap is reported as remaining, and no cursor is saved past it
+        first = fetch()
+        assert first["sync_mode"] == "full" and first["considered"] == 20 and first["remaining"] == 25
+        second = fetch()
+        assert second["sync_mode"] == "full" and second["considered"] == 20 and second["remaining"] == 5
+        third = fetch()
+        assert third["sync_mode"] == "full" and third["considered"] == 5 and third["remaining"] == 0
+
+        emulator.mailbox("emulator-backlog").add_messages(2)
+        fourth = fetch()
+        assert fourth["sync_mode"] == "incremental" and fourth["considered"] == 2
+    finally:
+        Emulator.uninstall()
+
+
+def test_stream_ends_with_an_error_record_when_the_run_fails():
+    import json
+    from server.routers.emails import stream_fetch_records
+
+    def failing_run():
+        yield {"type": "message", "message_id": "m1", "status": "created"}
+        raise RuntimeError("emulated Gmail outage")
+
+    lines = stream_fetch_records(failing_run(), "ndjson").get_data(as_text=True).splitlines()
+    assert [json.loads(line)["type"] for line in lines] == ["message", "error"]
+    assert "emulated Gmail outage" in json.loads(lines[-1])["error"]
+
+    events = stream_fetch_records(failing_run(), "sse").get_data(as_text=True)
+    assert events.split("\n\n")[1].startswith("event: error\n")
+
+
+def test_inserts_only_retry_rejected_calls():
+    from server import quota
+    from server.emulator import _http_error
+
+    class Flaky:
+        def __init__(self, *errors):
+            self.errors = list(errors)
+            self.calls = 0
+
+        def execute(self):
+            self.calls += 1
+            if self.errors:
+                raise self.errors.pop(0)
+            return {"id": "created"}
+
+    # A 429 is rejected before execution, so even an insert is replayed
+    throttled = Flaky(_http_error(429, "rateLimitExceeded", "Rate Limit Exceeded"))
+    assert quota.execute(throttled, "tasks", idempotent=False) == {"id": "created"} and throttled.calls == 2
+
+    # A 503 may come after the write, so an insert is not replayed; a read is
+    failed = Flaky(_http_error(503, "backendError", "Backend Error"))
+    try:
+        quota.execute(failed, "tasks", idempotent=False)
+        assert False, "insert was retried"
+    except Exception as e:
+        assert "503" in str(e) and failed.calls == 1
+    read = Flaky(_http_error(503, "backendError", "Backend Error"))
+    assert quota.execute(read, "tasks") == {"id": "created"} and read.calls == 2
+
+
+def test_token_bucket_charges_acquires_larger_than_its_capacity():
+    from server.quota import TokenBucket
+
+    # A 100-message Gmail batch is 500 units against a 250 units/second bucket
+    bucket = TokenBucket(rate=250)
+    assert bucket.acquire(500) >= 0.9
+    assert bucket.acquire(50) >= 0.15
+
+
+def test_jobs_orphaned_by_a_restart_are_failed():
+    from datetime import datetime, timedelta, timezone
+    from server import jobs
+    from server.db import FetchJob
+
+    init_db()
+    with db_session() as s:
+        user_id = get_or_create_user(s, "emulator-jobs@example.com").id
+        stale = FetchJob(user_id=user_id, status="running", heartbeat_at=datetime.now(timezone.utc) - timedelta(hours=1))
+        live = FetchJob(user_id=user_id, status="running", heartbeat_at=datetime.now(timezone.utc))
+        s.add_all([stale, live])
+        s.flush()
+        stale_id, live_id = stale.id, live.id
+
+    assert jobs.get_job(user_id, stale_id)["status"] == "failed"
+    assert "restart" in jobs.get_job(user_id, stale_id)["error"]
+    assert jobs.get_job(user_id, live_id)["status"] == "running"
+
+
+def test_job_progress_counts_known_mail_as_skipped_from_the_start():
+    import threading
+    from server import jobs
+
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=5, rate_limit_rate=0.0)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-job-progress@example.com").id
+        creds = emulated_credentials("emulator-job-progress")
+        collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", window="7d"))
+
+        mailbox = emulator.mailbox("emulator-job-progress")
+        mailbox.add_messages(3)
+        release = threading.Event()
+        get = mailbox.get
+        def blocked_get(message_id, **kw):
+            release.wait(10)
+            return get(message_id, **kw)
+        mailbox.get = blocked_get
+
+        job_id = jobs.enqueue_fetch_job(user_id, creds, {"provider": "google_tasks", "window": "7d", "sync": "full"})
+        deadline = time.monotonic() + 10
+        while jobs.get_job(user_id, job_id)["skipped"] < 5 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        running = jobs.get_job(user_id, job_id)
+        assert running["status"] == "running" and running["skipped"] == 5 and running["considered"] == 0
+
+        release.set()
+        while jobs.get_job(user_id, job_id)["status"] == "running" and time.monotonic() < deadline:
+            time.sleep(0.05)
+        done = jobs.get_job(user_id, job_id)
+        assert done["status"] == "completed" and done["considered"] == 3
+        assert done["skipped"] == 5 + done["considered"] - done["created"] - done["errors"]
+    finally:
+        Emulator.uninstall()
+
+
+def test_local_classifier_short_circuits_confident_skips(monkeypatch):
+    # Triage would reject the bulk mail before the LLM labels it
+    monkeypatch.setattr(pipeline, "TRIAGE_RULES", "")
+    monkeypatch.setattr(local_classifier, "LOCAL_CLASSIFIER_SKIP_CONFIDENCE", 0.98)
+    init_db()
+    emulator = Emulator(EmulatorConfig(messages=60, rate_limit_rate=0.0)).install()
+    try:
+        with db_session() as s:
+            user_id = get_or_create_user(s, "emulator-local@example.com").id
+        creds = emulated_credentials("emulator-local")
+        collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", window="30d", max_msgs=60))
+
+        [report] = local_classifier.retrain(user_id, holdout=0.25, min_examples=20)
+        assert report["status"] == "trained"
+        assert report["metrics"]["llm_call_reduction"] > 0
+        assert report["metrics"]["agreement"] == 1.0
+
+        newsletter = {"subject": "Weekly newsletter #999", "body": "Top stories this week in tech. Read more on our website.", "sender": "news@techblog.com"}
+        calls = emulator.faults.counters["calls"]
+        result = ml_decide(newsletter, user_id=user_id)
+        assert result["source"] == "local" and not result["should_create"]
+        assert emulator.faults.counters["calls"] == calls
+
+        # An invite from a sender whose mail is always skipped still reaches the LLM, which extracts the meeting
+        promo = {"subject": "50% OFF everything - deal #998", "body": "Limited time only! Shop now and save big.", "sender": "deals@shopping.com"}
+        assert ml_decide(promo, user_id=user_id)["source"] == "local"
+        invite = {"subject": "Limited time only: you're invited to our VIP event", "body": "Limited time only! Save big at the VIP event.\nWhen: Thursday 2pm", "sender": "deals@shopping.com"}
+        answer = ml_decide(invite, user_id=user_id)
+        assert "source" not in answer and answer["meeting"]
+        assert emulator.faults.counters["calls"] > calls  # two calls when the tier-one model escalates the invite
+        calls = emulator.faults.counters["calls"]
+
+        # Mail the model is unsure about still goes to the LLM
+        request = {"subject": "Can you sign the lease renewal?", "body": "The landlord needs it back by Monday.", "sender": "friend@example.org"}
+        assert "source" not in ml_decide(request, user_id=user_id)
+        assert emulator.faults.counters["calls"] == calls + 1
+
+        # Emails the local model decided are not fed back into its training data
+        examples = len(local_classifier.load_examples(user_id))
+        emulator.mailbox("emulator-local").add_messages(20)
+        fetched = collect_fetch_result(run_fetch(user_id, creds, provider="google_tasks", window="30d", max_msgs=60))
+        assert fetched["classified_by"].get("local")
+        labelled = sum(n for decider, n in fetched["classified_by"].items() if decider in local_classifier.TRAINING_DECIDERS)
+        assert len(local_classifier.load_examples(user_id)) == examples + labelled
+    finally:
+        Emulator.uninstall()
+
+
+def test_two_tier_classification_escalates(monkeypatch, openai_requests):
+    monkeypatch.setattr(ml, "CLASSIFY_TIER1_MODEL", "tier-one")
+    monkeypatch.setattr(ml, "CLASSIFY_TIER2_MODEL", "tier-two")
+    monkeypatch.setattr(ml, "CLASSIFY_TIER1_MIN_CONFIDENCE", 0.88)
+    _, requests = openai_requests
+    prompts = lambda: [(r["model"], r["messages"][-1]["content"]) for r in requests]
+
+    action = {"subject": "Please send the report", "snippet": "Can you send it by Friday?", "body": "Full body: the Q3 numbers are attached.", "sender": "boss@example.com"}
+    result = ml_decide(action)
+    assert (result["tier"], result["tier_model"]) == (1, "tier-one")
+    assert [model for model, _ in prompts()] == ["tier-one"]
+    assert "Can you send it by Friday?" in prompts()[0][1] and "Full body" not in prompts()[0][1]
+
+    # The emulated model is less sure about promotions (0.85) and flags meetings
+    requests.clear()
+    promo = {"subject": "50% OFF everything", "snippet": "Shop now", "body": "Shop now and save big.", "sender": "deals@shopping.com"}
+    meeting = {"subject": "Project sync invite", "snippet": "Join us", "body": "Agenda attached.", "sender": "manager@company.com"}
+    assert [(r["tier"], r.get("escalation")) for r in ml_decide_batch([action, promo, meeting])] == [
+        (1, None), (2, "low_confidence"), (2, "meeting"),
+    ]
+    models = [model for model, _ in prompts()]
+    escalated_from = models.index("tier-two")
+    assert set(models[:escalated_from]) == {"tier-one"} and set(models[escalated_from:]) == {"tier-two"}
+    assert "Full body" not in "".join(prompt for _, prompt in prompts())
+    assert "Shop now and save big." in "".join(prompt for model, prompt in prompts() if model == "tier-two")
+
+
+def test_prompt_prefix_is_cached_and_body_is_token_budgeted(openai_requests):
+    _, requests = openai_requests
+    categories = [f"{name}: requests, follow-ups, approvals and deadlines about {name.lower()}" for name in
+                  ("Work", "Finance", "Personal", "Travel", "Health", "Home", "Legal", "Hiring")]
+
+    before = ml.usage_stats()
+    for n in range(3):
+        classify_and_generate_task(
+            {"subject": f"Quarterly report #{n}", "body": f"Please review section {n}. " * 2000, "sender": "boss@example.com"},
+            api_key="emulator", task_categories=categories,
+        )
+    assert all(r["messages"][-1]["content"].startswith(ml.PROMPT_PREFIX) for r in requests)
+    assert ml.usage_stats()["cached_tokens"] > before["cached_tokens"]
+
+    body = ml.prepare_email_content({"body": "Please review the attached contract. " * 2000})["body"]
+    assert body.endswith("...")
+    assert ml.estimate_tokens(body[:-3]) <= ml.body_token_budget()
+
+
+def test_answers_follow_the_compact_schema(openai_requests):
+    emulator, requests = openai_requests
+    task = classify_and_generate_task({"subject": "Send the contract", "body": "Please sign it.", "sender": "a@example.com"}, api_key="emulator")
+    meeting = classify_and_generate_task({"subject": "Planning meeting", "body": "Agenda attached.", "sender": "a@example.com"}, api_key="emulator")
+    assert task["meeting"] is None and "fallback" not in task
+    assert meeting["meeting"]["is_meeting"] and meeting["meeting"]["start_datetime"]
+    assert requests[0]["response_format"]["type"] == ("json_schema" if ml.CLASSIFY_STRUCTURED_OUTPUTS else "json_object")
+    assert requests[0]["max_tokens"] == ml.answer_max_tokens(ml.classification_schema())
+    assert ('"reasoning":' in requests[0]["messages"][-1]["content"]) == ml.CLASSIFY_REASONING
+
+    create = emulator.openai.chat.completions.create
+    def incomplete(**kwargs):
+        response = create(**kwargs)
+        response.choices[0].message.content = '{"should_create": true, "confidence": "high"}'
+        return response
+    emulator.openai.chat.completions.create = incomplete
+    result = classify_and_generate_task({"subject": "Send the contract", "body": "Please sign it."}, api_key="emulator")
+    assert result["fallback"] and "schema" in result["reasoning"]
+
+
+def test_long_meeting_answer_fits_max_tokens(monkeypatch, openai_requests):
+    from server import emulator as emulator_module
+    fake_classification = emulator_module.fake_classification
+
+    def long_meeting(prompt, reasoning=False):
+        answer = fake_classification(prompt, reasoning)
+        answer["notes"] = "Quarterly planning with every regional team, agenda and dial-in details attached. " * 4
+        answer["meeting"] = {
+            "summary": "Quarterly planning offsite with all regional engineering and product leads",
+            "location": "Conference Center Hall B, 1200 Example Parkway, Springfield; dial-in https://meet.example.com/q3-planning-offsite",
+            "start_datetime": "2030-01-03T14:00:00Z",
+            "end_datetime": "2030-01-03T18:00:00Z",
+            "participants": [f"regional.lead{n:02d}@engineering.example.com" for n in range(ml.MEETING_PARTICIPANTS)],
+            "category": None,
+        }
+        return answer
+
+    monkeypatch.setattr(emulator_module, "fake_classification", long_meeting)
+    _, requests = openai_requests
+    result = classify_and_generate_task({"subject": "Planning meeting", "body": "Agenda attached.", "sender": "a@example.com"}, api_key="emulator")
+    assert "fallback" not in result
+    assert len(result["meeting"]["participants"]) == ml.MEETING_PARTICIPANTS
+    assert requests[-1]["max_tokens"] >= ml.MIN_ANSWER_TOKENS
+
+
+def test_parse_timeout_recycles_the_pool(monkeypatch):
+    from server import parse_pool
+    from server.emulator import SyntheticMailbox
+
+    monkeypatch.setattr(parse_pool, "PARSE_PROCESSES", 1)
+    mailbox = SyntheticMailbox(EmulatorConfig(messages=1))
+    message = mailbox.get(mailbox.order[0])
+    try:
+        assert parse_pool.parse_message(message, timeout=30).subject
+        pool = parse_pool._pool
+        workers = list(pool._processes.values())
+        with pytest.raises(parse_pool.ParseTimeoutError):
+            parse_pool.parse_message(message, timeout=0.0)
+        # The timed-out task can't be cancelled, so its worker is terminated and a fresh pool takes over
+        assert parse_pool._pool is None
+        for worker in workers:
+            worker.join(5)
+            assert not worker.is_alive()
+        assert parse_pool.parse_message(message, timeout=30).subject
+        assert parse_pool._pool is not pool
+    finally:
+        parse_pool._reset_pool()
+
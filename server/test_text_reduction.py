@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+"""
+Golden-file tests for server/text_reduction.py.
+Each testdata/text_reduction/NAME.txt is reduced and compared with NAME.expected.txt.
+Usage: python3 -m pytest server/test_text_reduction.py
+"""
+
+from pathlib import Path
+from server import text_reduction
+from server.text_reduction import reduce_payload, reduce_text
+
+CORPUS = Path(__file__).parent / "testdata" / "text_reduction"
+
+
+def test_golden_corpus():
+    inputs = sorted(p for p in CORPUS.glob("*.txt") if not p.name.endswith(".expected.txt"))
+    assert inputs
+    for path in inputs:
+        expected = path.with_name(path.stem + ".expected.txt").read_text(encoding="utf-8")
+        assert reduce_text(path.read_text(encoding="utf-8")) + "\n" == expected, path.name
+
+
+def test_rule_stats_and_forwards():
+    before = text_reduction.reduction_stats()
+    reply = (CORPUS / "outlook_reply.txt").read_text(encoding="utf-8")
+    assert reduce_payload({"subject": "RE: Vendor contract", "body": reply})["body"].endswith("comments by Friday.")
+    after = text_reduction.reduction_stats()
+    assert after["emails"] == before["emails"] + 1
+    for rule in ("outlook_separator", "signature"):
+        assert after["rules"][rule]["hits"] == before["rules"][rule]["hits"] + 1
+    assert after["rules"]["disclaimer"]["hits"] == before["rules"]["disclaimer"]["hits"]
+
+    # A forward keeps the thread it forwards
+    assert "From: Jon Baker" in reduce_payload({"subject": "Fwd: Vendor contract", "body": reply})["body"]
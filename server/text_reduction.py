@@ -0,0 +1,243 @@
+"""
+Text reduction ahead of classification.
+
+Reply threads carry the whole quoted history, plus signatures and legal
+footers, and all of it counts against the body's token budget. Each rule
+below removes one kind of noise from a plain-text body. ml_decide runs the
+TEXT_REDUCTION_RULES rules on every email before classification and cache
+lookup. Stored bodies are left untouched.
+
+Usage:
+    python -m server.text_reduction FILE...      # print each file reduced, then per-rule stats
+"""
+
+from __future__ import annotations
+import argparse
+import json
+import re
+import threading
+from typing import Any, Callable, Dict, Iterable
+from server.html_text import html_to_text
+
+ReductionRule = Callable[[list[str]], list[str]]
+
+# "On <date>, <name> wrote:" in the languages we see most; the attribution may wrap onto a second line
+_REPLY_HEADER = re.compile(
+    r"^\s*(On\s.{1,200}\swrote|Le\s.{1,200}\sa\s[ée]crit|Am\s.{1,200}\sschrieb|El\s.{1,200}\sescribi[óo])\s?:\s*$",
+    re.I,
+)
+_OUTLOOK_SEPARATOR = re.compile(r"^\s*-{2,}\s*Original Message\s*-{2,}\s*$|^\s*_{10,}\s*$", re.I)
+_FORWARD_MARKER = re.compile(r"forwarded message|^\s*begin forwarded", re.I)
+_FORWARD_SUBJECT = re.compile(r"^\s*(fwd?|fw|wg|tr)\s*:", re.I)
+_OUTLOOK_HEADER = re.compile(r"^\s*\*?(From|Von|De)\s*:\*?\s", re.I)
+_OUTLOOK_FIELDS = re.compile(r"^\s*\*?(Sent|Date|To|Subject|Gesendet|An|Betreff|Envoy[ée]|[ÀA]|Objet)\s*:", re.I)
+_QUOTED = re.compile(r"^\s*>")
+_SIGNATURE_DELIMITER = re.compile(r"^-- ?$")
+_MOBILE_SIGNATURE = re.compile(
+    r"^\s*(Sent from my \w+|Sent from (Mail|Outlook) for \w+|Get Outlook for (iOS|Android)|Sent from Yahoo Mail)\b.*$", re.I,
+)
+_VALEDICTION = re.compile(
+    r"^\s*(best|best regards|kind regards|warm regards|regards|many thanks|thanks|thank you|cheers|sincerely|br)\s*[,!.]?\s*$", re.I,
+)
+_DISCLAIMER = re.compile(
+    r"(this (e-?mail|message|communication)( and any (files|attachments)[^.]*)? (is|are|may be) (strictly )?(confidential|privileged|intended)"
+    r"|if you (have received|received|are not the intended recipient)"
+    r"|intended (solely|only) for the (use of the )?(individual|addressee|person|named recipient)"
+    r"|please consider the environment before printing"
+    r"|unauthori[sz]ed (use|disclosure|copying|distribution))",
+    re.I,
+)
+
+# Signs that a line is part of the message rather than a name, title or contact block
+_PROSE_END = re.compile(r"[.!;]\s*$")
+_ABBREVIATION = re.compile(r"\b[A-Z][A-Za-z]{0,3}\.\s*$")  # "Inc.", "Ltd.", "Jr." end titles, not sentences
+_FORM_FIELD = re.compile(r":\s*$")
+_DATE_OR_TIME = re.compile(
+    r"\b(mon|tues|wednes|thurs|fri|satur|sun)day\b|\b(today|tomorrow|tonight|eod|asap)\b"
+    r"|\b\d{1,2}(:\d{2})?\s?(am|pm)\b|\b\d{1,2}:\d{2}\b|\b\d{1,2}/\d{1,2}(/\d{2,4})?\b"
+    r"|\b(jan|feb|mar|apr|may|jun|jul|aug|sep|sept|oct|nov|dec)[a-z]*\.?\s+\d{1,2}\b",
+    re.I,
+)
+
+# A signature is short; anything longer is probably the message itself
+SIGNATURE_MAX_LINES = 6
+
+
+def _strip_reply_header(lines: list[str]) -> list[str]:
+    """Drop "On ... wrote:" and the quote below it; with no '>' markers (HTML mail) the rest of the text is the quote."""
+    for i, line in enumerate(lines):
+        header_end = None
+        if _REPLY_HEADER.match(line):
+            header_end = i + 1
+        elif i + 1 < len(lines) and line.strip() and _REPLY_HEADER.match(line.rstrip() + " " + lines[i + 1].strip()):
+            header_end = i + 2
+        if header_end is None:
+            continue
+        rest = lines[header_end:]
+        quoted = next((j for j, text in enumerate(rest) if text.strip()), None)
+        if quoted is None or not _QUOTED.match(rest[quoted]):
+            return lines[:i]
+        end = quoted
+        while end < len(rest) and (_QUOTED.match(rest[end]) or not rest[end].strip()):
+            end += 1
+        # Bottom-posted reply: keep whatever follows the quote
+        return lines[:i] + _strip_reply_header(rest[end:])
+    return lines
+
+
+def _strip_outlook_separator(lines: list[str]) -> list[str]:
+    """Cut at "-----Original Message-----", or at a From:/Sent:/To:/Subject: header block (Outlook's reply header)."""
+    for i, line in enumerate(lines):
+        if _OUTLOOK_SEPARATOR.match(line):
+            following = [text for text in lines[i + 1:i + 4] if text.strip()]
+            if "original message" in line.lower() or (following and _OUTLOOK_HEADER.match(following[0])):
+                return lines[:i]
+        if _OUTLOOK_HEADER.match(line) and sum(1 for text in lines[i + 1:i + 5] if _OUTLOOK_FIELDS.match(text)) >= 2:
+            previous = next((text for text in reversed(lines[max(0, i - 3):i]) if text.strip()), "")
+            if not _FORWARD_MARKER.search(previous):
+                return lines[:i]
+    return lines
+
+
+def _strip_quoted_lines(lines: list[str]) -> list[str]:
+    return [line for line in lines if not _QUOTED.match(line)]
+
+
+def _strip_disclaimer(lines: list[str]) -> list[str]:
+    """Drop paragraphs that read like confidentiality notices."""
+    kept: list[str] = []
+    paragraph: list[str] = []
+    for line in lines + [""]:
+        if line.strip():
+            paragraph.append(line)
+            continue
+        if paragraph and not _DISCLAIMER.search(" ".join(paragraph)):
+            kept.extend(paragraph)
+        paragraph = []
+        kept.append(line)
+    return kept[:-1]
+
+
+def _looks_like_signature(tail: list[str]) -> bool:
+    """
+    True if tail reads like a name, title or contact block: a few short lines with
+    no question, no sentence (an ending '.', '!' or ';' after more than three words),
+    no empty form field and no date or time.
+    """
+    lines = [text.strip() for text in tail if text.strip()]
+    if len(lines) > SIGNATURE_MAX_LINES:
+        return False
+    for text in lines:
+        if len(text) >= 80 or "?" in text or _FORM_FIELD.search(text) or _DATE_OR_TIME.search(text):
+            return False
+        if _PROSE_END.search(text) and not _ABBREVIATION.search(text) and len(text.split()) > 3:
+            return False
+    return True
+
+
+def _strip_signature(lines: list[str]) -> list[str]:
+    """
+    Cut at the "-- " delimiter or a mobile signature, or at a closing valediction,
+    when what follows looks like a signature (see _looks_like_signature).
+    """
+    for i, line in enumerate(lines):
+        if (_SIGNATURE_DELIMITER.match(line) or _MOBILE_SIGNATURE.match(line)) and _looks_like_signature(lines[i + 1:]):
+            return lines[:i]
+    for i in range(len(lines) - 1, max(-1, len(lines) - SIGNATURE_MAX_LINES - 2), -1):
+        if _VALEDICTION.match(lines[i]):
+            if _looks_like_signature(lines[i + 1:]):
+                return lines[:i]
+            break
+    return lines
+
+
+RULES: Dict[str, ReductionRule] = {
+    "reply_header": _strip_reply_header,
+    "outlook_separator": _strip_outlook_separator,
+    "quoted_lines": _strip_quoted_lines,
+    "disclaimer": _strip_disclaimer,
+    "signature": _strip_signature,
+}
+
+DEFAULT_RULES = list(RULES)
+
+# Rules that remove earlier messages of a thread; a forward's earlier messages are the point, so they are kept
+THREAD_RULES = {"reply_header", "outlook_separator", "quoted_lines"}
+
+_lock = threading.Lock()
+_counters: Dict[str, Dict[str, int]] = {name: {"hits": 0, "chars_removed": 0} for name in RULES}
+_totals = {"emails": 0, "chars_in": 0, "chars_out": 0}
+
+
+def parse_rules(spec: str | None) -> list[str]:
+    """
+    Parse a comma-separated rule list (e.g. the TEXT_REDUCTION_RULES env var).
+    None means the defaults; "" or "none" disables reduction. Unknown names are ignored.
+    """
+    if spec is None:
+        return list(DEFAULT_RULES)
+    names = [name.strip().lower() for name in spec.split(",")]
+    return [name for name in names if name in RULES]
+
+
+def reduce_text(text: str, rules: Iterable[str] = DEFAULT_RULES, record: bool = True) -> str:
+    """Apply rules in order to a plain-text body; with record, their effect is added to reduction_stats."""
+    if not text:
+        return text
+    lines = text.replace("\r\n", "\n").split("\n")
+    removed: Dict[str, int] = {}
+    size = sum(len(line) + 1 for line in lines)
+    for name in rules:
+        lines = RULES[name](lines)
+        new_size = sum(len(line) + 1 for line in lines)
+        if new_size < size:
+            removed[name] = size - new_size
+        size = new_size
+    reduced = re.sub(r"\n{3,}", "\n\n", "\n".join(line.rstrip() for line in lines)).strip()
+    if record:
+        with _lock:
+            _totals["emails"] += 1
+            _totals["chars_in"] += len(text)
+            _totals["chars_out"] += len(reduced)
+            for name, chars in removed.items():
+                _counters[name]["hits"] += 1
+                _counters[name]["chars_removed"] += chars
+    return reduced
+
+
+def reduce_payload(payload: Dict[str, Any], rules: Iterable[str] = DEFAULT_RULES, record: bool = True) -> Dict[str, Any]:
+    """The subject, sender and snippet of payload with its body reduced (an HTML-only body is converted to text first)."""
+    body = payload.get("body") or ""
+    if not body and payload.get("html"):
+        body = html_to_text(payload["html"])
+    if _FORWARD_SUBJECT.match(payload.get("subject") or ""):
+        rules = [name for name in rules if name not in THREAD_RULES]
+    reduced = {key: payload.get(key) for key in ("subject", "sender", "snippet") if payload.get(key) is not None}
+    reduced["body"] = reduce_text(body, rules, record)
+    return reduced
+
+
+def reduction_stats() -> Dict[str, Any]:
+    """Emails reduced, characters in and out, and per rule how many emails it changed and how much it removed."""
+    with _lock:
+        stats: Dict[str, Any] = dict(_totals)
+        stats["rules"] = {name: dict(counts) for name, counts in _counters.items()}
+    stats["reduction"] = round(1 - stats["chars_out"] / stats["chars_in"], 3) if stats["chars_in"] else 0.0
+    return stats
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Show what text reduction removes from plain-text email bodies.")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("--rules", help="comma-separated rules (default: all)")
+    args = parser.parse_args(argv)
+
+    rules = parse_rules(args.rules)
+    for path in args.files:
+        with open(path, encoding="utf-8") as f:
+            print(f"==> {path}\n{reduce_text(f.read(), rules)}\n")
+    print(json.dumps(reduction_stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Header- and label-based triage.
+Rejects obvious bulk mail from a format="metadata" fetch, before the full
+message download and the classifier call.
+"""
+
+from __future__ import annotations
+from typing import Callable, Dict, Iterable, Optional
+
+# Headers requested in the metadata fetch (Subject/From let us store the skipped email)
+TRIAGE_HEADERS = ["Subject", "From", "List-Unsubscribe", "List-Id", "Precedence", "Auto-Submitted"]
+
+TriageRule = Callable[[Dict[str, str], set], bool]
+
+# Each rule sees lower-cased header names -> values and the message's Gmail labels
+RULES: Dict[str, TriageRule] = {
+    "list_unsubscribe": lambda headers, labels: "list-unsubscribe" in headers,
+    "precedence_bulk": lambda headers, labels: headers.get("precedence", "").strip().lower() in ("bulk", "list", "junk"),
+    "auto_submitted": lambda headers, labels: headers.get("auto-submitted", "no").strip().lower() not in ("", "no"),
+    "category_promotions": lambda headers, labels: "CATEGORY_PROMOTIONS" in labels,
+    "category_social": lambda headers, labels: "CATEGORY_SOCIAL" in labels,
+    "category_updates": lambda headers, labels: "CATEGORY_UPDATES" in labels,
+    "category_forums": lambda headers, labels: "CATEGORY_FORUMS" in labels,
+}
+
+DEFAULT_RULES = ["list_unsubscribe", "precedence_bulk", "auto_submitted", "category_promotions", "category_social"]
+
+
+def parse_rules(spec: str | None) -> list[str]:
+    """
+    Parse a comma-separated rule list (e.g. the TRIAGE_RULES env var).
+    None means the defaults; "" or "none" disables triage. Unknown names are ignored.
+    """
+    if spec is None:
+        return list(DEFAULT_RULES)
+    names = [name.strip().lower() for name in spec.split(",")]
+    return [name for name in names if name in RULES]
+
+
+def triage_message(message: dict, rules: Iterable[str]) -> Optional[str]:
+    """Return the name of the first rule rejecting this metadata message, or None to keep it."""
+    headers = {
+        h.get("name", "").lower(): h.get("value", "")
+        for h in message.get("payload", {}).get("headers", [])
+    }
+    labels = set(message.get("labelIds", []))
+    for name in rules:
+        if RULES[name](headers, labels):
+            return name
+    return None
@@ -1,17 +1,16 @@
 from __future__ import annotations
-import base64
+import threading
 from datetime import datetime, timezone, timedelta
-from typing import Tuple
 from functools import wraps
 from flask import session, request, jsonify
 import jwt
 from server.config import FLASK_SECRET
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
-from bs4 import BeautifulSoup
 from dateutil import parser as dateutil_parser
 from sqlalchemy import select
-from server.db import db_session, User
+from server.db import db_session, User, StoredCredential, Email
+from server.mime import header_index, get_header, decode_part_text, gather_bodies, html_to_text, message_to_payload
 
 # SCOPES: Gmail read-only + Google Tasks write
 SCOPES = [
@@ -74,23 +73,78 @@ def _get_credentials():
         return None
     return Credentials.from_authorized_user_info(info=creds_info, scopes=SCOPES)
 
+def get_credentials():
+    """Return the session's Google credentials, e.g. to build services off the request thread."""
+    return _get_credentials()
+
+def store_credentials(user_id: int, creds_info: dict):
+    """Save (or replace) a user's credentials for background polling."""
+    with db_session() as s:
+        stored = s.execute(select(StoredCredential).where(StoredCredential.user_id == user_id)).scalar_one_or_none()
+        if stored:
+            # Google omits the refresh token on some re-consents; keep the one we have
+            if not creds_info.get("refresh_token"):
+                creds_info = {**creds_info, "refresh_token": stored.info.get("refresh_token")}
+            stored.info = creds_info
+            stored.last_error = None
+        else:
+            s.add(StoredCredential(user_id=user_id, info=creds_info))
+
+def load_stored_credentials(user_id: int) -> Credentials | None:
+    with db_session() as s:
+        stored = s.execute(select(StoredCredential).where(StoredCredential.user_id == user_id)).scalar_one_or_none()
+        if not stored or stored.last_error:
+            return None
+        return Credentials.from_authorized_user_info(info=stored.info, scopes=SCOPES)
+
+_thread_local = threading.local()
+
+# Replaces googleapiclient's build() when set (see server/emulator.py)
+_service_factory = None
+
+def set_service_factory(factory):
+    """Route every Google service construction through factory(name, version, creds); None restores build()."""
+    global _service_factory
+    _service_factory = factory
+    _thread_local.services = {}
+
+def build_service(name: str, version: str, creds: Credentials, **kwargs):
+    if _service_factory is not None:
+        return _service_factory(name, version, creds)
+    return build(name, version, credentials=creds, **kwargs)
+
+def get_thread_service(name: str, version: str, creds: Credentials):
+    """
+    Return a Google API service private to the calling thread.
+    httplib2 transports are not thread-safe, so pipeline workers never share one.
+    """
+    services = getattr(_thread_local, "services", None)
+    if services is None:
+        services = _thread_local.services = {}
+    cached = services.get((name, version))
+    if cached and cached[0] is creds:
+        return cached[1]
+    service = build_service(name, version, creds, cache_discovery=False)
+    services[(name, version)] = (creds, service)
+    return service
+
 def get_gmail_service():
     creds = _get_credentials()
     if not creds:
         return None
-    return build("gmail", "v1", credentials=creds)
+    return build_service("gmail", "v1", creds)
 
 def get_tasks_service():
     creds = _get_credentials()
     if not creds:
         return None
-    return build("tasks", "v1", credentials=creds)
+    return build_service("tasks", "v1", creds)
 
 def get_calendar_service():
     creds = _get_credentials()
     if not creds:
         return None
-    return build("calendar", "v3", credentials=creds)
+    return build_service("calendar", "v3", creds)
 
 def get_or_create_user(session, email: str) -> User:
     """Get or create a user by email address."""
@@ -107,6 +161,13 @@ def get_or_create_user(session, email: str) -> User:
     session.flush()
     return user
 
+def mark_user_decided(session, email_id: int | None):
+    """Record that the user confirmed or removed what an email produced, making it a training label."""
+    email_row = session.get(Email, email_id) if email_id else None
+    if email_row:
+        email_row.decided_by = "user"
+
+
 def get_current_user() -> User | None:
     """Get the current authenticated user from JWT."""
     if not hasattr(request, 'user_email'):
@@ -118,85 +179,3 @@ def get_current_user() -> User | None:
         _ = user.id
         s.expunge(user)
         return user
-
-def get_header(payload: dict, name: str) -> str | None:
-    for header in payload.get("headers", []):
-        if header.get("name", "").lower() == name.lower():
-            return header.get("value")
-    return None
-
-def decode_part_text(part: dict) -> str:
-    body = part.get("body", {})
-    data = body.get("data")
-    if not data:
-        return ""
-    raw = base64.urlsafe_b64decode(data.encode("utf-8"))
-    charset = "utf-8"
-    for header in part.get("headers", []):
-        if header.get("name", "").lower() == "content-type":
-            value = header.get("value", "")
-            lower = value.lower()
-            if "charset=" in lower:
-                charset = lower.split("charset=", 1)[1]
-                if ";" in charset:
-                    charset = charset.split(";", 1)[0]
-                charset = charset.strip().strip('"').strip("'")
-                break
-    try:
-        return raw.decode(charset, errors="replace")
-    except Exception:
-        return raw.decode("utf-8", errors="replace")
-
-def gather_bodies(payload: dict) -> Tuple[str, str]:
-    texts: list[str] = []
-    htmls: list[str] = []
-
-    def walk(part: dict):
-        mime = (part.get("mimeType") or "").lower()
-        if part.get("parts"):
-            for child in part["parts"]:
-                walk(child)
-            return
-        if mime.startswith("text/plain"):
-            texts.append(decode_part_text(part))
-        elif mime.startswith("text/html"):
-            htmls.append(decode_part_text(part))
-
-    if payload:
-        walk(payload)
-
-    text = next((t for t in texts if t.strip()), "")
-    html = next((h for h in htmls if h.strip()), "")
-    return text, html
-
-def html_to_text(html: str) -> str:
-    if not html:
-        return ""
-    soup = BeautifulSoup(html, "lxml")
-    for br in soup.find_all("br"):
-        br.replace_with("\n")
-    return soup.get_text("\n").strip()
-
-def message_to_payload(message: dict) -> dict:
-    payload = message.get("payload", {})
-    text_body, html_body = gather_bodies(payload)
-    body = text_body or html_to_text(html_body)
-
-    internal = message.get("internalDate")
-    received_at = None
-    if internal:
-        try:
-            received_at = datetime.fromtimestamp(int(internal) / 1000, tz=timezone.utc).isoformat()
-        except Exception:
-            received_at = None
-
-    return {
-        "subject": get_header(payload, "Subject") or "(No subject)",
-        "sender": get_header(payload, "From") or "",
-        "received_at": received_at,
-        "body": body.strip(),
-        "html": html_body, 
-        "snippet": message.get("snippet", ""),
-        "thread_id": message.get("threadId", ""),
-    }
-